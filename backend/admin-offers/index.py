@@ -4,8 +4,10 @@ import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-from datetime import datetime, timedelta
 from decimal import Decimal
+from rate_limiter import RateLimiter
+
+rate_limiter = RateLimiter(persist=True)
 
 
 def decimal_to_float(obj):
@@ -18,45 +20,6 @@ def decimal_to_float(obj):
         return [decimal_to_float(item) for item in obj]
     return obj
 
-def check_rate_limit(conn, identifier: str, endpoint: str, max_requests: int = 30, window_minutes: int = 1) -> bool:
-    with conn.cursor() as cur:
-        window_start = datetime.now() - timedelta(minutes=window_minutes)
-        
-        cur.execute(
-            """SELECT request_count, window_start 
-               FROM rate_limits 
-               WHERE identifier = %s AND endpoint = %s""",
-            (identifier, endpoint)
-        )
-        result = cur.fetchone()
-        
-        if result:
-            if result['window_start'] > window_start:
-                if result['request_count'] >= max_requests:
-                    return False
-                cur.execute(
-                    """UPDATE rate_limits 
-                       SET request_count = request_count + 1 
-                       WHERE identifier = %s AND endpoint = %s""",
-                    (identifier, endpoint)
-                )
-            else:
-                cur.execute(
-                    """UPDATE rate_limits 
-                       SET request_count = 1, window_start = CURRENT_TIMESTAMP 
-                       WHERE identifier = %s AND endpoint = %s""",
-                    (identifier, endpoint)
-                )
-        else:
-            cur.execute(
-                """INSERT INTO rate_limits (identifier, endpoint, request_count, window_start) 
-                   VALUES (%s, %s, 1, CURRENT_TIMESTAMP)""",
-                (identifier, endpoint)
-            )
-        
-        conn.commit()
-        return True
-
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Бэкенд для управления предложениями в админ-панели
@@ -95,7 +58,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         headers = event.get('headers', {})
         user_id = headers.get('X-User-Id') or headers.get('x-user-id', 'anonymous')
         
-        if not check_rate_limit(conn, user_id, 'admin_offers', max_requests=30, window_minutes=1):
+        allowed, _ = rate_limiter.check_rate_limit(user_id, max_requests=30, window_seconds=60, endpoint='admin_offers')
+        rate_limiter.flush_if_due(conn)
+        if not allowed:
             return {
                 'statusCode': 429,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
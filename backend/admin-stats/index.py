@@ -1,14 +1,30 @@
 import json
 import os
+from datetime import date, timedelta
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from stats_snapshot import (
+    REFRESH_INTERVAL_SECONDS, compute_stats, read_history, read_snapshot, refresh_snapshot
+)
+from stats_rollup import BUCKETS, read_series, run_rollup
+
+HISTORY_MAX_DAYS = 90
+SERIES_DEFAULT_DAYS = 90
+SERIES_MAX_DAYS = 3 * 366
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Получение статистики для админ-панели
     Возвращает количество активных пользователей, предложений, запросов и других сущностей
+    из снимка admin_stats_snapshot (refreshedAt — время подсчёта)
+    GET /?refresh=1 — пересчитать снимок сейчас
+    GET /?action=history&days=30 — почасовая история счётчиков для графиков
+    GET /?action=series&from=2026-01-01&to=2026-03-31&bucket=day|week|month —
+        ряды из дневных агрегатов (регистрации, предложения, запросы,
+        завершённые заказы и оборот по категориям, проверки верификации)
+    GET /?action=rollup — догнать дневные агрегаты до текущего момента
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -42,129 +58,75 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    params = event.get('queryStringParameters') or {}
+
     conn = None
     try:
         conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
-        cur = conn.cursor()
-        
-        # Общее количество пользователей
-        cur.execute("SELECT COUNT(*) as total FROM t_p42562714_web_app_creation_1.users WHERE removed_at IS NULL")
-        total_users = cur.fetchone()['total']
-        
-        # Активные пользователи (не заблокированные)
-        cur.execute("""
-            SELECT COUNT(*) as active 
-            FROM t_p42562714_web_app_creation_1.users 
-            WHERE removed_at IS NULL 
-            AND is_active = true 
-            AND (locked_until IS NULL OR locked_until < NOW())
-        """)
-        active_users = cur.fetchone()['active']
-        
-        # Верифицированные пользователи
-        cur.execute("""
-            SELECT COUNT(DISTINCT user_id) as verified 
-            FROM t_p42562714_web_app_creation_1.user_verifications 
-            WHERE status = 'approved'
-        """)
-        verified_users = cur.fetchone()['verified']
-        
-        # Активные предложения
-        cur.execute("""
-            SELECT COUNT(*) as total 
-            FROM t_p42562714_web_app_creation_1.offers 
-            WHERE status = 'active'
-        """)
-        active_offers = cur.fetchone()['total']
-        
-        # Активные запросы
-        cur.execute("""
-            SELECT COUNT(*) as total 
-            FROM t_p42562714_web_app_creation_1.requests 
-            WHERE status = 'active'
-        """)
-        active_requests = cur.fetchone()['total']
-        
-        # Активные аукционы
-        cur.execute("""
-            SELECT COUNT(*) as total 
-            FROM t_p42562714_web_app_creation_1.auctions 
-            WHERE status = 'active'
-        """)
-        active_auctions = cur.fetchone()['total']
-        
-        # Завершенные заказы
-        cur.execute("""
-            SELECT COUNT(*) as total 
-            FROM t_p42562714_web_app_creation_1.orders 
-            WHERE status = 'completed'
-        """)
-        completed_orders = cur.fetchone()['total']
-        
-        # Ожидающие верификацию
-        cur.execute("""
-            SELECT COUNT(*) as total 
-            FROM t_p42562714_web_app_creation_1.user_verifications 
-            WHERE status = 'pending'
-        """)
-        pending_verifications = cur.fetchone()['total']
 
-        # Топ продавцов по завершённым сделкам
-        cur.execute("""
-            SELECT
-                o.seller_id,
-                COALESCE(NULLIF(TRIM(u.company_name), ''),
-                         TRIM(COALESCE(u.first_name,'') || ' ' || COALESCE(u.last_name,'')),
-                         'Пользователь') AS name,
-                COUNT(*) AS deals,
-                COALESCE(SUM(o.total_amount), 0) AS revenue
-            FROM t_p42562714_web_app_creation_1.orders o
-            LEFT JOIN t_p42562714_web_app_creation_1.users u ON u.id = o.seller_id
-            WHERE o.status = 'completed'
-            GROUP BY o.seller_id, u.company_name, u.first_name, u.last_name
-            ORDER BY deals DESC
-            LIMIT 5
-        """)
-        top_sellers = [
-            {'name': r['name'], 'deals': r['deals'], 'revenue': float(r['revenue'])}
-            for r in cur.fetchall()
-        ]
+        if params.get('action') == 'history':
+            days = min(max(int(params.get('days', '30')), 1), HISTORY_MAX_DAYS)
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'days': days, 'points': read_history(conn, days)}),
+                'isBase64Encoded': False
+            }
 
-        # Популярные категории по завершённым сделкам
-        cur.execute("""
-            SELECT
-                COALESCE(NULLIF(offer_category, ''), 'Другое') AS category,
-                COUNT(*) AS count
-            FROM t_p42562714_web_app_creation_1.orders
-            WHERE status = 'completed'
-            GROUP BY category
-            ORDER BY count DESC
-            LIMIT 6
-        """)
-        rows = cur.fetchall()
-        total_cat = sum(r['count'] for r in rows) or 1
-        top_categories = [
-            {'name': r['category'], 'count': r['count'], 'percentage': round(r['count'] / total_cat * 100)}
-            for r in rows
-        ]
+        if params.get('action') == 'series':
+            bucket = params.get('bucket', 'day')
+            try:
+                date_to = date.fromisoformat(params['to']) if params.get('to') else date.today()
+                date_from = (date.fromisoformat(params['from']) if params.get('from')
+                             else date_to - timedelta(days=SERIES_DEFAULT_DAYS - 1))
+            except ValueError:
+                date_from = date_to = None
+            if bucket not in BUCKETS or date_from is None or date_from > date_to \
+                    or (date_to - date_from).days >= SERIES_MAX_DAYS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Нужны from <= to (YYYY-MM-DD, не больше {SERIES_MAX_DAYS} дней) и bucket из {", ".join(BUCKETS)}'}),
+                    'isBase64Encoded': False
+                }
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(read_series(conn, date_from, date_to, bucket)),
+                'isBase64Encoded': False
+            }
+
+        if params.get('action') == 'rollup':
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'days': run_rollup(conn)}),
+                'isBase64Encoded': False
+            }
+
+        # Снимок старше REFRESH_INTERVAL_SECONDS пересчитывает тот, кто первым взял аренду;
+        # ?refresh=1 — пересчитать сейчас
+        max_age = 0 if params.get('refresh') == '1' else REFRESH_INTERVAL_SECONDS
+        snapshot = read_snapshot(conn)
+        if snapshot is None or snapshot['age_seconds'] >= max_age:
+            refresh_snapshot(conn, max_age)
+            snapshot = read_snapshot(conn)
+
+        if snapshot is None:
+            # Первый подсчёт ещё идёт в другом вызове
+            with conn.cursor() as cur:
+                stats = compute_stats(cur)
+            refreshed_at = None
+            refresh_ms = None
+        else:
+            stats = snapshot['stats']
+            refreshed_at = snapshot['refreshed_at'].isoformat()
+            refresh_ms = snapshot['refresh_ms']
 
-        stats = {
-            'totalUsers': total_users,
-            'activeUsers': active_users,
-            'verifiedUsers': verified_users,
-            'activeOffers': active_offers,
-            'activeRequests': active_requests,
-            'activeAuctions': active_auctions,
-            'completedOrders': completed_orders,
-            'pendingVerifications': pending_verifications,
-            'topSellers': top_sellers,
-            'topCategories': top_categories,
-        }
-        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(stats),
+            'body': json.dumps({**stats, 'refreshedAt': refreshed_at, 'refreshMs': refresh_ms}),
             'isBase64Encoded': False
         }
     
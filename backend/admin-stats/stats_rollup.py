@@ -0,0 +1,226 @@
+'''
+Дневные агрегаты админ-панели (admin_stats_daily, admin_stats_daily_categories).
+Для каждого источника хранится водяной знак (admin_stats_rollup_state): строки
+с меткой времени до него уже учтены. Запуск берёт строки после водяного знака,
+находит затронутые ими дни и пересчитывает эти дни целиком по исходной таблице —
+повторный пересчёт того же дня даёт тот же результат.
+Дни, из которых строка ушла (удаление заказа, архивирование, смена статуса),
+по водяному знаку не найти — их отмечает триггер в admin_stats_dirty_days.
+Верхняя граница отстаёт от NOW() на ROLLUP_LAG_SECONDS: транзакции, начатые
+раньше, успевают закоммититься и не проскакивают мимо водяного знака.
+Запускается из archive-expired; модуль одинаковый в admin-stats и archive-expired.
+'''
+
+from datetime import date
+from typing import Any, Dict, List
+
+from psycopg2.extras import RealDictCursor
+
+SCHEMA = 't_p42562714_web_app_creation_1'
+
+ROLLUP_LAG_SECONDS = 120
+
+# watermark — колонка, по которой ищутся новые и изменённые строки;
+# day — выражение дня, к которому относится строка; aggregates — колонки admin_stats_daily;
+# dirty_days — дни дополнительно отмечает триггер (admin_stats_dirty_days)
+SOURCES: Dict[str, Dict[str, Any]] = {
+    'users': {
+        'table': 'users',
+        'watermark': 't.created_at',
+        'day': 't.created_at',
+        'filter': 'TRUE',
+        'aggregates': {'new_users': 'COUNT(t.id)'},
+    },
+    'offers': {
+        'table': 'offers',
+        'watermark': 't.created_at',
+        'day': 't.created_at',
+        'filter': 'TRUE',
+        'aggregates': {'new_offers': 'COUNT(t.id)'},
+    },
+    'requests': {
+        'table': 'requests',
+        'watermark': 't.created_at',
+        'day': 't.created_at',
+        'filter': 'TRUE',
+        'aggregates': {'new_requests': 'COUNT(t.id)'},
+    },
+    'orders': {
+        'table': 'orders',
+        'watermark': 't.updated_at',
+        'day': 't.completed_date',
+        'filter': "t.status = 'completed'",
+        'aggregates': {
+            'completed_orders': 'COUNT(t.id)',
+            'completed_gmv': 'COALESCE(SUM(t.total_amount), 0)',
+        },
+        'categories': True,
+        'dirty_days': True,
+    },
+    'verifications': {
+        'table': 'user_verifications',
+        'watermark': 't.reviewed_at',
+        'day': 't.reviewed_at',
+        'filter': "t.status IN ('approved', 'rejected')",
+        'aggregates': {
+            'verifications_approved': "COUNT(t.id) FILTER (WHERE t.status = 'approved')",
+            'verifications_rejected': "COUNT(t.id) FILTER (WHERE t.status = 'rejected')",
+        },
+    },
+}
+
+# Колонка admin_stats_daily -> ключ в ответе ?action=series
+SERIES_COLUMNS = (
+    ('new_users', 'newUsers'),
+    ('new_offers', 'newOffers'),
+    ('new_requests', 'newRequests'),
+    ('completed_orders', 'completedOrders'),
+    ('completed_gmv', 'gmv'),
+    ('verifications_approved', 'verificationsApproved'),
+    ('verifications_rejected', 'verificationsRejected'),
+)
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def _touched_days(cur, source: Dict[str, Any], watermark, upper) -> List[date]:
+    """
+    Дни строк, изменённых после водяного знака. Без фильтра источника: строка,
+    переставшая ему соответствовать (заказ уже не 'completed'), тоже меняет свой день.
+    """
+    if watermark is not None and watermark >= upper:
+        return []
+    cur.execute(f"""
+        SELECT DISTINCT ({source['day']})::date AS day
+        FROM {SCHEMA}.{source['table']} t
+        WHERE {source['watermark']} > COALESCE(%s::timestamp, '-infinity'::timestamp)
+          AND {source['watermark']} <= %s
+          AND ({source['day']}) IS NOT NULL
+    """, (watermark, upper))
+    return [row['day'] for row in cur.fetchall()]
+
+
+def _take_dirty_days(cur, name: str) -> List[date]:
+    """
+    Забирает дни, отмеченные триггером. Изменение, ещё не закоммиченное к этому
+    моменту, держит блокировку строки дня: DELETE дождётся его commit, и пересчёт
+    ниже его увидит, либо триггер вставит день заново для следующего запуска.
+    """
+    cur.execute(f"DELETE FROM {SCHEMA}.admin_stats_dirty_days WHERE source = %s RETURNING day", (name,))
+    return [row['day'] for row in cur.fetchall()]
+
+
+def _recompute_days(cur, source: Dict[str, Any], days: List[date]) -> None:
+    aggregates = source['aggregates']
+    columns = ', '.join(aggregates)
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.admin_stats_daily (day, {columns})
+        SELECT g.day, {', '.join(aggregates.values())}
+        FROM unnest(%s::date[]) AS g(day)
+        LEFT JOIN {SCHEMA}.{source['table']} t
+            ON ({source['day']}) >= g.day AND ({source['day']}) < g.day + 1
+           AND {source['filter']}
+        GROUP BY g.day
+        ON CONFLICT (day) DO UPDATE
+        SET {', '.join(f'{column} = EXCLUDED.{column}' for column in aggregates)},
+            updated_at = CURRENT_TIMESTAMP
+    """, (days,))
+
+    if source.get('categories'):
+        cur.execute(f"DELETE FROM {SCHEMA}.admin_stats_daily_categories WHERE day = ANY(%s::date[])", (days,))
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.admin_stats_daily_categories (day, category, completed_orders, completed_gmv)
+            SELECT g.day, COALESCE(NULLIF(t.offer_category, ''), 'Другое'), COUNT(t.id), COALESCE(SUM(t.total_amount), 0)
+            FROM unnest(%s::date[]) AS g(day)
+            JOIN {SCHEMA}.{source['table']} t
+                ON ({source['day']}) >= g.day AND ({source['day']}) < g.day + 1
+               AND {source['filter']}
+            GROUP BY 1, 2
+        """, (days,))
+
+
+def run_rollup(conn) -> Dict[str, int]:
+    """
+    Продвигает водяные знаки всех источников. Каждый источник — отдельная
+    транзакция; источник, который сейчас обрабатывает другой запуск, пропускается.
+    Возвращает {источник: число пересчитанных дней}.
+    """
+    result = {}
+    for name, source in SOURCES.items():
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f"""
+                    SELECT watermark, NOW()::timestamp - make_interval(secs => %s) AS upper
+                    FROM {SCHEMA}.admin_stats_rollup_state
+                    WHERE source = %s
+                    FOR UPDATE SKIP LOCKED
+                """, (ROLLUP_LAG_SECONDS, name))
+                state = cur.fetchone()
+                if state is None:
+                    conn.rollback()
+                    continue
+
+                days = set(_touched_days(cur, source, state['watermark'], state['upper']))
+                if source.get('dirty_days'):
+                    days.update(_take_dirty_days(cur, name))
+                days = sorted(days)
+                if days:
+                    _recompute_days(cur, source, days)
+                cur.execute(f"""
+                    UPDATE {SCHEMA}.admin_stats_rollup_state
+                    SET watermark = GREATEST(watermark, %s), updated_at = CURRENT_TIMESTAMP
+                    WHERE source = %s
+                """, (state['upper'], name))
+            conn.commit()
+            result[name] = len(days)
+        except Exception as e:
+            conn.rollback()
+            print(f'[ADMIN-STATS] rollup of {name} failed: {e}')
+    return result
+
+
+def read_series(conn, date_from: date, date_to: date, bucket: str) -> Dict[str, Any]:
+    """
+    Ряды по дням / неделям / месяцам за [date_from, date_to]; дни без данных — нули.
+    rolledUpTo — самый отстающий водяной знак: данные позже него могут быть неполными.
+    """
+    sums = ', '.join(f'COALESCE(SUM(d.{column}), 0) AS {column}' for column, _ in SERIES_COLUMNS)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT date_trunc(%s, g.day)::date AS bucket, {sums}
+            FROM generate_series(%s::date, %s::date, INTERVAL '1 day') AS g(day)
+            LEFT JOIN {SCHEMA}.admin_stats_daily d ON d.day = g.day::date
+            GROUP BY 1
+            ORDER BY 1
+        """, (bucket, date_from, date_to))
+        points = [
+            {'date': row['bucket'].isoformat(), **{key: float(row[column]) if column == 'completed_gmv' else row[column]
+                                                  for column, key in SERIES_COLUMNS}}
+            for row in cur.fetchall()
+        ]
+
+        cur.execute(f"""
+            SELECT date_trunc(%s, day)::date AS bucket, category,
+                   SUM(completed_orders) AS completed_orders, SUM(completed_gmv) AS completed_gmv
+            FROM {SCHEMA}.admin_stats_daily_categories
+            WHERE day BETWEEN %s AND %s
+            GROUP BY 1, 2
+            ORDER BY 1, completed_gmv DESC
+        """, (bucket, date_from, date_to))
+        categories = [
+            {'date': row['bucket'].isoformat(), 'category': row['category'],
+             'completedOrders': int(row['completed_orders']), 'gmv': float(row['completed_gmv'])}
+            for row in cur.fetchall()
+        ]
+
+        cur.execute(f"SELECT MIN(watermark) AS rolled_up_to FROM {SCHEMA}.admin_stats_rollup_state")
+        rolled_up_to = cur.fetchone()['rolled_up_to']
+
+    return {
+        'bucket': bucket,
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'points': points,
+        'categories': categories,
+        'rolledUpTo': rolled_up_to.isoformat() if rolled_up_to else None,
+    }
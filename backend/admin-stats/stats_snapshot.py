@@ -0,0 +1,199 @@
+'''
+Снимок статистики админ-панели (admin_stats_snapshot) и почасовая история
+счётчиков (admin_stats_history).
+Полный подсчёт по таблицам идёт не чаще раза в REFRESH_INTERVAL_SECONDS:
+по расписанию из archive-expired и из admin-stats, когда снимок устарел.
+Считает только взявший аренду (refreshing_until), остальные отдают имеющийся снимок.
+Модуль одинаковый в admin-stats и archive-expired.
+'''
+
+import time
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extras import Json, RealDictCursor
+
+SCHEMA = 't_p42562714_web_app_creation_1'
+
+REFRESH_INTERVAL_SECONDS = 5 * 60
+LEASE_SECONDS = 60
+
+# Колонка admin_stats_history -> ключ в снимке
+HISTORY_COUNTERS = (
+    ('total_users', 'totalUsers'),
+    ('active_users', 'activeUsers'),
+    ('verified_users', 'verifiedUsers'),
+    ('active_offers', 'activeOffers'),
+    ('active_requests', 'activeRequests'),
+    ('active_auctions', 'activeAuctions'),
+    ('completed_orders', 'completedOrders'),
+    ('pending_verifications', 'pendingVerifications'),
+)
+
+
+def compute_stats(cur) -> Dict[str, Any]:
+    """Полный подсчёт статистики по исходным таблицам"""
+    cur.execute(f"""
+        SELECT
+            COUNT(*) FILTER (WHERE removed_at IS NULL) AS total_users,
+            COUNT(*) FILTER (
+                WHERE removed_at IS NULL
+                AND is_active = true
+                AND (locked_until IS NULL OR locked_until < NOW())
+            ) AS active_users
+        FROM {SCHEMA}.users
+    """)
+    users = cur.fetchone()
+
+    cur.execute(f"""
+        SELECT
+            COUNT(DISTINCT user_id) FILTER (WHERE status = 'approved') AS verified_users,
+            COUNT(*) FILTER (WHERE status = 'pending') AS pending_verifications
+        FROM {SCHEMA}.user_verifications
+    """)
+    verifications = cur.fetchone()
+
+    cur.execute(f"""
+        SELECT
+            (SELECT COUNT(*) FROM {SCHEMA}.offers WHERE status = 'active') AS active_offers,
+            (SELECT COUNT(*) FROM {SCHEMA}.requests WHERE status = 'active') AS active_requests,
+            (SELECT COUNT(*) FROM {SCHEMA}.auctions WHERE status = 'active') AS active_auctions,
+            (SELECT COUNT(*) FROM {SCHEMA}.orders WHERE status = 'completed') AS completed_orders
+    """)
+    active = cur.fetchone()
+
+    # Топ продавцов по завершённым сделкам
+    cur.execute(f"""
+        SELECT
+            o.seller_id,
+            COALESCE(NULLIF(TRIM(u.company_name), ''),
+                     TRIM(COALESCE(u.first_name,'') || ' ' || COALESCE(u.last_name,'')),
+                     'Пользователь') AS name,
+            COUNT(*) AS deals,
+            COALESCE(SUM(o.total_amount), 0) AS revenue
+        FROM {SCHEMA}.orders o
+        LEFT JOIN {SCHEMA}.users u ON u.id = o.seller_id
+        WHERE o.status = 'completed'
+        GROUP BY o.seller_id, u.company_name, u.first_name, u.last_name
+        ORDER BY deals DESC
+        LIMIT 5
+    """)
+    top_sellers = [
+        {'name': r['name'], 'deals': r['deals'], 'revenue': float(r['revenue'])}
+        for r in cur.fetchall()
+    ]
+
+    # Популярные категории по завершённым сделкам
+    cur.execute(f"""
+        SELECT
+            COALESCE(NULLIF(offer_category, ''), 'Другое') AS category,
+            COUNT(*) AS count
+        FROM {SCHEMA}.orders
+        WHERE status = 'completed'
+        GROUP BY category
+        ORDER BY count DESC
+        LIMIT 6
+    """)
+    rows = cur.fetchall()
+    total_cat = sum(r['count'] for r in rows) or 1
+    top_categories = [
+        {'name': r['category'], 'count': r['count'], 'percentage': round(r['count'] / total_cat * 100)}
+        for r in rows
+    ]
+
+    return {
+        'totalUsers': users['total_users'],
+        'activeUsers': users['active_users'],
+        'verifiedUsers': verifications['verified_users'],
+        'activeOffers': active['active_offers'],
+        'activeRequests': active['active_requests'],
+        'activeAuctions': active['active_auctions'],
+        'completedOrders': active['completed_orders'],
+        'pendingVerifications': verifications['pending_verifications'],
+        'topSellers': top_sellers,
+        'topCategories': top_categories,
+    }
+
+
+def _acquire_refresh(conn, max_age_seconds: int) -> bool:
+    """Берёт аренду на пересчёт, если снимок старше max_age_seconds и никто его уже не считает"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {SCHEMA}.admin_stats_snapshot
+            SET refreshing_until = NOW() + make_interval(secs => %s)
+            WHERE id = 1
+              AND (refreshed_at IS NULL OR refreshed_at <= NOW() - make_interval(secs => %s))
+              AND (refreshing_until IS NULL OR refreshing_until < NOW())
+            RETURNING id
+        """, (LEASE_SECONDS, max_age_seconds))
+        acquired = cur.fetchone() is not None
+    conn.commit()
+    return acquired
+
+
+def refresh_snapshot(conn, max_age_seconds: int = REFRESH_INTERVAL_SECONDS) -> bool:
+    """
+    Пересчитывает снимок, если он старше max_age_seconds (0 — принудительно),
+    и записывает точку истории за текущий час. False — пересчёт не понадобился
+    или его уже выполняет другой вызов.
+    """
+    if not _acquire_refresh(conn, max_age_seconds):
+        return False
+    started = time.monotonic()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            stats = compute_stats(cur)
+            refresh_ms = int((time.monotonic() - started) * 1000)
+            cur.execute(f"""
+                UPDATE {SCHEMA}.admin_stats_snapshot
+                SET stats = %s, refreshed_at = NOW(), refresh_ms = %s, refreshing_until = NULL
+                WHERE id = 1
+            """, (Json(stats), refresh_ms))
+
+            columns = ', '.join(column for column, _ in HISTORY_COUNTERS)
+            updates = ', '.join(f'{column} = EXCLUDED.{column}' for column, _ in HISTORY_COUNTERS)
+            cur.execute(f"""
+                INSERT INTO {SCHEMA}.admin_stats_history (captured_at, {columns})
+                VALUES (date_trunc('hour', NOW()), {', '.join(['%s'] * len(HISTORY_COUNTERS))})
+                ON CONFLICT (captured_at) DO UPDATE SET {updates}
+            """, tuple(stats[key] for _, key in HISTORY_COUNTERS))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"UPDATE {SCHEMA}.admin_stats_snapshot SET refreshing_until = NULL WHERE id = 1")
+        conn.commit()
+        raise
+    print(f'[ADMIN-STATS] snapshot refreshed in {refresh_ms} ms')
+    return True
+
+
+def read_snapshot(conn) -> Optional[Dict[str, Any]]:
+    """Снимок со временем подсчёта; None, если он ещё ни разу не считался"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT stats, refreshed_at, refresh_ms,
+                   EXTRACT(EPOCH FROM NOW() - refreshed_at) AS age_seconds
+            FROM {SCHEMA}.admin_stats_snapshot
+            WHERE id = 1
+        """)
+        row = cur.fetchone()
+    if not row or row['refreshed_at'] is None:
+        return None
+    return dict(row)
+
+
+def read_history(conn, days: int) -> List[Dict[str, Any]]:
+    """Почасовые точки истории за последние days дней, по возрастанию времени"""
+    columns = ', '.join(column for column, _ in HISTORY_COUNTERS)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT captured_at, {columns}
+            FROM {SCHEMA}.admin_stats_history
+            WHERE captured_at >= NOW() - make_interval(days => %s)
+            ORDER BY captured_at
+        """, (days,))
+        rows = cur.fetchall()
+    return [
+        {'capturedAt': row['captured_at'].isoformat(), **{key: row[column] for column, key in HISTORY_COUNTERS}}
+        for row in rows
+    ]
@@ -0,0 +1,101 @@
+'''
+Приём изображений при создании и изменении предложений и запросов без
+обработки Pillow на пути запроса.
+- Ссылка на исходник, загруженный браузером в offer-uploads/ или request-uploads/
+  (get-upload-url ?action=presign), сохраняется как есть и ставится в очередь обработки.
+- data URL от старых клиентов декодируется и кладётся в S3 без перекодирования,
+  дальше — та же очередь. В offer_images.url data URL не попадает никогда.
+Варианты строит offers ?action=process-images (image_migration.process_pending_images);
+kick_image_processing будит его после commit: обычно варианты готовы через
+несколько секунд после сохранения, в худшем случае (пробуждение не дошло) —
+после ближайшего запуска archive-expired по расписанию. До этого списки
+показывают вместо изображения плейсхолдер.
+'''
+
+import base64
+import http.client
+import os
+import uuid
+from typing import Optional, Tuple
+
+UPLOAD_FOLDERS = ('offer-uploads', 'request-uploads')
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+OFFERS_HOST = 'functions.poehali.dev'
+OFFERS_PATH = '/2c8bcee0-2dd9-48ab-8d0e-e8ad34c623aa'
+# Соединение и отправка запроса на пробуждение обработчика
+KICK_TIMEOUT_SECONDS = 1.5
+
+_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/heic': 'heic', 'image/gif': 'gif'}
+
+
+class ImageUploadError(Exception):
+    """Изображение не удалось принять — строка в offer_images не создаётся"""
+
+
+def _cdn_prefix() -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/"
+
+
+def uploaded_key(url: str) -> Optional[str]:
+    """Ключ S3 необработанного исходника, если url указывает в папку загрузок"""
+    prefix = _cdn_prefix()
+    if not url.startswith(prefix):
+        return None
+    key = url[len(prefix):].split('?', 1)[0]
+    if key.split('/', 1)[0] not in UPLOAD_FOLDERS or '..' in key:
+        return None
+    return key
+
+
+def stage_data_url(s3, data_url: str, folder: str) -> str:
+    """Кладёт байты data URL в папку загрузок как есть; возвращает ключ S3"""
+    header, b64data = data_url.split(',', 1)
+    content_type = header[len('data:'):].split(';', 1)[0] or 'image/jpeg'
+    if not content_type.startswith('image/'):
+        raise ImageUploadError(f'Unsupported content type: {content_type}')
+    raw = base64.b64decode(b64data)
+    if len(raw) > MAX_UPLOAD_BYTES:
+        raise ImageUploadError('Image is too large')
+    key = f"{folder}/{uuid.uuid4()}.{_EXTENSIONS.get(content_type, 'bin')}"
+    s3.put_object(Bucket='files', Key=key, Body=raw, ContentType=content_type)
+    return key
+
+
+def prepare_image(s3_factory, url: str, folder: str) -> Tuple[str, Optional[str]]:
+    """
+    Возвращает (url для offer_images.url, source_key для очереди или None).
+    s3_factory вызывается только для data URL, чтобы не создавать клиент S3 без нужды.
+    ImageUploadError — изображение пропускается.
+    """
+    if url.startswith('data:'):
+        try:
+            key = stage_data_url(s3_factory(), url, folder)
+        except ImageUploadError:
+            raise
+        except Exception as e:
+            raise ImageUploadError(str(e))
+        return _cdn_prefix() + key, key
+    return url, uploaded_key(url)
+
+
+def kick_image_processing(wait: float = 0) -> None:
+    """
+    Будит обработчик очереди изображений (вызывать после commit). Запрос
+    отправляется синхронно, за время не больше KICK_TIMEOUT_SECONDS: фоновый
+    поток перед return контейнер функции может заморозить. Ответа (обработка
+    идёт до 20 с) обработчики запросов не ждут; wait > 0 — дождаться его
+    не дольше wait секунд. Если пробуждение не дошло, изображения обработает
+    запуск archive-expired по расписанию — до тех пор в списках плейсхолдер.
+    """
+    try:
+        conn = http.client.HTTPSConnection(OFFERS_HOST, timeout=KICK_TIMEOUT_SECONDS)
+        try:
+            conn.request('GET', f'{OFFERS_PATH}?action=process-images')
+            if wait > 0:
+                conn.sock.settimeout(wait)
+                conn.getresponse().read()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f'[IMAGE_UPLOADS] Processor kick failed: {e}')
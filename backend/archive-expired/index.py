@@ -1,18 +1,204 @@
 '''Автоматическое архивирование истёкших запросов, предложений и откликов'''
 import json
 import os
+import time
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from notification_outbox import enqueue_batch, kick_dispatcher
+from image_uploads import kick_image_processing
+from auction_scheduler import run_due_transitions
+from stats_snapshot import refresh_snapshot
+from stats_rollup import run_rollup
+
+SCHEMA = 't_p42562714_web_app_creation_1'
+
+# Размер одной пачки и ограничение времени работы одного запуска.
+# Если за запуск не всё успели — остаток заберёт следующий запуск.
+BATCH_SIZE = 500
+MAX_RUNTIME_SECONDS = 20
+
+# Сколько запуск ждёт ответа диспетчера уведомлений после пробуждения
+DISPATCH_WAIT_SECONDS = 5
+# Сколько запуск ждёт ответа обработчика очереди изображений
+IMAGE_PROCESSING_WAIT_SECONDS = 5
+
+# Эндпоинты, которые уведомляют владельца о снятии предложения с публикации
+# (вызывает диспетчер notification_outbox)
+EXPIRY_NOTIFY_ENDPOINTS = ['/d49f8584-6ef9-47c0-9661-02560166e10f', '/3c4b3e64-cb71-4b82-abd5-e67393be3d43']
+
+
+# Сколько хранится журнал событий аукционов для long-poll подписки
+AUCTION_EVENTS_RETENTION_DAYS = 7
 
 
 def get_db_connection():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
+def archive_requests_batch(cur, now: datetime, batch_size: int) -> list:
+    """Одним UPDATE архивирует пачку запросов с истёкшим expiry_date или deadline_end"""
+    cur.execute(f"""
+        UPDATE {SCHEMA}.requests r
+        SET status = 'archived', archived_at = %s, updated_at = %s
+        FROM (
+            SELECT id,
+                   CASE WHEN expiry_date IS NOT NULL AND expiry_date < %s THEN 'expiry_date'
+                        ELSE 'deadline_end' END AS reason
+            FROM {SCHEMA}.requests
+            WHERE status = 'active'
+              AND ((expiry_date IS NOT NULL AND expiry_date < %s)
+                   OR (deadline_end IS NOT NULL AND deadline_end < CURRENT_DATE))
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) AS expired
+        WHERE r.id = expired.id
+        RETURNING r.id, r.user_id, r.title, expired.reason
+    """, (now, now, now, now, batch_size))
+    return cur.fetchall()
+
+
+def close_fulfilled_requests_batch(cur, now: datetime, batch_size: int) -> list:
+    """
+    Закрывает пачку активных запросов, по которым принятое количество достигло
+    запрошенного (quantity > 0). Принятое количество — из сводки request_stats
+    (её ведёт backend/orders).
+    """
+    cur.execute(f"""
+        UPDATE {SCHEMA}.requests r
+        SET status = 'closed', updated_at = %s
+        FROM (
+            SELECT req.id
+            FROM {SCHEMA}.requests req
+            JOIN {SCHEMA}.request_stats rs ON rs.request_id = req.id
+            WHERE req.status = 'active'
+              AND req.quantity > 0
+              AND rs.has_accepted
+              AND rs.accepted_quantity >= req.quantity
+            LIMIT %s
+            FOR UPDATE OF req SKIP LOCKED
+        ) AS fulfilled
+        WHERE r.id = fulfilled.id
+        RETURNING r.id, r.user_id, r.title
+    """, (now, batch_size))
+    return cur.fetchall()
+
+
+def archive_offers_batch(cur, now: datetime, batch_size: int) -> list:
+    """
+    Одним UPDATE архивирует пачку предложений с истёкшим expiry_date,
+    delivery_period_end или датой выезда (transport_date_time).
+    """
+    cur.execute(f"""
+        UPDATE {SCHEMA}.offers o
+        SET status = 'archived', archived_at = %s, updated_at = %s
+        FROM (
+            SELECT id,
+                   CASE WHEN expiry_date IS NOT NULL AND expiry_date < %s THEN 'expiry_date'
+                        WHEN delivery_period_end IS NOT NULL AND delivery_period_end < CURRENT_DATE THEN 'delivery_period_end'
+                        ELSE 'transport_date_time' END AS reason
+            FROM {SCHEMA}.offers
+            WHERE status = 'active'
+              AND ((expiry_date IS NOT NULL AND expiry_date < %s)
+                   OR (delivery_period_end IS NOT NULL AND delivery_period_end < CURRENT_DATE)
+                   OR (transport_date_time IS NOT NULL
+                       AND transport_date_time != ''
+                       AND CAST(transport_date_time AS timestamp) < %s))
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) AS expired
+        WHERE o.id = expired.id
+        RETURNING o.id, o.user_id, o.title, expired.reason
+    """, (now, now, now, now, now, batch_size))
+    return cur.fetchall()
+
+
+def cancel_orders_for_offers(cur, now: datetime, offer_ids: list) -> list:
+    """Отменяет незавершённые отклики (orders) по архивированным предложениям"""
+    if not offer_ids:
+        return []
+    cur.execute(f"""
+        UPDATE {SCHEMA}.orders
+        SET status = 'cancelled', archived_at = %s, updated_at = %s, cancellation_reason = 'Предложение истекло'
+        WHERE offer_id = ANY(%s)
+          AND status IN ('new', 'counter_offer', 'accepted')
+        RETURNING id
+    """, (now, now, offer_ids))
+    return [row['id'] for row in cur.fetchall()]
+
+
+def enqueue_expiry_notifications(cur, expired_offers: list) -> int:
+    """
+    Ставит в notification_outbox уведомления владельцам о снятии предложений
+    с публикации — в той же транзакции, что и архивирование пачки.
+    Отправляет их диспетчер в push-send.
+    """
+    return enqueue_batch(cur, [
+        {
+            'user_id': row['user_id'],
+            'channel': 'webhook',
+            'endpoint': endpoint,
+            'title': 'Предложение снято с публикации',
+            'message': f'Срок публикации предложения «{row["title"]}» истёк. Перейдите в «Мои предложения» чтобы опубликовать снова.',
+            'url': '/my-offers'
+        }
+        for row in expired_offers
+        if row.get('user_id')
+        for endpoint in EXPIRY_NOTIFY_ENDPOINTS
+    ])
+
+
+def enqueue_request_notifications(cur, expired_requests: list, closed_requests: list) -> int:
+    """
+    Ставит в notification_outbox push владельцам об архивировании запросов
+    с истёкшим сроком и о закрытии запросов, по которым найден исполнитель.
+    """
+    items = [
+        {
+            'user_id': row['user_id'],
+            'channel': 'push',
+            'title': 'Запрос снят с публикации',
+            'message': f'Срок публикации запроса «{row["title"]}» истёк. Перейдите в «Мои запросы» чтобы опубликовать снова.',
+            'url': '/my-requests'
+        }
+        for row in expired_requests
+        if row.get('user_id')
+    ]
+    items += [
+        {
+            'user_id': row['user_id'],
+            'channel': 'push',
+            'title': 'Запрос закрыт — исполнитель найден',
+            'message': f'Запрос «{row["title"]}» скрыт из публичного списка, так как по нему принят исполнитель.',
+            'url': '/my-orders?tab=my-requests'
+        }
+        for row in closed_requests
+        if row.get('user_id')
+    ]
+    return enqueue_batch(cur, items)
+
+
+def purge_auction_events(cur, batch_size: int) -> int:
+    """Удаляет пачку событий auction_events старше срока хранения"""
+    cur.execute(f"""
+        DELETE FROM {SCHEMA}.auction_events
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.auction_events
+            WHERE created_at < NOW() - make_interval(days => %s)
+            ORDER BY created_at
+            LIMIT %s
+        )
+    """, (AUCTION_EVENTS_RETENTION_DAYS, batch_size))
+    return cur.rowcount
+
+
 def handler(event: dict, context) -> dict:
     """
-    Архивирует запросы, предложения и отклики с истёкшим сроком публикации.
+    Архивирует запросы, предложения и отклики с истёкшим сроком публикации,
+    закрывает запросы, по которым найден исполнитель,
+    и переводит аукционы с наступившим сроком в следующий статус,
+    обновляет снимок статистики админ-панели и её дневные агрегаты.
+    Работает пачками по BATCH_SIZE записей и не дольше MAX_RUNTIME_SECONDS.
     GET / - запустить архивирование (также принимает POST)
     """
     headers = {
@@ -27,89 +213,107 @@ def handler(event: dict, context) -> dict:
             'body': ''
         }
 
+    started = time.monotonic()
+    deadline = started + MAX_RUNTIME_SECONDS
+
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
     now = datetime.utcnow()
 
-    # 1. Архивируем запросы с истёкшим expiry_date
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.requests
-        SET status = 'archived', archived_at = %s, updated_at = %s
-        WHERE status = 'active'
-          AND expiry_date IS NOT NULL
-          AND expiry_date < %s
-        RETURNING id
-    """, (now, now, now))
-    archived_requests = [row['id'] for row in cur.fetchall()]
+    archived_requests = []
+    closed_requests = []
+    archived_offers = []
+    archived_orders = []
+    reasons = {}
+    notified = 0
+    passes = 0
+    complete = False
+    auction_transitions = {}
+    purged_events = 0
+    admin_stats_refreshed = False
+    admin_stats_rollup = {}
 
-    # 1b. Архивируем запросы с истёкшим сроком поставки (deadline_end)
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.requests
-        SET status = 'archived', archived_at = %s, updated_at = %s
-        WHERE status = 'active'
-          AND deadline_end IS NOT NULL
-          AND deadline_end < CURRENT_DATE
-        RETURNING id
-    """, (now, now))
-    archived_requests += [row['id'] for row in cur.fetchall()]
+    try:
+        while time.monotonic() < deadline:
+            passes += 1
 
-    # 2. Архивируем предложения с истёкшим expiry_date
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.offers
-        SET status = 'archived', archived_at = %s, updated_at = %s
-        WHERE status = 'active'
-          AND expiry_date IS NOT NULL
-          AND expiry_date < %s
-        RETURNING id
-    """, (now, now, now))
-    archived_offers = [row['id'] for row in cur.fetchall()]
+            # 1. Запросы с истёкшим expiry_date или сроком поставки
+            request_rows = archive_requests_batch(cur, now, BATCH_SIZE)
+            archived_requests += [row['id'] for row in request_rows]
+            for row in request_rows:
+                key = f"requests.{row['reason']}"
+                reasons[key] = reasons.get(key, 0) + 1
 
-    # 2b. Архивируем предложения с истёкшим периодом поставки (delivery_period_end)
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.offers
-        SET status = 'archived', archived_at = %s, updated_at = %s
-        WHERE status = 'active'
-          AND delivery_period_end IS NOT NULL
-          AND delivery_period_end < CURRENT_DATE
-        RETURNING id
-    """, (now, now))
-    archived_offers += [row['id'] for row in cur.fetchall()]
+            # Запросы, по которым принятое количество покрывает запрошенное
+            closed_rows = close_fulfilled_requests_batch(cur, now, BATCH_SIZE)
+            closed_requests += [row['id'] for row in closed_rows]
 
-    # 2c. Архивируем пассажирские перевозки с истёкшей датой выезда
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.offers
-        SET status = 'archived', archived_at = %s, updated_at = %s
-        WHERE status = 'active'
-          AND transport_service_type = 'Пассажирские перевозки'
-          AND transport_date_time IS NOT NULL
-          AND transport_date_time != ''
-          AND CAST(transport_date_time AS timestamp) < %s
-        RETURNING id
-    """, (now, now, now))
-    archived_offers += [row['id'] for row in cur.fetchall()]
+            # 2. Предложения с истёкшим сроком публикации, поставки или датой выезда
+            offer_rows = archive_offers_batch(cur, now, BATCH_SIZE)
+            offer_ids = [row['id'] for row in offer_rows]
+            archived_offers += offer_ids
+            for row in offer_rows:
+                key = f"offers.{row['reason']}"
+                reasons[key] = reasons.get(key, 0) + 1
 
-    # 3. Архивируем отклики (orders) для архивированных запросов и предложений
-    # — статусы не принятых/не завершённых: new, counter_offer, accepted -> archived
-    archived_request_ids = archived_requests
-    archived_offer_ids = archived_offers
+            # 3. Отклики (orders) по архивированным предложениям
+            archived_orders += cancel_orders_for_offers(cur, now, offer_ids)
 
-    archived_orders = []
+            # 4. Уведомления владельцам — в очередь, вместе с пачкой
+            notified += enqueue_expiry_notifications(cur, offer_rows)
+            notified += enqueue_request_notifications(cur, request_rows, closed_rows)
+
+            # Фиксируем каждую пачку отдельно, чтобы не держать блокировки весь запуск
+            conn.commit()
+
+            if len(request_rows) < BATCH_SIZE and len(closed_rows) < BATCH_SIZE and len(offer_rows) < BATCH_SIZE:
+                complete = True
+                break
 
-    if archived_offer_ids:
-        placeholders = ','.join(['%s'] * len(archived_offer_ids))
-        cur.execute(f"""
-            UPDATE t_p42562714_web_app_creation_1.orders
-            SET status = 'cancelled', archived_at = %s, updated_at = %s, cancellation_reason = 'Предложение истекло'
-            WHERE offer_id IN ({placeholders})
-              AND status IN ('new', 'counter_offer', 'accepted')
-            RETURNING id
-        """, [now, now] + archived_offer_ids)
-        archived_orders += [row['id'] for row in cur.fetchall()]
-
-    conn.commit()
-    cur.close()
-    conn.close()
+        # 5. Аукционы: только те, у которых наступил срок смены статуса
+        auction_transitions = run_due_transitions(conn)
+
+        # 6. Старые события аукционов
+        purged_events = purge_auction_events(cur, BATCH_SIZE)
+        conn.commit()
+
+        # 7. Снимок статистики админ-панели, если он старше интервала обновления.
+        # Шаги 7 и 8 необязательные: не начинаются после дедлайна, а их ошибка
+        # не срывает ответ и пробуждение диспетчера — догонит следующий запуск
+        if time.monotonic() < deadline:
+            try:
+                admin_stats_refreshed = refresh_snapshot(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f'[ARCHIVE] admin stats snapshot refresh failed: {e}')
+
+        # 8. Дневные агрегаты для графиков админ-панели — от водяных знаков
+        if time.monotonic() < deadline:
+            try:
+                admin_stats_rollup = run_rollup(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f'[ARCHIVE] admin stats rollup failed: {e}')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+        # Диспетчер будится каждым запуском, а не только при новых уведомлениях:
+        # так подбираются повторы с наступившим backoff, зависшие в 'sending'
+        # и уведомления, чьё пробуждение из обработчика запроса не дошло.
+        # Синхронно, с ожиданием ответа: до return контейнер не заморозится
+        kick_dispatcher(wait=DISPATCH_WAIT_SECONDS)
+        # Очередь изображений разбирается и без новых загрузок: зависшие захваты,
+        # повторы после ошибок и загрузки, чьё пробуждение не дошло, подбирает
+        # offers ?action=process-images. Тоже синхронно, с ожиданием ответа
+        kick_image_processing(wait=IMAGE_PROCESSING_WAIT_SECONDS)
+
+    duration_ms = int((time.monotonic() - started) * 1000)
+    print(f'[ARCHIVE] requests={len(archived_requests)} offers={len(archived_offers)} '
+          f'orders={len(archived_orders)} passes={passes} complete={complete} duration_ms={duration_ms}')
 
     return {
         'statusCode': 200,
@@ -121,6 +325,18 @@ def handler(event: dict, context) -> dict:
                 'offers': len(archived_offers),
                 'orders': len(archived_orders)
             },
+            'closed': {
+                'requests': len(closed_requests)
+            },
+            'reasons': reasons,
+            'auctionTransitions': auction_transitions,
+            'purgedAuctionEvents': purged_events,
+            'adminStatsRefreshed': admin_stats_refreshed,
+            'adminStatsRollupDays': admin_stats_rollup,
+            'notified': notified,
+            'passes': passes,
+            'complete': complete,
+            'duration_ms': duration_ms,
             'archived_at': now.isoformat()
         })
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,108 @@
+'''
+Постановка уведомлений в очередь notification_outbox.
+Обработчики запросов только пишут в очередь; отправку выполняет диспетчер
+в функции push-send (POST {"action": "dispatch"}).
+'''
+
+import json
+import os
+import http.client
+from typing import Any, Dict, Iterable, List, Optional
+from psycopg2.extras import execute_values
+
+OUTBOX_SCHEMA = os.environ.get('DB_SCHEMA', 't_p42562714_web_app_creation_1')
+
+PUSH_SEND_HOST = 'functions.poehali.dev'
+PUSH_SEND_PATH = '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a'
+# Соединение и отправка запроса на пробуждение диспетчера
+KICK_TIMEOUT_SECONDS = 1.5
+
+
+def enqueue_notifications(
+    cur,
+    user_ids: Iterable[Any],
+    title: str,
+    message: str,
+    url: str = '/',
+    channels: Iterable[str] = ('push',),
+    notification_type: Optional[str] = None,
+    coalesce_key: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    extra: Optional[Dict[str, Any]] = None
+) -> int:
+    """
+    Ставит уведомление в очередь для всех user_ids и каналов одним INSERT.
+    Выполняется в транзакции вызывающего кода — уведомление появится в очереди
+    только вместе с закоммиченными изменениями.
+    Если у получателя уже есть неотправленное уведомление с тем же coalesce_key,
+    оно обновляется вместо добавления нового.
+    """
+    user_ids = sorted({int(uid) for uid in user_ids if uid is not None})
+    channels = list(dict.fromkeys(channels))
+    if not user_ids or not channels:
+        return 0
+
+    cur.execute(f"""
+        INSERT INTO {OUTBOX_SCHEMA}.notification_outbox
+            (user_id, channel, endpoint, title, message, url, notification_type, extra, coalesce_key)
+        SELECT u.user_id, c.channel, %s, %s, %s, %s, %s, %s, %s
+        FROM unnest(%s::int[]) AS u(user_id)
+        CROSS JOIN unnest(%s::text[]) AS c(channel)
+        ON CONFLICT (user_id, channel, coalesce_key) WHERE status = 'pending' AND coalesce_key IS NOT NULL
+        DO UPDATE SET title = EXCLUDED.title,
+                      message = EXCLUDED.message,
+                      url = EXCLUDED.url,
+                      extra = EXCLUDED.extra,
+                      coalesced_count = notification_outbox.coalesced_count + 1
+    """, (
+        endpoint, title, message, url, notification_type,
+        json.dumps(extra) if extra is not None else None,
+        coalesce_key, user_ids, channels
+    ))
+    return len(user_ids) * len(channels)
+
+
+def enqueue_batch(cur, items: List[Dict[str, Any]]) -> int:
+    """
+    Ставит в очередь пачку разных уведомлений одним INSERT.
+    items: словари с ключами user_id, channel, title, message и необязательными
+    url, endpoint, notification_type, extra (без склейки по coalesce_key).
+    """
+    if not items:
+        return 0
+    execute_values(cur, f"""
+        INSERT INTO {OUTBOX_SCHEMA}.notification_outbox
+            (user_id, channel, endpoint, title, message, url, notification_type, extra)
+        VALUES %s
+    """, [
+        (
+            int(item['user_id']), item['channel'], item.get('endpoint'), item['title'], item['message'],
+            item.get('url', '/'), item.get('notification_type'),
+            json.dumps(item['extra']) if item.get('extra') is not None else None
+        )
+        for item in items
+    ])
+    return len(items)
+
+
+def kick_dispatcher(wait: float = 0) -> None:
+    """
+    Будит диспетчер (вызывать после commit). Запрос отправляется синхронно,
+    за время не больше KICK_TIMEOUT_SECONDS: фоновый поток, запущенный перед
+    return, контейнер функции может заморозить вместе с неотправленным запросом.
+    Ответа (диспетчер работает до 20 с) обработчики запросов не ждут;
+    wait > 0 — дождаться его не дольше wait секунд.
+    Если пробуждение не дошло, очередь разберёт запуск archive-expired
+    по расписанию — он будит диспетчер всегда.
+    """
+    try:
+        conn = http.client.HTTPSConnection(PUSH_SEND_HOST, timeout=KICK_TIMEOUT_SECONDS)
+        try:
+            conn.request('POST', PUSH_SEND_PATH, json.dumps({'action': 'dispatch'}), {'Content-Type': 'application/json'})
+            if wait > 0:
+                conn.sock.settimeout(wait)
+                conn.getresponse().read()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f'[OUTBOX] Dispatcher kick failed: {e}')
@@ -0,0 +1,187 @@
+'''
+Long-poll подписка на изменения аукциона (цена, число ставок, статус).
+События пишутся в журнал auction_events ставкой (auctions-place-bid) и
+планировщиком статусов; после коммита приходит NOTIFY auction_events
+с payload '<auction_id>:<event_id>'.
+Один фоновый поток на контейнер держит LISTEN-соединение и будит ожидающие
+запросы; сами запросы ходят в БД только за новыми событиями своего аукциона.
+'''
+
+import os
+import select
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+
+EVENTS_SCHEMA = os.environ.get('DB_SCHEMA', 't_p42562714_web_app_creation_1')
+EVENTS_CHANNEL = 'auction_events'
+
+# Сколько запрос может ждать новых событий (меньше таймаута функции)
+LONG_POLL_MAX_SECONDS = 25
+EVENTS_PAGE_LIMIT = 100
+
+
+def fetch_events(cur, auction_id: int, after_id: int, limit: int = EVENTS_PAGE_LIMIT) -> List[Dict[str, Any]]:
+    """События аукциона новее after_id по индексу (auction_id, id), от старых к новым"""
+    cur.execute(f"""
+        SELECT id, event_type, current_bid, bid_count, status, bid_id, user_id, created_at
+        FROM {EVENTS_SCHEMA}.auction_events
+        WHERE auction_id = %s AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (auction_id, after_id, limit))
+    return [{
+        'id': row[0],
+        'type': row[1],
+        'currentBid': float(row[2]) if row[2] is not None else None,
+        'bidCount': row[3],
+        'status': row[4],
+        'bidId': row[5],
+        'userId': row[6],
+        'createdAt': row[7].isoformat() if row[7] else None,
+    } for row in cur.fetchall()]
+
+
+def latest_event_id(cur, auction_id: int) -> int:
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {EVENTS_SCHEMA}.auction_events WHERE auction_id = %s", (auction_id,))
+    return int(cur.fetchone()[0])
+
+
+class EventListener:
+    """
+    Фоновый LISTEN auction_events. Хранит последний известный id события
+    по каждому аукциону и будит ожидающих через Condition.
+    При переподключении увеличивает generation: уведомления за время разрыва
+    могли потеряться, и ожидающие перечитывают журнал из БД.
+    """
+
+    def __init__(self, dsn: Optional[str] = None):
+        self._dsn = dsn
+        self._cond = threading.Condition()
+        self._latest: Dict[int, int] = {}
+        self._generation = 0
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'notifications': 0, 'reconnects': 0, 'waits': 0, 'wakeups': 0, 'timeouts': 0}
+
+    def ensure_started(self, timeout: float = 5) -> bool:
+        """Запускает поток при первом вызове; True, когда LISTEN уже выполнен"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self._ready.wait(timeout)
+
+    def wait(self, auction_id: int, after_id: int, timeout: float) -> bool:
+        """
+        Ждёт события аукциона новее after_id. Возвращает True, если стоит
+        перечитать журнал (пришло событие или был разрыв соединения).
+        """
+        self._stats['waits'] += 1
+        with self._cond:
+            generation = self._generation
+            woke = self._cond.wait_for(
+                lambda: self._latest.get(auction_id, 0) > after_id or self._generation != generation,
+                timeout
+            )
+        self._stats['wakeups' if woke else 'timeouts'] += 1
+        return woke
+
+    def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self._dsn or os.environ['DATABASE_URL'])
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN {EVENTS_CHANNEL}')
+                with self._cond:
+                    self._generation += 1
+                    self._cond.notify_all()
+                self._ready.set()
+
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        # Проверка живости соединения в простое
+                        conn.cursor().execute('SELECT 1')
+                        continue
+                    conn.poll()
+                    if not conn.notifies:
+                        continue
+                    with self._cond:
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            try:
+                                auction_id, event_id = (int(part) for part in notify.payload.split(':', 1))
+                            except ValueError:
+                                continue
+                            if event_id > self._latest.get(auction_id, 0):
+                                self._latest[auction_id] = event_id
+                            self._stats['notifications'] += 1
+                        self._cond.notify_all()
+            except Exception as e:
+                print(f'[AUCTION_EVENTS] Listener error: {e}')
+                self._ready.clear()
+                self._stats['reconnects'] += 1
+                time.sleep(1)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'auctions': len(self._latest), 'listening': self._ready.is_set()}
+
+
+event_listener = EventListener()
+
+
+def _read(connect: Callable[[], Any], query: Callable[..., Any], *args) -> Any:
+    """Одно чтение журнала на отдельном соединении, закрываемом сразу после запроса"""
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        try:
+            return query(cur, *args)
+        finally:
+            cur.close()
+    finally:
+        conn.close()
+
+
+def poll_events(connect: Callable[[], Any], auction_id: int, after_id: Optional[int], timeout: float) -> Dict[str, Any]:
+    """
+    Возвращает события аукциона новее after_id, при необходимости ожидая их
+    до timeout секунд. Без after_id сразу возвращает текущий id журнала —
+    с него клиент начинает подписку.
+    connect() открывает соединение с БД: оно нужно только на время чтения журнала,
+    во время ожидания запрос соединение не держит.
+    """
+    if after_id is None:
+        return {'events': [], 'lastEventId': _read(connect, latest_event_id, auction_id), 'timedOut': False}
+
+    # LISTEN должен начаться до чтения журнала, иначе событие между чтением
+    # и ожиданием будет пропущено
+    listening = event_listener.ensure_started()
+    deadline = time.monotonic() + timeout
+    while True:
+        events = _read(connect, fetch_events, auction_id, after_id)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            break
+        if not listening:
+            # Без LISTEN — редкий опрос журнала, пока соединение восстанавливается
+            time.sleep(min(1.0, remaining))
+            listening = event_listener.ensure_started(timeout=0)
+            continue
+        if not event_listener.wait(auction_id, after_id, remaining):
+            break
+
+    return {
+        'events': events,
+        'lastEventId': events[-1]['id'] if events else after_id,
+        'timedOut': not events,
+    }
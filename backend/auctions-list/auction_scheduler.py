@@ -0,0 +1,158 @@
+'''
+Планировщик смены статусов аукционов:
+upcoming → active → ending-soon → ended → archived (если ставок не было).
+Срок следующего перехода хранится в вычисляемой колонке auctions.next_transition_at,
+поэтому запуск выбирает по индексу только аукционы с уже наступившим сроком.
+'''
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+SCHEDULER_SCHEMA = os.environ.get('DB_SCHEMA', 't_p42562714_web_app_creation_1')
+
+# Даты аукционов хранятся в местном времени Якутска
+AUCTION_TZ_OFFSET_HOURS = int(os.environ.get('AUCTION_TZ_OFFSET_HOURS', '9'))
+
+TRANSITION_BATCH_SIZE = 500
+ENDING_SOON_HOURS = 24
+
+# Как часто контейнер перечитывает ближайший срок перехода из БД
+# (аукционы могли создать или изменить другие контейнеры)
+RECHECK_SECONDS = 30
+
+
+def auction_now() -> datetime:
+    return datetime.now(timezone(timedelta(hours=AUCTION_TZ_OFFSET_HOURS))).replace(tzinfo=None)
+
+
+def run_due_transitions(conn, now: Optional[datetime] = None, batch_size: int = TRANSITION_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Переводит аукционы с наступившим сроком сразу в итоговый статус
+    (например, upcoming с прошедшим end_date — сразу в ended/archived).
+    Работает пачками, каждая пачка коммитится отдельно; SKIP LOCKED позволяет
+    запускать планировщик из нескольких контейнеров одновременно.
+    О каждом переходе пишется событие 'status' в auction_events (с NOTIFY).
+    Возвращает число переходов по парам 'старый→новый'.
+    """
+    now = now or auction_now()
+    transitions: Dict[str, int] = {}
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(f"""
+                WITH due AS (
+                    SELECT id, status, start_date, end_date, COALESCE(bid_count, 0) AS bid_count
+                    FROM {SCHEDULER_SCHEMA}.auctions
+                    WHERE next_transition_at <= %(now)s
+                    ORDER BY next_transition_at
+                    LIMIT %(batch)s
+                    FOR UPDATE SKIP LOCKED
+                ), computed AS (
+                    SELECT id, status AS old_status,
+                        CASE
+                            WHEN end_date <= %(now)s
+                                 AND (status IN ('active', 'ending-soon', 'ended')
+                                      OR (status = 'upcoming' AND start_date <= %(now)s))
+                                THEN CASE WHEN bid_count = 0 THEN 'archived' ELSE 'ended' END
+                            WHEN status = 'upcoming' AND start_date <= %(now)s
+                                THEN CASE WHEN end_date <= %(now)s + make_interval(hours => %(soon)s)
+                                          THEN 'ending-soon' ELSE 'active' END
+                            WHEN status = 'active' AND end_date <= %(now)s + make_interval(hours => %(soon)s)
+                                THEN 'ending-soon'
+                            ELSE status
+                        END AS new_status
+                    FROM due
+                ), changed AS (
+                    UPDATE {SCHEDULER_SCHEMA}.auctions a
+                    SET status = c.new_status
+                    FROM computed c
+                    WHERE a.id = c.id AND c.new_status <> c.old_status
+                    RETURNING a.id, a.current_bid, a.bid_count, c.old_status, c.new_status
+                ), ev AS (
+                    INSERT INTO {SCHEDULER_SCHEMA}.auction_events (auction_id, event_type, current_bid, bid_count, status)
+                    SELECT id, 'status', current_bid, bid_count, new_status FROM changed
+                    RETURNING auction_id, pg_notify('auction_events', auction_id || ':' || id)
+                )
+                SELECT ch.old_status, ch.new_status
+                FROM changed ch
+                JOIN ev ON ev.auction_id = ch.id
+            """, {'now': now, 'batch': batch_size, 'soon': ENDING_SOON_HOURS})
+            rows = cur.fetchall()
+            conn.commit()
+
+            for old_status, new_status in rows:
+                key = f'{old_status}→{new_status}'
+                transitions[key] = transitions.get(key, 0) + 1
+
+            if len(rows) < batch_size:
+                break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    if transitions:
+        print(f'[AUCTION_SCHEDULER] transitions={transitions}')
+    return transitions
+
+
+def next_deadline(conn) -> Optional[datetime]:
+    """Ближайший срок смены статуса среди всех аукционов (по частичному индексу)"""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT MIN(next_transition_at) FROM {SCHEDULER_SCHEMA}.auctions
+            WHERE next_transition_at IS NOT NULL
+        """)
+        row = cur.fetchone()
+        return row[0] if row else None
+    finally:
+        cur.close()
+
+
+class TransitionScheduler:
+    """
+    Таймер переходов внутри контейнера: помнит ближайший срок и до его
+    наступления не обращается к БД на запись. Срок перечитывается не чаще
+    раза в RECHECK_SECONDS, так что пока переходов нет, запрос списка
+    не делает ни одного UPDATE.
+    """
+
+    def __init__(self, recheck_seconds: float = RECHECK_SECONDS):
+        self._recheck_seconds = recheck_seconds
+        self._next_due: Optional[datetime] = None
+        self._checked_at = float('-inf')
+        self._stats = {'ticks': 0, 'runs': 0, 'rechecks': 0, 'transitions': 0}
+
+    def _refresh(self, conn) -> None:
+        self._next_due = next_deadline(conn)
+        self._checked_at = time.monotonic()
+        self._stats['rechecks'] += 1
+
+    def tick(self, conn) -> Optional[Dict[str, int]]:
+        """Выполняет переходы, если срок ближайшего из них наступил; иначе ничего не делает"""
+        self._stats['ticks'] += 1
+        if time.monotonic() - self._checked_at >= self._recheck_seconds:
+            self._refresh(conn)
+
+        now = auction_now()
+        if self._next_due is None or now < self._next_due:
+            return None
+
+        transitions = run_due_transitions(conn, now)
+        self._stats['runs'] += 1
+        self._stats['transitions'] += sum(transitions.values())
+        self._refresh(conn)
+        return transitions
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'nextDue': self._next_due.isoformat() if self._next_due else None,
+        }
+
+
+transition_scheduler = TransitionScheduler()
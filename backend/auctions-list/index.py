@@ -1,12 +1,30 @@
 """
-Получение списка активных аукционов с фильтрацией + обмен контактами
+Получение списка активных аукционов с фильтрацией и пагинацией + обмен контактами
 """
 import json
 import os
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from auction_scheduler import transition_scheduler, run_due_transitions
+from auction_events import poll_events, event_listener, LONG_POLL_MAX_SECONDS
+from pagination import decode_cursor, encode_cursor, page_meta
+
+S = 't_p42562714_web_app_creation_1'
+
+DEFAULT_LIST_LIMIT = 20
+MAX_LIST_LIMIT = 100
+# Верхняя граница для старых клиентов, которые запрашивают список без limit/cursor
+LEGACY_LIST_LIMIT = 500
+
+# Ставки в карточке аукциона и на странице истории
+DETAIL_BIDS_LIMIT = 50
+MAX_BIDS_LIMIT = 200
+
+# PostgreSQL возвращает timestamp without timezone в UTC, клиенту отдаём время Якутска (UTC+9)
+UTC_TZ = timezone.utc
+YAKUTSK_TZ = timezone(timedelta(hours=9))
 
 def convert_decimals(obj: Any) -> Any:
     """Рекурсивно конвертирует Decimal в float для JSON сериализации"""
@@ -18,6 +36,143 @@ def convert_decimals(obj: Any) -> Any:
         return [convert_decimals(item) for item in obj]
     return obj
 
+def encode_auction_cursor(is_premium: Any, created_at: Any, auction_id: Any) -> str:
+    """Курсор на последний аукцион страницы: (премиум, дата создания, id)"""
+    return encode_cursor(f"{1 if is_premium else 0}|{created_at.isoformat()}", auction_id)
+
+def decode_auction_cursor(cursor: Optional[str]) -> Optional[Tuple[bool, str, int]]:
+    decoded = decode_cursor(cursor)
+    if not decoded:
+        return None
+    try:
+        sort_value, auction_id = decoded
+        premium, created_at = sort_value.split('|', 1)
+        return premium == '1', created_at, int(auction_id)
+    except ValueError:
+        return None
+
+def utc_to_yakutsk(dt: Optional[datetime]) -> Optional[str]:
+    """Конвертирует наивный UTC datetime из БД в ISO-строку по времени Якутска"""
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=UTC_TZ).astimezone(YAKUTSK_TZ).isoformat()
+
+def parse_client_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """ISO-время от клиента → наивный UTC datetime; без смещения считается временем Якутска"""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=YAKUTSK_TZ)
+    return dt.astimezone(UTC_TZ).replace(tzinfo=None)
+
+def fetch_bids(cur, auction_id: Any, limit: int, since_id: Optional[int] = None,
+               since: Optional[datetime] = None, before_id: Optional[int] = None) -> Tuple[list, bool]:
+    """
+    Страница ставок аукциона по индексу (auction_id, id). Возвращает (ставки, hasMore).
+    - since_id / since: только ставки новее указанной, от старых к новым
+      (клиент продолжает с sinceId = id последней полученной ставки);
+    - иначе история от новых к старым, before_id — курсор следующей страницы.
+    isWinning отмечает последнюю ставку аукциона (она же максимальная).
+    """
+    conditions = ["b.auction_id = %s"]
+    query_params: list = [auction_id, auction_id]
+    incremental = since_id is not None or since is not None
+    if since_id is not None:
+        conditions.append("b.id > %s")
+        query_params.append(since_id)
+    if since is not None:
+        conditions.append("b.created_at > %s")
+        query_params.append(since)
+    if before_id is not None and not incremental:
+        conditions.append("b.id < %s")
+        query_params.append(before_id)
+
+    cur.execute(f"""
+        SELECT b.id, b.user_id, b.amount, b.created_at,
+               COALESCE(u.company_name, CONCAT(u.first_name, ' ', u.last_name)) as user_name,
+               (SELECT MAX(w.id) FROM {S}.bids w WHERE w.auction_id = %s) as winning_id
+        FROM {S}.bids b
+        LEFT JOIN {S}.users u ON b.user_id = u.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY b.id {'ASC' if incremental else 'DESC'}
+        LIMIT %s
+    """, query_params + [limit + 1])
+    rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    bids = [{
+        'id': row[0],
+        'userId': row[1],
+        'amount': float(row[2]),
+        'timestamp': utc_to_yakutsk(row[3]),
+        'userName': row[4] or 'Участник',
+        'isWinning': row[0] == row[5],
+    } for row in rows[:limit]]
+    return bids, has_more
+
+def handle_bid_history(cur, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    GET ?action=bids&id=<auction_id> — история ставок постранично или приращением:
+    &sinceId=<bid_id> или &since=<ISO время> — только новые ставки;
+    &beforeId=<bid_id> — следующая страница истории; &limit= (по умолчанию DETAIL_BIDS_LIMIT)
+    """
+    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+    auction_id = params.get('id') or params.get('auctionId')
+    try:
+        auction_id = int(auction_id)
+        limit = min(max(int(params.get('limit', DETAIL_BIDS_LIMIT)), 1), MAX_BIDS_LIMIT)
+        since_id = int(params['sinceId']) if params.get('sinceId') else None
+        before_id = int(params['beforeId']) if params.get('beforeId') else None
+    except (TypeError, ValueError):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Некорректные параметры'}), 'isBase64Encoded': False}
+
+    cur.execute(f"""
+        SELECT current_bid, bid_count, status FROM {S}.auctions
+        WHERE id = %s AND status NOT IN ('cancelled', 'deleted')
+    """, (auction_id,))
+    auction_row = cur.fetchone()
+    if not auction_row:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Auction not found'}), 'isBase64Encoded': False}
+
+    since = parse_client_timestamp(params.get('since'))
+    bids, has_more = fetch_bids(cur, auction_id, limit, since_id=since_id, since=since, before_id=before_id)
+    incremental = since_id is not None or since is not None
+
+    body = {
+        'auctionId': auction_id,
+        'currentBid': float(auction_row[0]) if auction_row[0] is not None else None,
+        'bidCount': auction_row[1],
+        'status': auction_row[2],
+        'bids': bids,
+        'hasMore': has_more,
+        # Для приращения — с чего продолжать опрос, для истории — курсор следующей страницы
+        'lastBidId': (bids[-1]['id'] if bids else since_id) if incremental else None,
+        'nextBeforeId': bids[-1]['id'] if bids and has_more and not incremental else None,
+    }
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(body), 'isBase64Encoded': False}
+
+def handle_auction_events(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    GET ?action=events&id=<auction_id>&after=<event_id>&timeout=<сек> — long-poll:
+    ответ приходит, как только появится событие новее after (ставка, смена статуса),
+    или по таймауту с пустым списком. Без after — текущий lastEventId для начала подписки.
+    """
+    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+    try:
+        auction_id = int(params.get('id') or params.get('auctionId'))
+        after_id = int(params['after']) if params.get('after') not in (None, '') else None
+        timeout = min(max(float(params.get('timeout', LONG_POLL_MAX_SECONDS)), 0), LONG_POLL_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Некорректные параметры'}), 'isBase64Encoded': False}
+
+    # Соединение открывается только на чтение журнала: ожидание до 25 с его не держит
+    result = poll_events(lambda: psycopg2.connect(os.environ['DATABASE_URL']), auction_id, after_id, timeout)
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'auctionId': auction_id, **result}), 'isBase64Encoded': False}
+
 def handle_contact_exchange(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     user_id = event.get('headers', {}).get('X-User-Id')
     if not user_id:
@@ -40,7 +195,6 @@ def handle_contact_exchange(event: Dict[str, Any], context: Any) -> Dict[str, An
             'isBase64Encoded': False
         }
     
-    S = 't_p42562714_web_app_creation_1'
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor()
 
@@ -213,104 +367,129 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
-        # Получаем часовой пояс из запроса или используем Якутск по умолчанию
         params = event.get('queryStringParameters') or {}
-        tz_offset = int(params.get('timezoneOffset', 9))
-        user_tz = timezone(timedelta(hours=tz_offset))
-        now = datetime.now(user_tz).replace(tzinfo=None)
         
-        # Активируем предстоящие аукционы, время которых наступило
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.auctions 
-            SET status = 'active' 
-            WHERE status = 'upcoming' AND start_date <= %s
-        """, (now,))
+        # Long-poll сам открывает соединение на каждое чтение журнала
+        if params.get('action') == 'events':
+            return handle_auction_events(params)
+        
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
         
-        # Завершаем аукционы, время которых истекло
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.auctions 
-            SET status = 'ended' 
-            WHERE status IN ('active', 'ending-soon') AND end_date <= %s
-        """, (now,))
-
-        # Архивируем завершённые аукционы без ставок
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.auctions 
-            SET status = 'archived'
-            WHERE status = 'ended' AND bid_count = 0
-        """)
+        # Принудительный запуск переходов статусов (для расписания и администратора)
+        if params.get('action') == 'transitions':
+            transitions = run_due_transitions(conn)
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({
+                    'success': True,
+                    'transitions': transitions,
+                    'scheduler': transition_scheduler.stats(),
+                    'eventListener': event_listener.stats()
+                }),
+                'isBase64Encoded': False
+            }
         
-        # Помечаем аукционы как "скоро завершится" (меньше 24 часов)
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.auctions 
-            SET status = 'ending-soon' 
-            WHERE status = 'active' 
-            AND end_date > %s 
-            AND end_date <= %s + INTERVAL '24 hours'
-        """, (now, now))
+        if params.get('action') == 'bids':
+            try:
+                return handle_bid_history(cur, params)
+            finally:
+                cur.close()
+                conn.close()
         
-        conn.commit()
+        # Смена статусов (upcoming → active → ending-soon → ended → archived)
+        # выполняется, только когда наступил срок ближайшего перехода
+        try:
+            transition_scheduler.tick(conn)
+        except Exception as e:
+            conn.rollback()
+            print(f'[AUCTION_SCHEDULER] Error: {e}')
         
-        # Получаем параметры запроса (params уже определены выше)
         auction_id = params.get('id')
         status_filter = params.get('status')
+        category_filter = params.get('category')
+        district_filter = params.get('district')
+        
+        # Keyset-пагинация: ?limit= и/или ?cursor= (пустой для первой страницы).
+        # Без них — страница из LEGACY_LIST_LIMIT записей; hasMore/nextCursor
+        # возвращаются и в этом случае, чтобы обрезка списка была видна клиенту
+        cursor_mode = 'cursor' in params or 'limit' in params
+        if cursor_mode:
+            try:
+                limit = min(max(int(params.get('limit', DEFAULT_LIST_LIMIT)), 1), MAX_LIST_LIMIT)
+            except (TypeError, ValueError):
+                limit = DEFAULT_LIST_LIMIT
+        else:
+            limit = LEGACY_LIST_LIMIT
+        cursor = decode_auction_cursor(params.get('cursor')) if cursor_mode else None
         
-        # Получаем список аукционов
-        query = """
+        query = f"""
             SELECT 
                 a.id, a.user_id, a.title, a.description, a.category, a.subcategory,
                 a.quantity, a.unit, a.starting_price, a.current_bid, a.min_bid_step,
                 a.buy_now_price, a.has_vat, a.vat_rate, a.district, a.full_address,
                 a.gps_coordinates, a.available_districts, a.available_delivery_types,
                 a.start_date, a.end_date, a.duration_days, a.status, a.is_premium,
-                a.bid_count, a.view_count, a.created_at,
-                COALESCE(json_agg(
-                    json_build_object(
-                        'url', ai.url,
-                        'alt', ai.alt
-                    ) ORDER BY ai.sort_order
-                ) FILTER (WHERE ai.id IS NOT NULL), '[]') as images,
-                a.video_url
-            FROM t_p42562714_web_app_creation_1.auctions a
-            LEFT JOIN t_p42562714_web_app_creation_1.auction_images ai ON a.id = ai.auction_id
+                a.bid_count, a.view_count, a.created_at, a.video_url
+            FROM {S}.auctions a
         """
         
         if auction_id:
             query += " WHERE a.id = %s AND a.status NOT IN ('cancelled', 'deleted', 'archived')"
-            query += " GROUP BY a.id"
             cur.execute(query, (auction_id,))
         else:
+            conditions = []
+            query_params = []
             if status_filter and status_filter not in ('cancelled', 'deleted', 'archived'):
-                query += " WHERE a.status = %s"
-                query += " GROUP BY a.id ORDER BY a.is_premium DESC, a.created_at DESC"
-                cur.execute(query, (status_filter,))
+                conditions.append("a.status = %s")
+                query_params.append(status_filter)
             else:
-                query += " WHERE a.status NOT IN ('cancelled', 'deleted', 'archived')"
-                query += " GROUP BY a.id ORDER BY a.is_premium DESC, a.created_at DESC"
-                cur.execute(query)
+                conditions.append("a.status NOT IN ('cancelled', 'deleted', 'archived')")
+            if category_filter:
+                conditions.append("a.category = %s")
+                query_params.append(category_filter)
+            if district_filter:
+                conditions.append("(a.district = %s OR %s = ANY(a.available_districts))")
+                query_params += [district_filter, district_filter]
+            if cursor:
+                conditions.append("(COALESCE(a.is_premium, false), a.created_at, a.id) < (%s, %s, %s)")
+                query_params += list(cursor)
+            query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY COALESCE(a.is_premium, false) DESC, a.created_at DESC, a.id DESC"
+            query += f" LIMIT {limit + 1}"
+            cur.execute(query, query_params)
         rows = cur.fetchall()
         
-        auctions = []
-        # Якутск UTC+9
-        yakutsk_tz = timezone(timedelta(hours=9))
-        utc_tz = timezone(timedelta(hours=0))
+        has_more = False
+        next_cursor = None
+        if not auction_id:
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if has_more and rows:
+                last = rows[-1]
+                next_cursor = encode_auction_cursor(last[23], last[26], last[0])
+        
+        # Изображения — отдельным запросом только для аукционов страницы
+        images_map = {}
+        if rows:
+            cur.execute(f"""
+                SELECT auction_id, url, alt
+                FROM {S}.auction_images
+                WHERE auction_id = ANY(%s)
+                ORDER BY auction_id, sort_order
+            """, ([row[0] for row in rows],))
+            for image_row in cur.fetchall():
+                images_map.setdefault(image_row[0], []).append({'url': image_row[1], 'alt': image_row[2]})
         
+        auctions = []
         for row in rows:
-            # PostgreSQL возвращает timestamp without timezone в UTC
-            # Конвертируем UTC → Якутск
             start_date = row[19]
             end_date = row[20]
             created_at = row[26]
             
-            # Функция для конвертации UTC → Якутск
-            def utc_to_yakutsk(dt):
-                if dt is None:
-                    return None
-                return dt.replace(tzinfo=utc_tz).astimezone(yakutsk_tz).isoformat()
-            
             auction = {
                 'id': row[0],
                 'userId': row[1],
@@ -339,50 +518,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'bidCount': row[24],
                 'viewCount': row[25],
                 'createdAt': utc_to_yakutsk(created_at),
-                'images': json.loads(row[27]) if isinstance(row[27], str) else row[27],
-                'videoUrl': row[28],
+                'images': images_map.get(row[0], []),
+                'videoUrl': row[27],
             }
             auctions.append(auction)
         
         if auction_id and auctions:
-            # Получаем ставки для конкретного аукциона
-            cur.execute("""
-                SELECT b.id, b.user_id, b.amount, b.created_at,
-                       COALESCE(u.company_name, CONCAT(u.first_name, ' ', u.last_name)) as user_name
-                FROM t_p42562714_web_app_creation_1.bids b
-                LEFT JOIN t_p42562714_web_app_creation_1.users u ON b.user_id = u.id
-                WHERE b.auction_id = %s
-                ORDER BY b.created_at DESC
-            """, (auction_id,))
-            
-            bids_rows = cur.fetchall()
-            bids = []
-            # Якутск UTC+9
-            yakutsk_tz = timezone(timedelta(hours=9))
-            utc_tz = timezone(timedelta(hours=0))
-            for bid_row in bids_rows:
-                # PostgreSQL возвращает наивный datetime в UTC
-                # Сначала помечаем как UTC, затем конвертируем в Якутск
-                timestamp_naive = bid_row[3]
-                if timestamp_naive:
-                    # Помечаем что это UTC время
-                    timestamp_utc = timestamp_naive.replace(tzinfo=utc_tz)
-                    # Конвертируем UTC → Якутск (+9 часов)
-                    timestamp_yakutsk = timestamp_utc.astimezone(yakutsk_tz)
-                    timestamp_str = timestamp_yakutsk.isoformat()
-                else:
-                    timestamp_str = None
-                
-                bids.append({
-                    'id': bid_row[0],
-                    'userId': bid_row[1],
-                    'amount': float(bid_row[2]),
-                    'timestamp': timestamp_str,
-                    'userName': bid_row[4] or 'Участник',
-                    'isWinning': bid_row == bids_rows[0]  # Первая ставка (самая последняя по времени) - выигрышная
-                })
-            
+            # Последние ставки аукциона; остальное — через ?action=bids&beforeId=
+            bids, bids_has_more = fetch_bids(cur, auctions[0]['id'], DETAIL_BIDS_LIMIT)
             auctions[0]['bids'] = bids
+            auctions[0]['bidsHasMore'] = bids_has_more
         
         cur.close()
         conn.close()
@@ -413,10 +558,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
         
+        response_body = {'auctions': auctions}
+        response_body.update(page_meta(limit, has_more, next_cursor))
+        
         return {
             'statusCode': 200,
             'headers': cache_headers,
-            'body': json.dumps({'auctions': auctions}),
+            'body': json.dumps(response_body),
             'isBase64Encoded': False
         }
         
@@ -3,106 +3,157 @@
 """
 import json
 import os
+import time
 import threading
-import http.client
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import psycopg2
-from typing import Dict, Any
+import psycopg2.errors
+from typing import Dict, Any, Optional
+from db_pool import get_connection
+from notification_outbox import enqueue_notifications, kick_dispatcher
+from rate_limiter import RateLimiter
 
+SCHEMA = 't_p42562714_web_app_creation_1'
 
-def _send_push_to_user(user_id: int, title: str, message: str, url: str):
-    """Отправка push-уведомления пользователю в фоновом потоке"""
-    try:
-        payload = json.dumps({
-            'userId': user_id,
-            'type': 'auction_bid',
-            'title': title,
-            'message': message,
-            'url': url
-        })
-        conn = http.client.HTTPSConnection('functions.poehali.dev', timeout=8)
-        conn.request('POST', '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a',
-                     payload, {'Content-Type': 'application/json'})
-        resp = conn.getresponse()
-        resp.read()
-        conn.close()
-    except Exception as e:
-        print(f'[AUCTION_PUSH] Error sending to user {user_id}: {e}')
+# Сколько ставка может ждать блокировку строки аукциона в «шторм» последних минут.
+# Дольше не ждём: клиент получает 409 и повторяет с актуальной ценой.
+BID_LOCK_TIMEOUT_MS = int(os.environ.get('BID_LOCK_TIMEOUT_MS', '2000'))
 
+# Даты аукционов хранятся в местном времени Якутска (как в auctions-list/auction_scheduler.py)
+AUCTION_TZ_OFFSET_HOURS = int(os.environ.get('AUCTION_TZ_OFFSET_HOURS', '9'))
 
-def _notify_auction_participants(auction_id: str, bidder_id: int, auction_title: str,
-                                  new_amount: float, owner_id: int):
-    """Уведомляем владельца и всех предыдущих участников аукциона"""
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        schema = 't_p42562714_web_app_creation_1'
+rate_limiter = RateLimiter(persist=True)
 
-        cur.execute(f"""
-            SELECT DISTINCT user_id FROM {schema}.bids
-            WHERE auction_id = %s AND user_id != %s
-        """, (auction_id, bidder_id))
-        participants = [row[0] for row in cur.fetchall()]
-        cur.close()
-        conn.close()
+_metrics_lock = threading.Lock()
+_bid_metrics = {
+    'attempts': 0,
+    'placed': 0,
+    'rejected': 0,
+    'lock_timeouts': 0,
+    'statement_ms_total': 0.0,
+    'statement_ms_max': 0.0,
+    'slow_statements': 0,  # дольше 100 мс — признак ожидания блокировки
+}
 
-        url = f'/auction/{auction_id}'
-        amount_str = f'{new_amount:,.0f}'.replace(',', ' ')
-        title_short = auction_title[:40] + '...' if len(auction_title) > 40 else auction_title
-
-        threads = []
-        for uid in participants:
-            t = threading.Thread(
-                target=_send_push_to_user,
-                args=(uid, 'Вас перебили!',
-                      f'Новая ставка {amount_str} ₽ на «{title_short}»', url),
-                daemon=True
-            )
-            threads.append(t)
-            t.start()
-
-        if owner_id != bidder_id:
-            t = threading.Thread(
-                target=_send_push_to_user,
-                args=(owner_id, 'Новая ставка на аукционе',
-                      f'{amount_str} ₽ на «{title_short}»', url),
-                daemon=True
-            )
-            threads.append(t)
-            t.start()
 
-    except Exception as e:
-        print(f'[AUCTION_PUSH] Notify participants error: {e}')
+def _record_metrics(outcome: str, statement_ms: float) -> None:
+    with _metrics_lock:
+        _bid_metrics['attempts'] += 1
+        _bid_metrics[outcome] += 1
+        _bid_metrics['statement_ms_total'] += statement_ms
+        _bid_metrics['statement_ms_max'] = max(_bid_metrics['statement_ms_max'], statement_ms)
+        if statement_ms > 100:
+            _bid_metrics['slow_statements'] += 1
+
+
+def get_bid_metrics() -> Dict[str, Any]:
+    """Метрики конкуренции за строки аукционов в этом контейнере"""
+    with _metrics_lock:
+        attempts = _bid_metrics['attempts']
+        return {
+            **_bid_metrics,
+            'statement_ms_avg': round(_bid_metrics['statement_ms_total'] / attempts, 3) if attempts else 0.0,
+            'lock_timeout_ms': BID_LOCK_TIMEOUT_MS,
+        }
+
 
+def auction_now() -> datetime:
+    return datetime.now(timezone(timedelta(hours=AUCTION_TZ_OFFSET_HOURS))).replace(tzinfo=None)
 
-def check_rate_limit(conn, identifier: str, endpoint: str, max_requests: int = 10, window_minutes: int = 1) -> bool:
-    with conn.cursor() as cur:
-        window_start = datetime.now() - timedelta(minutes=window_minutes)
-        cur.execute(
-            "SELECT request_count, window_start FROM rate_limits WHERE identifier = %s AND endpoint = %s",
-            (identifier, endpoint)
+
+def place_bid_atomic(cur, auction_id: Any, user_id: int, amount: float) -> Optional[tuple]:
+    """
+    Проверяет и применяет ставку одним запросом:
+    - условный UPDATE аукциона проходит, только если аукцион активен и end_date ещё
+      не наступил (статус меняет планировщик и может отставать), ставит не владелец
+      и сумма не меньше текущей цены + шаг. Под READ COMMITTED условие перепроверяется
+      на свежей версии строки после ожидания блокировки, поэтому две одновременные
+      ставки не могут обе пройти по устаревшей цене;
+    - INSERT ставки выполняется только если UPDATE вернул строку;
+    - в том же запросе возвращаются название, владелец, прежние участники и имя ставящего;
+    - в журнал auction_events пишется событие 'bid' с новой ценой, после коммита
+      NOTIFY auction_events будит long-poll подписчиков (auctions-list action=events).
+    Возвращает None, если ставка не прошла условие.
+    """
+    cur.execute(f"""
+        WITH updated AS (
+            UPDATE {SCHEMA}.auctions a
+            SET current_bid = %(amount)s, bid_count = COALESCE(a.bid_count, 0) + 1
+            WHERE a.id = %(auction_id)s
+              AND a.status IN ('active', 'ending-soon')
+              AND a.end_date > %(now)s
+              AND a.user_id <> %(user_id)s
+              AND %(amount)s >= COALESCE(NULLIF(a.current_bid, 0), a.starting_price) + a.min_bid_step
+            RETURNING a.id, a.user_id, a.title, a.current_bid, a.bid_count, a.status
+        ), bid AS (
+            INSERT INTO {SCHEMA}.bids (auction_id, user_id, amount)
+            SELECT id, %(user_id)s, %(amount)s FROM updated
+            RETURNING id, created_at
+        ), ev AS (
+            INSERT INTO {SCHEMA}.auction_events (auction_id, event_type, current_bid, bid_count, status, bid_id, user_id)
+            SELECT u.id, 'bid', u.current_bid, u.bid_count, u.status, b.id, %(user_id)s
+            FROM updated u CROSS JOIN bid b
+            RETURNING id, pg_notify('auction_events', auction_id || ':' || id)
         )
-        result = cur.fetchone()
-        if result:
-            if result[1] > window_start:
-                if result[0] >= max_requests:
-                    return False
-                cur.execute(
-                    "UPDATE rate_limits SET request_count = request_count + 1 WHERE identifier = %s AND endpoint = %s",
-                    (identifier, endpoint)
-                )
-            else:
-                cur.execute(
-                    "UPDATE rate_limits SET request_count = 1, window_start = CURRENT_TIMESTAMP WHERE identifier = %s AND endpoint = %s",
-                    (identifier, endpoint)
-                )
-        else:
-            cur.execute(
-                "INSERT INTO rate_limits (identifier, endpoint, request_count, window_start) VALUES (%s, %s, 1, CURRENT_TIMESTAMP)",
-                (identifier, endpoint)
-            )
-        conn.commit()
-        return True
+        SELECT b.id, b.created_at, u.user_id, u.title, (SELECT id FROM ev) AS event_id,
+               ARRAY(
+                   SELECT DISTINCT p.user_id FROM {SCHEMA}.bids p
+                   WHERE p.auction_id = u.id AND p.user_id <> %(user_id)s
+               ) AS participants,
+               usr.first_name, usr.last_name, usr.company_name, usr.user_type
+        FROM updated u
+        CROSS JOIN bid b
+        LEFT JOIN {SCHEMA}.users usr ON usr.id = %(user_id)s
+    """, {'auction_id': auction_id, 'user_id': user_id, 'amount': amount, 'now': auction_now()})
+    return cur.fetchone()
+
+
+def explain_rejected_bid(cur, auction_id: Any, user_id: int, amount: float) -> tuple:
+    """Медленный путь только для отклонённых ставок: причина отказа для клиента"""
+    cur.execute(f"""
+        SELECT status, current_bid, min_bid_step, starting_price, user_id, end_date <= %s AS ended
+        FROM {SCHEMA}.auctions
+        WHERE id = %s
+    """, (auction_now(), auction_id))
+    auction_data = cur.fetchone()
+    if not auction_data:
+        return 404, {'error': 'Auction not found'}
+
+    status, current_bid, min_bid_step, starting_price, owner_id, ended = auction_data
+    if status not in ['active', 'ending-soon'] or ended:
+        return 400, {'error': 'Аукцион не активен'}
+    if int(user_id) == int(owner_id):
+        return 400, {'error': 'Вы не можете делать ставки на свой аукцион'}
+
+    min_next_bid = float(current_bid or starting_price) + float(min_bid_step)
+    return 400, {'error': f'Минимальная ставка: {min_next_bid} ₽', 'minBid': min_next_bid}
+
+
+def _enqueue_bid_notifications(cur, auction_id: str, bidder_id: int, auction_title: str,
+                               new_amount: float, owner_id: int, participants: list):
+    """
+    Ставит в очередь уведомления владельцу и всем предыдущим участникам аукциона.
+    «Вас перебили» склеивается по аукциону: пока участник не получил прошлое
+    уведомление, новая ставка лишь обновляет его текст.
+    """
+    participants = [uid for uid in participants if uid != owner_id]
+
+    url = f'/auction/{auction_id}'
+    amount_str = f'{new_amount:,.0f}'.replace(',', ' ')
+    title_short = auction_title[:40] + '...' if len(auction_title) > 40 else auction_title
+
+    enqueue_notifications(
+        cur, participants, 'Вас перебили!',
+        f'Новая ставка {amount_str} ₽ на «{title_short}»', url,
+        notification_type='auction_bid', coalesce_key=f'auction:{auction_id}:outbid'
+    )
+    if owner_id != bidder_id:
+        enqueue_notifications(
+            cur, [owner_id], 'Новая ставка на аукционе',
+            f'{amount_str} ₽ на «{title_short}»', url,
+            notification_type='auction_bid', coalesce_key=f'auction:{auction_id}:owner'
+        )
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
@@ -112,7 +163,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
@@ -120,6 +171,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    if method == 'GET':
+        # GET ?action=metrics — метрики конкуренции ставок и rate limiter
+        params = event.get('queryStringParameters') or {}
+        if params.get('action') == 'metrics':
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'bids': get_bid_metrics(), 'rateLimiter': rate_limiter.stats()}),
+                'isBase64Encoded': False
+            }
+
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -141,19 +203,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     source_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'unknown')
 
-    try:
-        conn_rl = psycopg2.connect(os.environ['DATABASE_URL'])
-        if not check_rate_limit(conn_rl, f"{source_ip}:{user_id}", 'place_bid', max_requests=10, window_minutes=1):
-            conn_rl.close()
-            return {
-                'statusCode': 429,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Слишком много ставок. Подождите минуту.'}),
-                'isBase64Encoded': False
-            }
-        conn_rl.close()
-    except Exception:
-        pass
+    # Лимит проверяется в памяти; счётчики синхронизируются с БД пачкой после ставки
+    allowed, _ = rate_limiter.check_rate_limit(f"{source_ip}:{user_id}", max_requests=10, window_seconds=60, endpoint='place_bid')
+    if not allowed:
+        return {
+            'statusCode': 429,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Слишком много ставок. Подождите минуту.'}),
+            'isBase64Encoded': False
+        }
 
     try:
         body_data = json.loads(event.get('body', '{}'))
@@ -168,118 +226,60 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        bidder_id = int(user_id)
+        bid_amount = float(amount)
+
+        conn = get_connection()
         cur = conn.cursor()
-        
-        # Получаем данные аукциона
-        cur.execute("""
-            SELECT status, current_bid, min_bid_step, starting_price, user_id, end_date
-            FROM t_p42562714_web_app_creation_1.auctions 
-            WHERE id = %s
-        """, (auction_id,))
-        
-        auction_data = cur.fetchone()
-        
-        if not auction_data:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Auction not found'}),
-                'isBase64Encoded': False
-            }
-        
-        status, current_bid, min_bid_step, starting_price, owner_id, end_date = auction_data
-        
-        # Проверка что аукцион активен
-        if status not in ['active', 'ending-soon']:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Аукцион не активен'}),
-                'isBase64Encoded': False
-            }
-        
-        # Проверка что пользователь не владелец
-        if int(user_id) == int(owner_id):
+
+        started = time.monotonic()
+        try:
+            cur.execute('SET LOCAL lock_timeout = %s', (f'{BID_LOCK_TIMEOUT_MS}ms',))
+            placed = place_bid_atomic(cur, auction_id, bidder_id, bid_amount)
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
             cur.close()
             conn.close()
+            _record_metrics('lock_timeouts', (time.monotonic() - started) * 1000)
             return {
-                'statusCode': 400,
+                'statusCode': 409,
                 'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Вы не можете делать ставки на свой аукцион'}),
+                'body': json.dumps({'error': 'Слишком много одновременных ставок. Обновите цену и повторите.', 'retry': True}),
                 'isBase64Encoded': False
             }
-        
-        # Проверка минимальной ставки
-        min_next_bid = float(current_bid or starting_price) + float(min_bid_step)
-        if float(amount) < min_next_bid:
+        statement_ms = (time.monotonic() - started) * 1000
+
+        if not placed:
+            conn.rollback()
+            status_code, error_body = explain_rejected_bid(cur, auction_id, bidder_id, bid_amount)
             cur.close()
             conn.close()
+            _record_metrics('rejected', statement_ms)
             return {
-                'statusCode': 400,
+                'statusCode': status_code,
                 'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({
-                    'error': f'Минимальная ставка: {min_next_bid} ₽',
-                    'minBid': min_next_bid
-                }),
+                'body': json.dumps(error_body),
                 'isBase64Encoded': False
             }
-        
-        # Размещаем ставку
-        cur.execute("""
-            INSERT INTO t_p42562714_web_app_creation_1.bids 
-            (auction_id, user_id, amount) 
-            VALUES (%s, %s, %s)
-            RETURNING id, created_at
-        """, (auction_id, user_id, amount))
-        
-        bid_id, created_at = cur.fetchone()
-        
-        # Обновляем текущую цену и счётчик ставок
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.auctions 
-            SET current_bid = %s, bid_count = bid_count + 1
-            WHERE id = %s
-        """, (amount, auction_id))
-        
+
+        bid_id, created_at, owner_id, auction_title, event_id, participants, first_name, last_name, company_name, user_type = placed
+
+        # Уведомления участникам фиксируются вместе со ставкой
+        _enqueue_bid_notifications(cur, auction_id, bidder_id, auction_title or '', bid_amount, int(owner_id), participants or [])
+
         conn.commit()
-        
-        # Получаем имя пользователя
-        cur.execute("""
-            SELECT first_name, last_name, company_name, user_type 
-            FROM t_p42562714_web_app_creation_1.users 
-            WHERE id = %s
-        """, (user_id,))
-        
-        user_data = cur.fetchone()
-        user_name = 'Участник'
-        if user_data:
-            first_name, last_name, company_name, user_type = user_data
-            if user_type == 'legal-entity' and company_name:
-                user_name = company_name
-            elif first_name and last_name:
-                user_name = f"{first_name} {last_name}"
-        
-        auction_title = ''
-        cur.execute("""
-            SELECT title FROM t_p42562714_web_app_creation_1.auctions WHERE id = %s
-        """, (auction_id,))
-        title_row = cur.fetchone()
-        if title_row:
-            auction_title = title_row[0]
+        _record_metrics('placed', statement_ms)
+        kick_dispatcher()
+        rate_limiter.flush_if_due(conn)
 
         cur.close()
         conn.close()
 
-        threading.Thread(
-            target=_notify_auction_participants,
-            args=(auction_id, int(user_id), auction_title, float(amount), int(owner_id)),
-            daemon=True
-        ).start()
+        user_name = 'Участник'
+        if user_type == 'legal-entity' and company_name:
+            user_name = company_name
+        elif first_name and last_name:
+            user_name = f"{first_name} {last_name}"
 
         return {
             'statusCode': 200,
@@ -291,10 +291,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'auctionId': auction_id,
                     'userId': int(user_id),
                     'userName': user_name,
-                    'amount': float(amount),
+                    'amount': bid_amount,
                     'timestamp': created_at.isoformat() if created_at else datetime.now().isoformat(),
                     'isWinning': True
-                }
+                },
+                'eventId': event_id
             }),
             'isBase64Encoded': False
         }
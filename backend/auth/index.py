@@ -10,7 +10,6 @@ import os
 import secrets
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import bcrypt
 import smtplib
@@ -18,14 +17,18 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import jwt
 from jwt_middleware import get_user_from_request
+from db_pool import get_connection
+from rate_limiter import RateLimiter
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 JWT_SECRET = os.environ.get('JWT_SECRET_KEY', '')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24 * 7
 
+rate_limiter = RateLimiter(persist=True)
+
 def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return get_connection(cursor_factory=RealDictCursor)
 
 def normalize_phone(phone: str) -> str:
     """Нормализует номер телефона, убирая все спецсимволы и приводя к формату 79XXXXXXXXX"""
@@ -48,45 +51,6 @@ def generate_jwt_token(user_id: int, email: str, phone: str = None) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def check_rate_limit(conn, identifier: str, endpoint: str, max_requests: int = 10, window_minutes: int = 1) -> bool:
-    with conn.cursor() as cur:
-        window_start = datetime.now() - timedelta(minutes=window_minutes)
-        
-        cur.execute(
-            """SELECT request_count, window_start 
-               FROM rate_limits 
-               WHERE identifier = %s AND endpoint = %s""",
-            (identifier, endpoint)
-        )
-        result = cur.fetchone()
-        
-        if result:
-            if result['window_start'] > window_start:
-                if result['request_count'] >= max_requests:
-                    return False
-                cur.execute(
-                    """UPDATE rate_limits 
-                       SET request_count = request_count + 1 
-                       WHERE identifier = %s AND endpoint = %s""",
-                    (identifier, endpoint)
-                )
-            else:
-                cur.execute(
-                    """UPDATE rate_limits 
-                       SET request_count = 1, window_start = CURRENT_TIMESTAMP 
-                       WHERE identifier = %s AND endpoint = %s""",
-                    (identifier, endpoint)
-                )
-        else:
-            cur.execute(
-                """INSERT INTO rate_limits (identifier, endpoint, request_count, window_start) 
-                   VALUES (%s, %s, 1, CURRENT_TIMESTAMP)""",
-                (identifier, endpoint)
-            )
-        
-        conn.commit()
-        return True
-
 def hash_password(password: str) -> str:
     salt = bcrypt.gensalt()
     return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
@@ -243,7 +207,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = body_data.get('action')
             
             if action in ['login', 'register', 'forgot_password']:
-                if not check_rate_limit(conn, source_ip, f'auth_{action}', max_requests=5, window_minutes=1):
+                allowed, _ = rate_limiter.check_rate_limit(source_ip, max_requests=5, window_seconds=60, endpoint=f'auth_{action}')
+                rate_limiter.flush_if_due(conn)
+                if not allowed:
                     return {
                         'statusCode': 429,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,94 @@
+'''
+Сводки для списка контрактов (contracts-list):
+- contract_summary — число активных откликов, признак отменённых/отклонённых
+  откликов и последние RECENT_RESPONDENTS активных откликов контракта;
+- seller_reliability — завершённые и отменённые контракты продавца,
+  надёжность = completed / (completed + cancelled).
+Пересчитываются из исходных таблиц в транзакции, изменившей отклики или
+статус контракта, после изменения. Модуль одинаковый в contracts-list,
+contract-chat и save-contract.
+'''
+
+from typing import Iterable
+
+RECENT_RESPONDENTS = 5
+
+# Статусы отклика, которые не считаются активными
+INACTIVE_RESPONSE_STATUSES = ('cancelled', 'rejected')
+
+
+def refresh_contract_summary(cur, contract_ids: Iterable) -> None:
+    """
+    Пересчитывает contract_summary для contract_ids. Строки контрактов
+    сначала блокируются: пересчёт в параллельной транзакции дождётся коммита
+    этой и увидит её изменения, а не перезапишет их.
+    """
+    ids = sorted({int(cid) for cid in contract_ids if cid})
+    if not ids:
+        return
+    cur.execute('SELECT id FROM contracts WHERE id = ANY(%s) ORDER BY id FOR UPDATE', (ids,))
+    if not cur.fetchall():
+        return
+    cur.execute('''
+        INSERT INTO contract_summary AS s (contract_id, responses_count, has_cancelled_responses, recent_respondents)
+        SELECT c.id,
+               (SELECT COUNT(*) FROM contract_responses cr
+                WHERE cr.contract_id = c.id AND cr.status NOT IN %(inactive)s),
+               EXISTS(SELECT 1 FROM contract_responses cr
+                      WHERE cr.contract_id = c.id AND cr.status IN %(inactive)s),
+               COALESCE((
+                   SELECT jsonb_agg(jsonb_build_object('id', r.id, 'userId', r.user_id, 'status', r.status, 'createdAt', r.created_at)
+                                    ORDER BY r.created_at DESC)
+                   FROM (
+                       SELECT cr.id, cr.user_id, cr.status, cr.created_at
+                       FROM contract_responses cr
+                       WHERE cr.contract_id = c.id AND cr.status NOT IN %(inactive)s
+                       ORDER BY cr.created_at DESC
+                       LIMIT %(recent)s
+                   ) r
+               ), '[]'::jsonb)
+        FROM contracts c
+        WHERE c.id = ANY(%(ids)s)
+        ON CONFLICT (contract_id) DO UPDATE
+        SET responses_count = EXCLUDED.responses_count,
+            has_cancelled_responses = EXCLUDED.has_cancelled_responses,
+            recent_respondents = EXCLUDED.recent_respondents,
+            updated_at = CURRENT_TIMESTAMP
+    ''', {'ids': ids, 'inactive': INACTIVE_RESPONSE_STATUSES, 'recent': RECENT_RESPONDENTS})
+
+
+def refresh_seller_reliability(cur, seller_ids: Iterable) -> None:
+    """
+    Пересчитывает seller_reliability для seller_ids по индексу contracts (seller_id, status).
+    Строки сводки создаются и блокируются до подсчёта — по той же причине,
+    что и в refresh_contract_summary.
+    """
+    ids = sorted({int(sid) for sid in seller_ids if sid})
+    if not ids:
+        return
+    cur.execute('''
+        INSERT INTO seller_reliability (seller_id)
+        SELECT unnest(%s::int[])
+        ON CONFLICT (seller_id) DO NOTHING
+    ''', (ids,))
+    cur.execute('SELECT seller_id FROM seller_reliability WHERE seller_id = ANY(%s) ORDER BY seller_id FOR UPDATE', (ids,))
+    cur.fetchall()
+    cur.execute('''
+        UPDATE seller_reliability s
+        SET completed_count = agg.completed_count,
+            cancelled_count = agg.cancelled_count,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT u.seller_id,
+                   COUNT(c.id) FILTER (WHERE c.status = 'completed') AS completed_count,
+                   COUNT(c.id) FILTER (WHERE c.status = 'cancelled') AS cancelled_count
+            FROM unnest(%s::int[]) AS u(seller_id)
+            LEFT JOIN contracts c ON c.seller_id = u.seller_id
+            GROUP BY u.seller_id
+        ) agg
+        WHERE s.seller_id = agg.seller_id
+    ''', (ids,))
+
+
+def delete_contract_summary(cur, contract_id: int) -> None:
+    cur.execute('DELETE FROM contract_summary WHERE contract_id = %s', (contract_id,))
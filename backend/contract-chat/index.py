@@ -14,6 +14,7 @@ from typing import Dict, Any
 from decimal import Decimal
 import psycopg2
 from psycopg2.extras import RealDictCursor, Json as PgJson
+from contract_summary import refresh_contract_summary
 
 PUSH_SEND_PATH = '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a'
 EMAIL_NOTIFY_PATH = '/dd3295a9-ffa3-4842-8c95-de00a018ecf0'
@@ -302,6 +303,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                           neg_prepayment, contract_start_date, contract_end_date, response_id))
                     if neg_total is not None:
                         cur.execute('UPDATE contract_responses SET total_amount = %s WHERE id = %s', (neg_total, response_id))
+                    refresh_contract_summary(cur, [resp['c_id']])
                     conn.commit()
                     return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'success': True}), 'isBase64Encoded': False}
 
@@ -329,6 +331,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             WHERE id = %s
                         ''', (response_id,))
                         cur.execute("UPDATE contracts SET status = 'open' WHERE id = %s", (resp['c_id'],))
+                        refresh_contract_summary(cur, [resp['c_id']])
                     conn.commit()
                     return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'success': True, 'bothWantAmend': both_amend}), 'isBase64Encoded': False}
 
@@ -346,12 +349,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     if both:
                         cur.execute("UPDATE contract_responses SET status = 'confirmed', confirmed_at = NOW() WHERE id = %s", (response_id,))
                         cur.execute("UPDATE contracts SET status = 'signed', buyer_id = %s WHERE id = %s", (resp['user_id'], resp['c_id']))
+                        refresh_contract_summary(cur, [resp['c_id']])
                     conn.commit()
                     return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'success': True, 'bothConfirmed': both}), 'isBase64Encoded': False}
 
                 # ── Отменить отклик ────────────────────────────────────────
                 if action == 'cancel':
                     cur.execute("UPDATE contract_responses SET status = 'cancelled', updated_at = NOW() WHERE id = %s", (response_id,))
+                    refresh_contract_summary(cur, [resp['c_id']])
                     conn.commit()
                     seller_id = resp['seller_id']
                     contract_title = resp.get('contract_title', 'контракт')
@@ -0,0 +1,218 @@
+'''
+Пул соединений с PostgreSQL, общий для всех вызовов функции в контейнере
+'''
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class PooledConnection:
+    """
+    Обёртка над соединением psycopg2.
+    close() не закрывает соединение, а возвращает его в пул, поэтому
+    существующий код вида conn = get_db_connection() ... conn.close() не меняется.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._raw is None:
+            raise psycopg2.InterfaceError('connection already returned to pool')
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    @property
+    def closed(self) -> int:
+        return 1 if self._raw is None else self._raw.closed
+
+    def close(self) -> None:
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+
+    def __del__(self):
+        # Страховка: если вызывающий код забыл close(), соединение не теряется
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        max_size: int = 4,
+        acquire_timeout: float = 10.0,
+        health_check_after: float = 30.0,
+        max_idle_seconds: float = 300.0
+    ):
+        self._dsn = dsn
+        self._max_size = max_size
+        self._acquire_timeout = acquire_timeout
+        self._health_check_after = health_check_after
+        self._max_idle_seconds = max_idle_seconds
+        self._idle: deque = deque()  # (conn, время возврата в пул)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'reused': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'waits': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+        }
+
+    def _connect(self):
+        dsn = self._dsn or os.environ['DATABASE_URL']
+        return psycopg2.connect(dsn)
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self, cursor_factory=None, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        Выдаёт соединение из пула.
+        Если свободных нет и пул заполнен — ждёт до timeout секунд, затем PoolTimeoutError.
+        """
+        timeout = self._acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        raw = None
+        idle_since = None
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, idle_since = self._idle.pop()
+                    break
+                if self._size < self._max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(f'No free DB connection in {timeout}s (pool size {self._max_size})')
+                waited = True
+                self._cond.wait(remaining)
+
+        try:
+            if raw is None:
+                raw = self._connect()
+                self._stats['created'] += 1
+            else:
+                idle_for = time.monotonic() - idle_since
+                if raw.closed or idle_for > self._max_idle_seconds or (
+                    idle_for > self._health_check_after and not self._is_healthy(raw)
+                ):
+                    self._discard(raw)
+                    raw = self._connect()
+                    self._stats['reconnects'] += 1
+                else:
+                    self._stats['reused'] += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        raw.cursor_factory = cursor_factory or psycopg2.extensions.cursor
+
+        wait_ms = (time.monotonic() - started) * 1000
+        self._stats['acquired'] += 1
+        self._stats['wait_ms_total'] += wait_ms
+        self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], wait_ms)
+        if waited:
+            self._stats['waits'] += 1
+
+        return PooledConnection(self, raw)
+
+    def release(self, raw) -> None:
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+        reusable = not raw.closed
+        if reusable:
+            try:
+                if raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+                if raw.autocommit:
+                    raw.autocommit = False
+            except Exception:
+                reusable = False
+
+        with self._cond:
+            if reusable:
+                self._idle.append((raw, time.monotonic()))
+            else:
+                self._discard(raw)
+                self._stats['discarded'] += 1
+                self._size -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики пула: выдачи, ожидания, переподключения и текущий размер"""
+        with self._cond:
+            acquired = self._stats['acquired']
+            return {
+                **self._stats,
+                'wait_ms_avg': round(self._stats['wait_ms_total'] / acquired, 3) if acquired else 0.0,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self._max_size,
+            }
+
+    def close_all(self) -> None:
+        with self._cond:
+            while self._idle:
+                raw, _ = self._idle.pop()
+                self._discard(raw)
+                self._size -= 1
+
+
+db_pool = ConnectionPool(
+    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+    acquire_timeout=float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+)
+
+
+def get_connection(cursor_factory=None) -> PooledConnection:
+    """Соединение из общего пула; conn.close() возвращает его обратно"""
+    return db_pool.acquire(cursor_factory=cursor_factory)
@@ -12,14 +12,14 @@ import os
 import base64
 import uuid
 import mimetypes
-import http.client
-import threading
 import datetime
 from typing import Dict, Any
 from decimal import Decimal
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import boto3
+from db_pool import get_connection
+from notification_outbox import enqueue_notifications, kick_dispatcher
+from contract_summary import delete_contract_summary, refresh_contract_summary, refresh_seller_reliability
 
 
 class SafeEncoder(json.JSONEncoder):
@@ -30,30 +30,20 @@ class SafeEncoder(json.JSONEncoder):
             return float(obj)
         return super().default(obj)
 
-PUSH_SEND_PATH = '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a'
-EMAIL_NOTIFY_PATH = '/dd3295a9-ffa3-4842-8c95-de00a018ecf0'
 
-
-def send_push(user_id: int, title: str, message: str, url: str = '/my-contracts'):
+def notify(user_id: int, title: str, message: str, url: str = '/my-contracts', channels: tuple = ('push',)):
+    """Ставит уведомление в notification_outbox; отправляет его диспетчер в push-send"""
     try:
-        data = json.dumps({'userId': user_id, 'title': title, 'message': message, 'url': url})
-        conn = http.client.HTTPSConnection('functions.poehali.dev', timeout=8)
-        conn.request('POST', PUSH_SEND_PATH, data, {'Content-Type': 'application/json'})
-        conn.getresponse()
-        conn.close()
-    except Exception as e:
-        print(f'[PUSH] error: {e}')
-
-
-def send_email(user_id: int, title: str, message: str, url: str = '/my-contracts'):
-    try:
-        data = json.dumps({'userId': user_id, 'title': title, 'message': message, 'url': url})
-        conn = http.client.HTTPSConnection('functions.poehali.dev', timeout=8)
-        conn.request('POST', EMAIL_NOTIFY_PATH, data, {'Content-Type': 'application/json'})
-        conn.getresponse()
-        conn.close()
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                enqueue_notifications(cur, [user_id], title, message, url, channels=channels)
+            conn.commit()
+        finally:
+            conn.close()
+        kick_dispatcher()
     except Exception as e:
-        print(f'[EMAIL] error: {e}')
+        print(f'[NOTIFY] error: {e}')
 
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -73,7 +63,7 @@ def decimal_to_float(obj):
     return obj
 
 def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return get_connection(cursor_factory=RealDictCursor)
 
 
 def get_my_responses(user_id: int) -> dict:
@@ -162,6 +152,49 @@ def get_my_responses(user_id: int) -> dict:
         conn.close()
 
 
+def attach_respondents(cur, contracts: list, user_id) -> None:
+    """
+    Дополняет строки страницы списка: имена откликнувшихся из contract_summary.recent_respondents
+    и отклик текущего пользователя (my_response_id, my_cancelled_response) —
+    по одному запросу на страницу вместо подзапросов на каждую строку.
+    """
+    respondent_ids = sorted({r['userId'] for c in contracts for r in (c.get('recent_respondents') or [])})
+    users = {}
+    if respondent_ids:
+        cur.execute('SELECT id, first_name, last_name, company_name, user_type FROM users WHERE id = ANY(%s)', (respondent_ids,))
+        users = {row['id']: row for row in cur.fetchall()}
+
+    my_responses = {}
+    if user_id and contracts:
+        cur.execute(
+            'SELECT contract_id, id, status FROM contract_responses WHERE user_id = %s AND contract_id = ANY(%s) ORDER BY id',
+            (user_id, [c['id'] for c in contracts])
+        )
+        for row in cur.fetchall():
+            my_responses.setdefault(row['contract_id'], []).append(row)
+
+    for contract in contracts:
+        respondents = []
+        for r in contract.get('recent_respondents') or []:
+            u = users.get(r['userId'])
+            if not u:
+                continue
+            respondents.append({
+                'id': r['id'],
+                'firstName': u['first_name'],
+                'lastName': u['last_name'],
+                'companyName': u['company_name'] or '',
+                'userType': u['user_type'] or 'individual',
+                'status': r['status'],
+                'createdAt': r['createdAt'],
+            })
+        contract['recent_respondents'] = respondents
+
+        mine = my_responses.get(contract['id'], [])
+        contract['my_response_id'] = next((r['id'] for r in mine if r['status'] and r['status'] != 'cancelled'), None)
+        contract['my_cancelled_response'] = any(r['status'] in ('cancelled', 'rejected') for r in mine)
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     raw_method = event.get('httpMethod') or event.get('requestContext', {}).get('httpMethod') or ''
     method: str = raw_method.upper() if raw_method else 'GET'
@@ -212,6 +245,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     return {'statusCode': 400, 'headers': RESP_HEADERS, 'body': json.dumps({'error': 'Нельзя удалить контракт с активными откликами'}), 'isBase64Encoded': False}
                 cur.execute('DELETE FROM contract_responses WHERE contract_id = %s', (contract_id,))
                 cur.execute('DELETE FROM contracts WHERE id = %s', (contract_id,))
+                delete_contract_summary(cur, contract_id)
+                refresh_seller_reliability(cur, [user_id])
                 conn.commit()
                 return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'success': True, 'message': 'Контракт удалён'}), 'isBase64Encoded': False}
         finally:
@@ -255,9 +290,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     (contract_id, user_id, price_per_unit, total_amount, comment, 'pending')
                 )
                 new_id = cur.fetchone()['id']
+                refresh_contract_summary(cur, [contract_id])
                 conn.commit()
-            threading.Thread(target=send_push, args=(seller_id, 'Новый отклик на контракт', f'{respondent_name} откликнулся на «{contract_title}»', '/my-contracts'), daemon=True).start()
-            threading.Thread(target=send_email, args=(seller_id, 'Новый отклик на контракт', f'{respondent_name} откликнулся на «{contract_title}»', '/my-contracts'), daemon=True).start()
+            notify(seller_id, 'Новый отклик на контракт', f'{respondent_name} откликнулся на «{contract_title}»', '/my-contracts', channels=('push', 'email'))
             return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'id': new_id, 'message': 'Отклик успешно отправлен'}), 'isBase64Encoded': False}
         finally:
             conn.close()
@@ -306,21 +341,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         (contract_id, user_id, price_per_unit, total_amount, comment, 'pending')
                     )
                     new_id = cur.fetchone()['id']
+                    refresh_contract_summary(cur, [contract_id])
                     conn.commit()
-                threading.Thread(
-                    target=send_push,
-                    args=(seller_id, 'Новый отклик на контракт',
-                          f'{respondent_name} откликнулся на «{contract_title}»',
-                          '/my-contracts'),
-                    daemon=True
-                ).start()
-                threading.Thread(
-                    target=send_email,
-                    args=(seller_id, 'Новый отклик на контракт',
-                          f'{respondent_name} откликнулся на «{contract_title}»',
-                          '/my-contracts'),
-                    daemon=True
-                ).start()
+                notify(seller_id, 'Новый отклик на контракт',
+                       f'{respondent_name} откликнулся на «{contract_title}»',
+                       '/my-contracts', channels=('push', 'email'))
                 return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'id': new_id, 'message': 'Отклик успешно отправлен'}), 'isBase64Encoded': False}
             finally:
                 conn.close()
@@ -356,11 +381,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     if both:
                         cur.execute("UPDATE contract_responses SET status = 'confirmed', confirmed_at = NOW() WHERE id = %s", (response_id,))
                         cur.execute("UPDATE contracts SET status = 'signed', buyer_id = %s WHERE id = %s", (resp['user_id'], resp['c_id']))
+                        refresh_contract_summary(cur, [resp['c_id']])
                     conn.commit()
                     return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'success': True, 'bothConfirmed': both}), 'isBase64Encoded': False}
 
                 if action == 'cancel':
                     cur.execute("UPDATE contract_responses SET status = 'cancelled', updated_at = NOW() WHERE id = %s", (response_id,))
+                    refresh_contract_summary(cur, [resp['c_id']])
                     conn.commit()
                     return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'success': True}), 'isBase64Encoded': False}
 
@@ -405,11 +432,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 sender = cur.fetchone() or {}
                 sender_name = f"{sender.get('first_name', '')} {sender.get('last_name', '')}".strip() or 'Участник'
                 notif_text = text[:60] + '...' if len(text) > 60 else (text or 'Прикреплён файл')
-                threading.Thread(
-                    target=send_push,
-                    args=(recipient_id, f'Сообщение от {sender_name}', notif_text, '/my-contracts'),
-                    daemon=True
-                ).start()
+                notify(recipient_id, f'Сообщение от {sender_name}', notif_text, '/my-contracts')
 
                 return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'id': row['id'], 'createdAt': str(row['created_at'])}), 'isBase64Encoded': False}
         finally:
@@ -457,26 +480,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     (contract_id, user_id, price_per_unit, total_amount, comment, 'pending')
                 )
                 new_id = cur.fetchone()['id']
+                refresh_contract_summary(cur, [contract_id])
                 conn.commit()
 
                 cur.execute('SELECT u.first_name, u.last_name FROM users u WHERE u.id = %s', (user_id,))
                 respondent = cur.fetchone() or {}
                 respondent_name = f"{respondent.get('first_name', '')} {respondent.get('last_name', '')}".strip() or 'Участник'
                 contract_title = contract.get('title') or contract.get('product_name') or f'Контракт #{contract_id}'
-                threading.Thread(
-                    target=send_push,
-                    args=(contract['seller_id'], 'Новый отклик на контракт',
-                          f'{respondent_name} откликнулся на «{contract_title}»',
-                          '/my-contracts'),
-                    daemon=True
-                ).start()
-                threading.Thread(
-                    target=send_email,
-                    args=(contract['seller_id'], 'Новый отклик на контракт',
-                          f'{respondent_name} откликнулся на «{contract_title}»',
-                          '/my-contracts'),
-                    daemon=True
-                ).start()
+                notify(contract['seller_id'], 'Новый отклик на контракт',
+                       f'{respondent_name} откликнулся на «{contract_title}»',
+                       '/my-contracts', channels=('push', 'email'))
 
                 return {'statusCode': 200, 'headers': RESP_HEADERS, 'body': json.dumps({'id': new_id, 'message': 'Отклик успешно отправлен'}), 'isBase64Encoded': False}
         finally:
@@ -760,8 +773,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
             where_clause = ("WHERE " + " AND ".join(conditions)) if conditions else ""
 
-            my_response_subq = f"(SELECT id FROM contract_responses WHERE contract_id = c.id AND user_id = {user_id} AND status != 'cancelled' LIMIT 1)" if user_id else "NULL"
-            my_cancelled_subq = f"EXISTS(SELECT 1 FROM contract_responses WHERE contract_id = c.id AND user_id = {user_id} AND status IN ('cancelled','rejected'))" if user_id else "FALSE"
+            # Отклики, рейтинг и надёжность продавца — из поддерживаемых сводок
+            # (contract_summary, user_rating_summary, seller_reliability), без JOIN по откликам
             query = f"""
                 SELECT
                     c.*,
@@ -771,45 +784,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     b.first_name    as buyer_first_name,
                     b.last_name     as buyer_last_name,
                     b.company_name  as buyer_company_name,
-                    COALESCE(AVG(r.rating), 0) as seller_rating,
-                    (
-                        SELECT CASE
-                            WHEN COUNT(*) FILTER (WHERE status IN ('completed','cancelled')) = 0 THEN NULL
-                            ELSE ROUND(100.0 * COUNT(*) FILTER (WHERE status = 'completed') / COUNT(*) FILTER (WHERE status IN ('completed','cancelled')))
-                        END
-                        FROM contracts sc WHERE sc.seller_id = c.seller_id
-                    ) as reliability_score,
-                    COUNT(DISTINCT cr.id) FILTER (WHERE cr.status NOT IN ('cancelled','rejected')) as responses_count,
-                    (
-                        SELECT json_agg(json_build_object(
-                            'id', cr2.id,
-                            'firstName', u2.first_name,
-                            'lastName', u2.last_name,
-                            'companyName', COALESCE(u2.company_name, ''),
-                            'userType', COALESCE(u2.user_type, 'individual'),
-                            'status', cr2.status,
-                            'createdAt', cr2.created_at
-                        ) ORDER BY cr2.created_at DESC)
-                        FROM contract_responses cr2
-                        JOIN users u2 ON cr2.user_id = u2.id
-                        WHERE cr2.contract_id = c.id AND cr2.status NOT IN ('cancelled','rejected')
-                    ) as recent_respondents,
-                    {my_response_subq} as my_response_id,
-                    EXISTS(SELECT 1 FROM contract_responses WHERE contract_id = c.id AND status IN ('cancelled','rejected')) as has_cancelled_responses,
-                    {my_cancelled_subq} as my_cancelled_response
+                    COALESCE(rs.rating_sum::numeric / NULLIF(rs.reviews_count, 0), 0) as seller_rating,
+                    CASE
+                        WHEN COALESCE(sr.completed_count + sr.cancelled_count, 0) = 0 THEN NULL
+                        ELSE ROUND(100.0 * sr.completed_count / (sr.completed_count + sr.cancelled_count))
+                    END as reliability_score,
+                    COALESCE(cs.responses_count, 0) as responses_count,
+                    cs.recent_respondents,
+                    COALESCE(cs.has_cancelled_responses, FALSE) as has_cancelled_responses
                 FROM contracts c
                 LEFT JOIN users s ON c.seller_id = s.id
                 LEFT JOIN users b ON c.buyer_id  = b.id
-                LEFT JOIN reviews r ON r.reviewed_user_id = c.seller_id
-                LEFT JOIN contract_responses cr ON cr.contract_id = c.id
+                LEFT JOIN user_rating_summary rs ON rs.user_id = c.seller_id
+                LEFT JOIN seller_reliability sr ON sr.seller_id = c.seller_id
+                LEFT JOIN contract_summary cs ON cs.contract_id = c.id
                 {where_clause}
-                GROUP BY c.id, s.first_name, s.last_name, s.company_name, b.first_name, b.last_name, b.company_name
                 ORDER BY c.created_at DESC
                 LIMIT %s OFFSET %s
             """
             query_params.extend([limit, offset])
             cur.execute(query, tuple(query_params))
-            contracts = cur.fetchall()
+            contracts = [dict(row) for row in cur.fetchall()]
+            attach_respondents(cur, contracts, user_id)
 
             count_query = f"SELECT COUNT(*) as total FROM contracts c {where_clause}"
             cur.execute(count_query, tuple(query_params[:-2]))
@@ -8,6 +8,13 @@ from typing import Dict, Any
 
 CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB — минимальный размер части для S3 multipart
 
+# Прямая загрузка фото из браузера: исходники кладутся в папки загрузок,
+# варианты размеров строит очередь обработки в offers (?action=process-images)
+PRESIGN_FOLDERS = ('offer-uploads', 'request-uploads')
+PRESIGN_CONTENT_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/heic': 'heic', 'image/gif': 'gif'}
+PRESIGN_EXPIRES_SECONDS = 15 * 60
+PRESIGN_MAX_BYTES = 25 * 1024 * 1024
+
 
 def get_s3():
     return boto3.client(
@@ -21,6 +28,8 @@ def get_s3():
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Multipart S3 upload для больших видео файлов через чанки по 4 МБ.
+    POST /?action=presign    — подписанная ссылка PUT для прямой загрузки фото в S3
+    POST /?action=single     — загрузить файл целиком (base64)
     POST /?action=init       — инициализировать загрузку, получить upload_id и key
     POST /?action=part       — загрузить очередной чанк (base64), получить ETag
     POST /?action=complete   — завершить загрузку, получить финальный URL
@@ -54,7 +63,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
     s3 = get_s3()
 
-    if action == 'single':
+    if action == 'presign':
+        # Браузер загружает фото напрямую в S3 (PUT на uploadUrl с тем же Content-Type),
+        # затем передаёт fileUrl при создании предложения или запроса
+        content_type = body.get('contentType', 'image/jpeg')
+        folder = body.get('folder', 'offer-uploads')
+        size = int(body.get('size') or 0)
+        if folder not in PRESIGN_FOLDERS or content_type not in PRESIGN_CONTENT_TYPES:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Unsupported folder or content type'}), 'isBase64Encoded': False}
+        if size > PRESIGN_MAX_BYTES:
+            return {'statusCode': 413, 'headers': headers, 'body': json.dumps({'error': 'File is too large', 'maxBytes': PRESIGN_MAX_BYTES}), 'isBase64Encoded': False}
+
+        key = f"{folder}/{uuid.uuid4()}.{PRESIGN_CONTENT_TYPES[content_type]}"
+        upload_url = s3.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': 'files', 'Key': key, 'ContentType': content_type},
+            ExpiresIn=PRESIGN_EXPIRES_SECONDS
+        )
+        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'uploadUrl': upload_url,
+                'key': key,
+                'fileUrl': cdn_url,
+                'contentType': content_type,
+                'expiresIn': PRESIGN_EXPIRES_SECONDS,
+                'maxBytes': PRESIGN_MAX_BYTES
+            }),
+            'isBase64Encoded': False
+        }
+
+    elif action == 'single':
         # Загрузка файла целиком за один запрос (для файлов до ~6МБ base64)
         filename = body.get('filename', 'file')
         content_type = body.get('contentType', 'application/octet-stream')
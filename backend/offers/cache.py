@@ -1,44 +1,209 @@
 '''
-Простая in-memory кэш система для backend функций
+In-memory LRU кэш с TTL и инвалидацией по тегам для backend функций
 '''
 
+import base64
+import gzip
+import hashlib
+import json
 import time
-from typing import Any, Optional, Dict, Tuple
-
-class SimpleCache:
-    def __init__(self):
-        self._cache: Dict[str, Tuple[Any, float, float]] = {}
-        self._max_size = 100
-    
-    def get(self, key: str) -> Optional[Any]:
-        if key not in self._cache:
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'size', 'tags')
+
+    def __init__(self, value: Any, expires_at: float, size: int, tags: Tuple[Hashable, ...]):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.tags = tags
+
+
+def estimate_size(value: Any) -> int:
+    """Приблизительный размер значения в байтах"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 1024
+
+
+class LRUCache:
+    """
+    LRU кэш с TTL: get/set/вытеснение за O(1).
+    Ключи — кортежи, например ('offers_list', 'active', None, 20, 0).
+    Каждой записи можно назначить теги и затем сбросить все записи с тегом,
+    не перебирая весь кэш.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024, default_ttl: float = 120):
+        self._data: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._default_ttl = default_ttl
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0, 'sets': 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self._stats['misses'] += 1
             return None
-        
-        value, timestamp, ttl = self._cache[key]
-        
-        if time.time() - timestamp > ttl:
-            del self._cache[key]
+
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            self._stats['expired'] += 1
+            self._stats['misses'] += 1
             return None
-        
-        return value
-    
-    def set(self, key: str, value: Any, ttl: float = 120) -> None:
-        if len(self._cache) >= self._max_size:
-            oldest_key = min(self._cache.keys(), key=lambda k: self._cache[k][1])
-            del self._cache[oldest_key]
-        
-        self._cache[key] = (value, time.time(), ttl)
-    
-    def invalidate(self, pattern: str) -> int:
-        keys_to_delete = [k for k in self._cache.keys() if pattern in k]
-        for key in keys_to_delete:
-            del self._cache[key]
-        return len(keys_to_delete)
-    
+
+        self._data.move_to_end(key)
+        self._stats['hits'] += 1
+        return entry.value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+        tags: Iterable[Hashable] = (),
+        size: Optional[int] = None
+    ) -> None:
+        if key in self._data:
+            self._remove(key)
+
+        size = estimate_size(value) if size is None else size
+        if size > self._max_bytes:
+            return
+
+        ttl = self._default_ttl if ttl is None else ttl
+        entry = _Entry(value, time.monotonic() + ttl, size, tuple(tags))
+        self._data[key] = entry
+        self._bytes += size
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        self._stats['sets'] += 1
+
+        while len(self._data) > self._max_entries or self._bytes > self._max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self._stats['evictions'] += 1
+
+    def delete(self, key: Hashable) -> bool:
+        if key not in self._data:
+            return False
+        self._remove(key)
+        return True
+
+    def invalidate_tags(self, *tags: Hashable) -> int:
+        """Удаляет все записи, помеченные хотя бы одним из тегов"""
+        removed = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                removed += 1
+        self._stats['invalidations'] += removed
+        return removed
+
     def clear(self) -> None:
-        self._cache.clear()
-    
+        self._data.clear()
+        self._tags.clear()
+        self._bytes = 0
+
     def size(self) -> int:
-        return len(self._cache)
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'max_entries': self._max_entries,
+            'max_bytes': self._max_bytes,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+offers_cache = LRUCache()
+
+
+def offers_list_tag(status: Optional[str], scope: Any) -> Tuple[str, Optional[str], str]:
+    """Тег страницы списка: статус + 'public' или id владельца"""
+    return ('offers_list', status, str(scope) if scope else 'public')
+
+
+def offer_tag(offer_id: Any) -> Tuple[str, str]:
+    """Тег «страница содержит это предложение»"""
+    return ('offer', str(offer_id))
+
+
+def invalidate_offer(offer_id: Any = None, user_id: Any = None, statuses: Iterable[Optional[str]] = ()) -> int:
+    """
+    Сбрасывает страницы списков, затронутые изменением предложения:
+    - все страницы, на которых оно уже есть;
+    - страницы со статусами statuses (и 'all'), куда оно может попасть —
+      публичные и страницы владельца user_id.
+    """
+    tags = []
+    if offer_id is not None:
+        tags.append(offer_tag(offer_id))
+    statuses = set(statuses)
+    if statuses:
+        statuses.add('all')
+        for status in statuses:
+            tags.append(offers_list_tag(status, None))
+            if user_id is not None:
+                tags.append(offers_list_tag(status, user_id))
+    return offers_cache.invalidate_tags(*tags)
+
+
+class CachedResponse:
+    """
+    Готовый HTTP-ответ для кэша: тело уже сериализовано в JSON,
+    при достаточном размере заранее сжато gzip, посчитан ETag.
+    Попадание в кэш не требует ни json.dumps, ни сжатия.
+    """
+    __slots__ = ('body', 'etag', 'gzipped_b64', 'size')
+
+    def __init__(self, payload: Any, default=None, gzip_min_bytes: int = 1024):
+        self.body = json.dumps(payload, default=default, ensure_ascii=False)
+        raw = self.body.encode('utf-8')
+        self.etag = '"' + hashlib.sha1(raw).hexdigest() + '"'
+        self.gzipped_b64 = None
+        if len(raw) >= gzip_min_bytes:
+            self.gzipped_b64 = base64.b64encode(gzip.compress(raw, compresslevel=6)).decode('ascii')
+        self.size = len(raw) + len(self.gzipped_b64 or '')
+
+    def to_http(self, event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        """HTTP-ответ с учётом If-None-Match (304) и Accept-Encoding (gzip)"""
+        req_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        resp_headers = {**headers, 'ETag': self.etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+
+        if_none_match = req_headers.get('if-none-match', '')
+        client_etags = [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]
+        if if_none_match and (self.etag in client_etags or '*' in client_etags):
+            return {'statusCode': 304, 'headers': resp_headers, 'body': '', 'isBase64Encoded': False}
+
+        if self.gzipped_b64 is not None and 'gzip' in req_headers.get('accept-encoding', ''):
+            return {
+                'statusCode': 200,
+                'headers': {**resp_headers, 'Content-Encoding': 'gzip'},
+                'body': self.gzipped_b64,
+                'isBase64Encoded': True
+            }
 
-offers_cache = SimpleCache()
+        return {'statusCode': 200, 'headers': resp_headers, 'body': self.body, 'isBase64Encoded': False}
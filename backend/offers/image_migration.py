@@ -0,0 +1,485 @@
+'''
+Фоновая миграция изображений предложений:
+- 'to-s3'     — base64 data URL из offer_images.url перекодируются и загружаются в S3;
+- 'remigrate' — изображения с CDN скачиваются, перекодируются (EXIF-ориентация)
+                и перезаписываются, url получает ?v= для сброса кэша CDN.
+Оба задания пишут варианты 200/400/800 (image_variants) в offer_images.variants,
+так что remigrate заодно заполняет варианты для ранее загруженных изображений.
+
+Строки выбираются пачками по первичному ключу после курсора задания
+(image_migration_jobs.last_id). Декодирование и сжатие Pillow идут в пуле
+процессов, скачивание и загрузка в S3 — в пуле потоков на одном клиенте boto3.
+Новые url пачки записываются одним UPDATE ... FROM (VALUES ...) в той же
+транзакции, что и курсор, поэтому после прерывания работа продолжается
+со следующей необработанной пачки.
+'''
+
+import base64
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import boto3
+import psycopg2.extensions
+import requests
+from botocore.config import Config
+from psycopg2.extras import execute_values
+
+from image_variants import plan_uploads, render_variants
+
+MIGRATION_SCHEMA = os.environ.get('DB_SCHEMA', 't_p42562714_web_app_creation_1')
+
+MIGRATION_BATCH_SIZE = int(os.environ.get('IMAGE_MIGRATION_BATCH_SIZE', '32'))
+# Сколько секунд один вызов обрабатывает пачки (меньше таймаута функции)
+MIGRATION_TIME_BUDGET_SECONDS = float(os.environ.get('IMAGE_MIGRATION_TIME_BUDGET', '20'))
+ENCODE_WORKERS = int(os.environ.get('IMAGE_ENCODE_WORKERS', str(min(4, os.cpu_count() or 1))))
+IO_WORKERS = int(os.environ.get('IMAGE_IO_WORKERS', '8'))
+# Аренда задания продлевается после каждой пачки; зависший вызов освобождает её сам
+LEASE_SECONDS = 60
+MAX_REPORTED_ERRORS = 20
+
+S3_BUCKET = 'files'
+S3_PREFIX = 'offer-images'
+
+JOBS = {
+    'to-s3': "url LIKE 'data:image%%'",
+    'remigrate': "url LIKE 'https://%%' AND processing_status IS NULL",
+}
+
+# Очередь загруженных исходников (image_uploads): попытки и зависшие захваты
+PROCESSING_MAX_ATTEMPTS = 3
+PROCESSING_STALE_MINUTES = 5
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+
+
+def encode_source(source) -> Dict[int, Dict[str, Any]]:
+    """Задача пула процессов: data URL или исходные байты → варианты 200/400/800 (WebP + JPEG)"""
+    if isinstance(source, str):
+        source = base64.b64decode(source.split(',', 1)[1])
+    return render_variants(source)
+
+
+class MigrationWorkers:
+    """
+    Пулы контейнера, переиспользуемые между вызовами: процессы для Pillow
+    (при недоступности fork — потоки), потоки для HTTP/S3 и общий клиент S3
+    с пулом соединений по числу потоков.
+    """
+
+    def __init__(self, encode_workers: int = ENCODE_WORKERS, io_workers: int = IO_WORKERS):
+        self._encode_workers = encode_workers
+        self._io_workers = io_workers
+        self._encode_pool: Optional[Executor] = None
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+        self._s3 = None
+        self._http: Optional[requests.Session] = None
+        self.encode_mode = None
+
+    @property
+    def encode_pool(self) -> Executor:
+        if self._encode_pool is None:
+            try:
+                self._encode_pool = ProcessPoolExecutor(
+                    max_workers=self._encode_workers,
+                    mp_context=multiprocessing.get_context('fork')
+                )
+                self.encode_mode = 'processes'
+            except (OSError, ValueError, NotImplementedError) as e:
+                # Нет /dev/shm или fork в окружении — сжатие в потоках (Pillow отпускает GIL)
+                print(f'[IMAGE_MIGRATION] process pool unavailable, using threads: {e}')
+                self._encode_pool = ThreadPoolExecutor(max_workers=self._encode_workers)
+                self.encode_mode = 'threads'
+        return self._encode_pool
+
+    @property
+    def io_pool(self) -> ThreadPoolExecutor:
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=self._io_workers)
+        return self._io_pool
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = boto3.client('s3',
+                endpoint_url='https://bucket.poehali.dev',
+                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+                config=Config(max_pool_connections=self._io_workers),
+            )
+        return self._s3
+
+    @property
+    def http(self) -> requests.Session:
+        if self._http is None:
+            self._http = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._io_workers)
+            self._http.mount('https://', adapter)
+        return self._http
+
+    def reset_encode_pool(self) -> None:
+        """Пул процессов сломан (процесс убит по памяти) — пересоздаётся при следующем обращении"""
+        if self._encode_pool is not None:
+            self._encode_pool.shutdown(wait=False, cancel_futures=True)
+            self._encode_pool = None
+
+    def download(self, url: str) -> bytes:
+        response = self.http.get(url, timeout=10)
+        if response.status_code != 200:
+            raise Exception(f"Failed to download: {response.status_code}")
+        return response.content
+
+    def fetch_upload(self, s3_key: str) -> bytes:
+        """Исходник из папки загрузок; размер проверяется до чтения тела"""
+        obj = self.s3.get_object(Bucket=S3_BUCKET, Key=s3_key)
+        if obj['ContentLength'] > MAX_SOURCE_BYTES:
+            obj['Body'].close()
+            raise Exception(f"Source is too large: {obj['ContentLength']} bytes")
+        return obj['Body'].read()
+
+    def upload(self, s3_key: str, data: bytes, content_type: str) -> None:
+        self.s3.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=data, ContentType=content_type)
+
+
+migration_workers = MigrationWorkers()
+
+
+def _acquire_job(cur, job: str, restart: bool) -> Optional[Dict[str, Any]]:
+    """
+    Берёт аренду задания. Проход начинается заново при restart, а для 'to-s3'
+    ещё и после завершения прошлого прохода (новые base64 могли появиться позже).
+    None — задание уже выполняет другой вызов.
+    """
+    cur.execute(f"""
+        INSERT INTO {MIGRATION_SCHEMA}.image_migration_jobs (job) VALUES (%s)
+        ON CONFLICT (job) DO NOTHING
+    """, (job,))
+    cur.execute(f"""
+        WITH claimed AS (
+            SELECT job, %(restart)s OR (%(rerun)s AND finished_at IS NOT NULL) AS reset
+            FROM {MIGRATION_SCHEMA}.image_migration_jobs
+            WHERE job = %(job)s AND (locked_until IS NULL OR locked_until < NOW())
+            FOR UPDATE
+        )
+        UPDATE {MIGRATION_SCHEMA}.image_migration_jobs j
+        SET locked_until = NOW() + make_interval(secs => %(lease)s),
+            last_id = CASE WHEN claimed.reset THEN NULL ELSE j.last_id END,
+            processed = CASE WHEN claimed.reset THEN 0 ELSE j.processed END,
+            migrated = CASE WHEN claimed.reset THEN 0 ELSE j.migrated END,
+            failed = CASE WHEN claimed.reset THEN 0 ELSE j.failed END,
+            work_ms = CASE WHEN claimed.reset THEN 0 ELSE j.work_ms END,
+            last_error = CASE WHEN claimed.reset THEN NULL ELSE j.last_error END,
+            finished_at = CASE WHEN claimed.reset THEN NULL ELSE j.finished_at END,
+            started_at = CASE WHEN claimed.reset OR j.started_at IS NULL THEN NOW() ELSE j.started_at END
+        FROM claimed
+        WHERE j.job = claimed.job
+        RETURNING j.last_id::text, j.finished_at
+    """, {'job': job, 'restart': restart, 'rerun': job == 'to-s3', 'lease': LEASE_SECONDS})
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {'last_id': row[0], 'finished': row[1] is not None}
+
+
+def _process_batch(job: str, rows: List[Tuple[str, str]], version: int) -> Tuple[List[Tuple[str, str, str]], List[Dict[str, str]]]:
+    """
+    Перекодирует и загружает пачку строк (id, источник): data URL для 'to-s3',
+    url CDN для 'remigrate', ключ S3 исходника для 'process'.
+    Возвращает (id, новый url, variants) успешных строк и ошибки.
+    """
+    workers = migration_workers
+    errors: List[Dict[str, str]] = []
+
+    if job == 'to-s3':
+        sources = {image_id: workers.encode_pool.submit(encode_source, url) for image_id, url in rows}
+    else:
+        # remigrate скачивает с CDN по url, очередь загрузок — из S3 по source_key
+        fetch = workers.download if job == 'remigrate' else workers.fetch_upload
+        downloads = {image_id: workers.io_pool.submit(fetch, source) for image_id, source in rows}
+        sources = {}
+        for image_id, future in downloads.items():
+            try:
+                sources[image_id] = workers.encode_pool.submit(encode_source, future.result())
+            except Exception as e:
+                errors.append({'id': image_id, 'error': str(e)})
+
+    uploads = {}
+    for image_id, future in sources.items():
+        try:
+            rendered = future.result()
+        except BrokenProcessPool as e:
+            workers.reset_encode_pool()
+            errors.append({'id': image_id, 'error': str(e)})
+            continue
+        except Exception as e:
+            errors.append({'id': image_id, 'error': str(e)})
+            continue
+        # remigrate перезаписывает те же ключи S3 — без новой версии CDN продолжит отдавать старый файл
+        url, variants, planned = plan_uploads(
+            f"{S3_PREFIX}/{image_id}", rendered, version if job == 'remigrate' else None
+        )
+        futures = [workers.io_pool.submit(workers.upload, key, body, content_type) for key, body, content_type in planned]
+        uploads[image_id] = (url, variants, futures)
+
+    updates = []
+    for image_id, (url, variants, futures) in uploads.items():
+        try:
+            for future in futures:
+                future.result()
+        except Exception as e:
+            errors.append({'id': image_id, 'error': str(e)})
+            continue
+        updates.append((image_id, url, json.dumps(variants)))
+    return updates, errors
+
+
+def run_migration(conn, job: str, restart: bool = False,
+                  time_budget: float = MIGRATION_TIME_BUDGET_SECONDS,
+                  batch_size: int = MIGRATION_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Обрабатывает пачки задания, пока не истечёт time_budget или не закончатся строки.
+    Повторный вызов продолжает с сохранённого курсора.
+    """
+    if job not in JOBS:
+        raise ValueError(f'Unknown migration job: {job}')
+
+    started = time.monotonic()
+    version = int(time.time())
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    result = {'job': job, 'running': True, 'batches': 0, 'processed': 0, 'migrated': 0, 'failed': 0, 'errors': []}
+    try:
+        state = _acquire_job(cur, job, restart)
+        conn.commit()
+        if state is None:
+            return {**result, 'running': False, 'locked': True}
+        if state['finished']:
+            return {**result, 'running': False, 'finished': True}
+
+        last_id = state['last_id']
+        finished = False
+        while time.monotonic() - started < time_budget:
+            cur.execute(f"""
+                SELECT id::text, url FROM {MIGRATION_SCHEMA}.offer_images
+                WHERE {JOBS[job]} AND (%(last_id)s::uuid IS NULL OR id > %(last_id)s::uuid)
+                ORDER BY id
+                LIMIT %(limit)s
+            """, {'last_id': last_id, 'limit': batch_size})
+            rows = cur.fetchall()
+            if not rows:
+                finished = True
+                break
+
+            batch_started = time.monotonic()
+            updates, errors = _process_batch(job, rows, version)
+            work_ms = int((time.monotonic() - batch_started) * 1000)
+            last_id = rows[-1][0]
+
+            if updates:
+                execute_values(cur, f"""
+                    UPDATE {MIGRATION_SCHEMA}.offer_images AS oi
+                    SET url = v.url, variants = v.variants::jsonb
+                    FROM (VALUES %s) AS v(id, url, variants)
+                    WHERE oi.id = v.id::uuid
+                """, updates, page_size=len(updates))
+            cur.execute(f"""
+                UPDATE {MIGRATION_SCHEMA}.image_migration_jobs
+                SET last_id = %(last_id)s::uuid,
+                    processed = processed + %(processed)s,
+                    migrated = migrated + %(migrated)s,
+                    failed = failed + %(failed)s,
+                    work_ms = work_ms + %(work_ms)s,
+                    last_error = COALESCE(%(error)s, last_error),
+                    updated_at = NOW(),
+                    locked_until = NOW() + make_interval(secs => %(lease)s)
+                WHERE job = %(job)s
+            """, {
+                'job': job,
+                'last_id': last_id,
+                'processed': len(rows),
+                'migrated': len(updates),
+                'failed': len(errors),
+                'work_ms': work_ms,
+                'error': f"{errors[-1]['id']}: {errors[-1]['error']}"[:1000] if errors else None,
+                'lease': LEASE_SECONDS,
+            })
+            conn.commit()
+
+            result['batches'] += 1
+            result['processed'] += len(rows)
+            result['migrated'] += len(updates)
+            result['failed'] += len(errors)
+            for error in errors:
+                print(f"[IMAGE_MIGRATION] {job} {error['id']}: {error['error']}")
+            result['errors'].extend(errors[:MAX_REPORTED_ERRORS - len(result['errors'])])
+
+            if len(rows) < batch_size:
+                finished = True
+                break
+
+        cur.execute(f"""
+            UPDATE {MIGRATION_SCHEMA}.image_migration_jobs
+            SET locked_until = NULL,
+                finished_at = CASE WHEN %s THEN NOW() ELSE finished_at END,
+                updated_at = NOW()
+            WHERE job = %s
+        """, (finished, job))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    elapsed = time.monotonic() - started
+    result['running'] = not finished
+    result['finished'] = finished
+    result['elapsedMs'] = int(elapsed * 1000)
+    result['imagesPerSecond'] = round(result['processed'] / elapsed, 2) if elapsed > 0 else 0
+    result['encodeMode'] = migration_workers.encode_mode
+    return result
+
+
+def process_pending_images(conn, time_budget: float = MIGRATION_TIME_BUDGET_SECONDS,
+                           batch_size: int = MIGRATION_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Обрабатывает очередь загруженных исходников (processing_status = 'pending').
+    Пачка захватывается с SKIP LOCKED, поэтому обработчики из нескольких
+    контейнеров не мешают друг другу; захваты, зависшие дольше
+    PROCESSING_STALE_MINUTES, забираются повторно. После PROCESSING_MAX_ATTEMPTS
+    неудач строка остаётся с исходником в url и статусом 'failed'.
+    В offerIds — предложения, у которых сменился url изображения (для сброса кэша списков).
+    """
+    started = time.monotonic()
+    version = int(time.time())
+    result = {'batches': 0, 'processed': 0, 'failed': 0, 'errors': []}
+    offer_ids = set()
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        while time.monotonic() - started < time_budget:
+            cur.execute(f"""
+                UPDATE {MIGRATION_SCHEMA}.offer_images
+                SET processing_status = 'processing',
+                    processing_attempts = processing_attempts + 1,
+                    processing_claimed_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM {MIGRATION_SCHEMA}.offer_images
+                    WHERE processing_status = 'pending'
+                       OR (processing_status = 'processing'
+                           AND processing_claimed_at < NOW() - make_interval(mins => %s))
+                    ORDER BY created_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id::text, source_key
+            """, (PROCESSING_STALE_MINUTES, batch_size))
+            rows = cur.fetchall()
+            conn.commit()
+            if not rows:
+                break
+
+            updates, errors = _process_batch('process', rows, version)
+            if updates:
+                execute_values(cur, f"""
+                    UPDATE {MIGRATION_SCHEMA}.offer_images AS oi
+                    SET url = v.url, variants = v.variants::jsonb,
+                        processing_status = NULL, processing_error = NULL
+                    FROM (VALUES %s) AS v(id, url, variants)
+                    WHERE oi.id = v.id::uuid
+                """, updates, page_size=len(updates))
+                cur.execute(f"""
+                    SELECT DISTINCT offer_id::text FROM {MIGRATION_SCHEMA}.offer_image_relations
+                    WHERE image_id = ANY(%s::uuid[])
+                """, ([image_id for image_id, _, _ in updates],))
+                offer_ids.update(row[0] for row in cur.fetchall())
+            if errors:
+                execute_values(cur, f"""
+                    UPDATE {MIGRATION_SCHEMA}.offer_images AS oi
+                    SET processing_status = CASE WHEN oi.processing_attempts >= {PROCESSING_MAX_ATTEMPTS}
+                                                 THEN 'failed' ELSE 'pending' END,
+                        processing_error = v.error
+                    FROM (VALUES %s) AS v(id, error)
+                    WHERE oi.id = v.id::uuid
+                """, [(error['id'], error['error'][:1000]) for error in errors], page_size=len(errors))
+            conn.commit()
+
+            result['batches'] += 1
+            result['processed'] += len(updates)
+            result['failed'] += len(errors)
+            for error in errors:
+                print(f"[IMAGE_PROCESSING] {error['id']}: {error['error']}")
+            result['errors'].extend(errors[:MAX_REPORTED_ERRORS - len(result['errors'])])
+            if len(rows) < batch_size:
+                break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    result['offerIds'] = sorted(offer_ids)
+    result['elapsedMs'] = int((time.monotonic() - started) * 1000)
+    return result
+
+
+def queue_status(conn) -> Dict[str, int]:
+    """Размер очереди обработки загруженных изображений по статусам"""
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cur.execute(f"""
+            SELECT processing_status, COUNT(*) FROM {MIGRATION_SCHEMA}.offer_images
+            WHERE processing_status IS NOT NULL
+            GROUP BY processing_status
+        """)
+        counts = {'pending': 0, 'processing': 0, 'failed': 0}
+        counts.update({status: count for status, count in cur.fetchall()})
+        conn.commit()
+        return counts
+    finally:
+        cur.close()
+
+
+def job_status(conn) -> Dict[str, Any]:
+    """Курсор, счётчики и пропускная способность каждого задания"""
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cur.execute(f"""
+            SELECT job, last_id::text, processed, migrated, failed, work_ms, last_error,
+                   started_at, updated_at, finished_at,
+                   locked_until IS NOT NULL AND locked_until > NOW() AS running
+            FROM {MIGRATION_SCHEMA}.image_migration_jobs
+        """)
+        rows = cur.fetchall()
+        jobs = {}
+        for job, last_id, processed, migrated, failed, work_ms, last_error, started_at, updated_at, finished_at, running in rows:
+            if job not in JOBS:
+                continue
+            remaining = 0
+            if finished_at is None:
+                cur.execute(f"""
+                    SELECT COUNT(*) FROM {MIGRATION_SCHEMA}.offer_images
+                    WHERE {JOBS[job]} AND (%(last_id)s::uuid IS NULL OR id > %(last_id)s::uuid)
+                """, {'last_id': last_id})
+                remaining = cur.fetchone()[0]
+            per_second = processed / (work_ms / 1000) if work_ms else 0
+            jobs[job] = {
+                'lastId': last_id,
+                'processed': processed,
+                'migrated': migrated,
+                'failed': failed,
+                'remaining': remaining,
+                'progress': round(processed / (processed + remaining) * 100, 2) if processed + remaining else 100.0,
+                'imagesPerSecond': round(per_second, 2),
+                'etaSeconds': round(remaining / per_second) if per_second else None,
+                'lastError': last_error,
+                'running': running,
+                'startedAt': started_at.isoformat() if started_at else None,
+                'updatedAt': updated_at.isoformat() if updated_at else None,
+                'finishedAt': finished_at.isoformat() if finished_at else None,
+            }
+        conn.commit()
+        return jobs
+    finally:
+        cur.close()
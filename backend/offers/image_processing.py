@@ -0,0 +1,124 @@
+'''
+Общая обработка фото на Pillow (offers, requests, upload-video):
+- проверка размера файла и числа пикселей до декодирования (защита от
+  decompression bomb);
+- JPEG декодируется сразу в уменьшенном масштабе через draft() (1/2, 1/4, 1/8),
+  когда нужен результат заметно меньше исходника — для фото с телефона
+  в 4–8 раз меньше памяти и времени на декодирование;
+- поворот по EXIF и заливка прозрачности белым фоном за один проход.
+Замеры: scripts/benchmark_image_processing.py.
+'''
+
+import math
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+# 50 Мп — с запасом для камер телефонов (12–48 Мп); больше — отказ без декодирования
+MAX_IMAGE_PIXELS = 50_000_000
+MAX_INPUT_BYTES = 50 * 1024 * 1024
+
+# Pillow сам поднимает DecompressionBombError при превышении лимита вдвое;
+# open_image отказывает уже на самом лимите
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# EXIF Orientation, при которых ширина и высота меняются местами
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+_EXIF_ORIENTATION = 0x0112
+
+
+class ImageProcessingError(Exception):
+    """Файл не является допустимым изображением или превышает лимиты"""
+
+
+def open_image(data: bytes) -> Image.Image:
+    """Открывает изображение без декодирования пикселей и проверяет лимиты"""
+    if len(data) > MAX_INPUT_BYTES:
+        raise ImageProcessingError(f'Image file is too large: {len(data)} bytes')
+    try:
+        img = Image.open(BytesIO(data))
+    except (Image.DecompressionBombError, Image.UnidentifiedImageError, OSError) as e:
+        raise ImageProcessingError(str(e))
+    if img.width * img.height > MAX_IMAGE_PIXELS:
+        raise ImageProcessingError(f'Image has too many pixels: {img.width}x{img.height}')
+    return img
+
+
+def displayed_size(img: Image.Image) -> Tuple[int, int]:
+    """Размер с учётом EXIF-поворота (каким его увидит пользователь)"""
+    try:
+        orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+    except Exception:
+        orientation = 1
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        return img.height, img.width
+    return img.width, img.height
+
+
+def _scale_for(size: Tuple[int, int], max_width: Optional[int], max_side: Optional[int]) -> float:
+    width, height = size
+    scale = 1.0
+    if max_width:
+        scale = min(scale, max_width / width)
+    if max_side:
+        scale = min(scale, max_side / max(width, height))
+    return scale
+
+
+def to_rgb(img: Image.Image, background: Tuple[int, int, int] = (255, 255, 255)) -> Image.Image:
+    """RGB без прозрачности: альфа-канал накладывается на фон, остальные режимы конвертируются"""
+    if img.mode == 'RGB':
+        return img
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        canvas = Image.new('RGB', img.size, background)
+        canvas.paste(img.convert('RGBA') if img.mode == 'PA' else img, mask=img.getchannel('A'))
+        return canvas
+    return img.convert('RGB')
+
+
+def load_image(data: bytes, max_width: Optional[int] = None, max_side: Optional[int] = None,
+               flatten: bool = True) -> Image.Image:
+    """
+    Декодирует изображение, поворачивает по EXIF и (при flatten) приводит к RGB.
+    max_width / max_side — итоговый размер, который нужен вызывающему: JPEG
+    декодируется в ближайшем масштабе не меньше него, дальнейшее уменьшение
+    (resize_within) делает вызывающий код.
+    """
+    img = open_image(data)
+    if img.format == 'JPEG' and (max_width or max_side):
+        shown_w, shown_h = displayed_size(img)
+        scale = _scale_for((shown_w, shown_h), max_width, max_side)
+        if scale < 0.5:
+            # draft() работает в координатах файла, до поворота
+            img.draft(img.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    try:
+        img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        print(f"Warning: Could not fix EXIF orientation: {str(e)}")
+    return to_rgb(img) if flatten else img
+
+
+def resize_within(img: Image.Image, max_width: Optional[int] = None,
+                  max_side: Optional[int] = None) -> Image.Image:
+    """Уменьшает (не увеличивает) изображение до max_width / max_side, LANCZOS с предварительным reduce()"""
+    scale = _scale_for(img.size, max_width, max_side)
+    if scale >= 1.0:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def encode(img: Image.Image, image_format: str = 'JPEG', quality: int = 85) -> bytes:
+    """Кодирование в JPEG / WEBP / PNG"""
+    image_format = image_format.upper()
+    output = BytesIO()
+    if image_format == 'JPEG':
+        to_rgb(img).save(output, format='JPEG', quality=quality, optimize=True)
+    elif image_format == 'WEBP':
+        img.save(output, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(output, format=image_format)
+    return output.getvalue()
@@ -2,19 +2,22 @@
 
 import json
 import os 
-import base64
 import time
-import http.client
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 from decimal import Decimal
-from io import BytesIO
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import boto3
 from PIL import Image
-from cache import offers_cache
+from cache import offers_cache, offers_list_tag, offer_tag, invalidate_offer, CachedResponse
 from rate_limiter import rate_limiter
+from db_pool import get_connection, db_pool
+from pagination import decode_cursor, split_page, estimate_count, page_meta
+from search import search_filter, search_rank
+from image_migration import run_migration, job_status, queue_status, process_pending_images, migration_workers
+from image_variants import render_image_variants, upload_variants, thumbnail_url
+from image_processing import load_image
+from image_uploads import prepare_image, kick_image_processing, ImageUploadError
 
 
 def decimal_default(obj):
@@ -24,9 +27,34 @@ def decimal_default(obj):
     raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
+# Предложение со статусом active, срок которого уже истёк, но archive-expired ещё не отработал
+ACTIVE_NOT_EXPIRED_SQL = """(
+    (o.expiry_date IS NULL OR o.expiry_date >= NOW())
+    AND (o.delivery_period_end IS NULL OR o.delivery_period_end >= CURRENT_DATE)
+    AND (o.transport_date_time IS NULL OR o.transport_date_time = ''
+         OR CAST(o.transport_date_time AS timestamp) >= NOW())
+)"""
+
+
 def get_db_connection():
-    """Подключение к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Подключение к базе данных из пула контейнера"""
+    return get_connection()
+
+def is_admin(user_id: Optional[str]) -> bool:
+    """Пользователь — администратор (role admin/superadmin или корневой администратор)"""
+    if not user_id or not str(user_id).isdigit():
+        return False
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("SELECT role, is_root_admin FROM t_p42562714_web_app_creation_1.users WHERE id = %s", (int(user_id),))
+        user = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    if not user:
+        return False
+    return user['role'] in ('admin', 'superadmin') or user['is_root_admin'] == True
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -76,7 +104,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -97,17 +125,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             # Специальный эндпоинт для миграции изображений
             if action == 'migrate-images':
-                return migrate_images_to_s3(headers)
+                return migrate_images_to_s3(query_params, headers)
             elif action == 'migration-status':
                 return get_migration_status(headers)
             elif action == 'remigrate-all':
-                return remigrate_all_images(headers)
+                return remigrate_all_images(query_params, headers)
+            elif action == 'process-images':
+                return process_uploaded_images(headers)
             elif action == 'rotate-image':
                 image_id = query_params.get('image_id')
                 degrees = int(query_params.get('degrees', 90))
                 if not image_id:
                     return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'image_id required'}), 'isBase64Encoded': False}
                 return rotate_image(image_id, degrees, headers)
+            elif action in ('db-pool-stats', 'cache-stats'):
+                # Внутренние метрики контейнера — только администраторам
+                req_headers = event.get('headers') or {}
+                if not is_admin(req_headers.get('X-User-Id') or req_headers.get('x-user-id')):
+                    return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Admin access required'}), 'isBase64Encoded': False}
+                stats = db_pool.stats() if action == 'db-pool-stats' else offers_cache.stats()
+                return {'statusCode': 200, 'headers': headers, 'body': json.dumps(stats), 'isBase64Encoded': False}
             elif action == 'recalculate-quantities':
                 return recalculate_quantities(query_params.get('userId'), headers)
             elif offer_id:
@@ -182,83 +219,34 @@ def get_offers_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
         except:
             offset = 0
         
+        # Keyset-пагинация: ?cursor= (пустой для первой страницы) вместо offset.
+        # total=exact|approx — по желанию посчитать общее количество
+        cursor_mode = 'cursor' in query_params
+        cursor_param = query_params.get('cursor') or ''
+        cursor = decode_cursor(cursor_param) if cursor_mode else None
+        total_mode = query_params.get('total')
+        search_text = (query_params.get('query') or '').strip()
+        
         # ⚡ КЭШИРОВАНИЕ: Проверяем кэш для списка предложений
-        cache_key = f"offers_list:{status_filter}:{user_id_filter}:{limit}:{offset}"
-        cached_result = offers_cache.get(cache_key)
-        if cached_result is not None:
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps(cached_result),
-                'isBase64Encoded': False
-            }
+        if cursor_mode:
+            cache_key = ('offers_list', status_filter, user_id_filter, limit, 'cursor', cursor_param, total_mode, search_text)
+        else:
+            cache_key = ('offers_list', status_filter, user_id_filter, limit, offset, search_text)
+        cached_response = offers_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response.to_http(event, headers)
         
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
-        # Авто-архивация истёкших предложений по expiry_date
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.offers
-            SET status = 'archived', updated_at = NOW()
-            WHERE status = 'active'
-              AND expiry_date IS NOT NULL
-              AND expiry_date < NOW()
-            RETURNING user_id, title
-        """)
-        expired_offers = cur.fetchall()
-
-        # Авто-архивация предложений с истёкшим периодом поставки
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.offers
-            SET status = 'archived', updated_at = NOW()
-            WHERE status = 'active'
-              AND delivery_period_end IS NOT NULL
-              AND delivery_period_end < CURRENT_DATE
-            RETURNING user_id, title
-        """)
-        expired_offers += cur.fetchall()
-
-        # Авто-архивация транспортных предложений с истёкшей датой выезда
-        cur.execute("""
-            UPDATE t_p42562714_web_app_creation_1.offers
-            SET status = 'archived', updated_at = NOW()
-            WHERE status = 'active'
-              AND transport_date_time IS NOT NULL
-              AND transport_date_time != ''
-              AND CAST(transport_date_time AS timestamp) < NOW()
-            RETURNING user_id, title
-        """)
-        expired_offers += cur.fetchall()
-        conn.commit()
-
-        # Сбрасываем кеш если были архивированы записи
-        if expired_offers:
-            offers_cache.clear()
-
-        # Уведомляем владельцев об архивации
-        for row in expired_offers:
-            try:
-                payload = json.dumps({
-                    'userId': row['user_id'],
-                    'title': 'Предложение снято с публикации',
-                    'message': f'Срок публикации предложения «{row["title"]}» истёк. Перейдите в «Мои предложения» чтобы опубликовать снова.',
-                    'url': '/my-offers'
-                })
-                for endpoint in ['/d49f8584-6ef9-47c0-9661-02560166e10f', '/3c4b3e64-cb71-4b82-abd5-e67393be3d43']:
-                    try:
-                        conn2 = http.client.HTTPSConnection('functions.poehali.dev', timeout=3)
-                        conn2.request('POST', endpoint, payload, {'Content-Type': 'application/json'})
-                        conn2.getresponse().read()
-                        conn2.close()
-                    except Exception:
-                        pass
-            except Exception as e:
-                print(f'[EXPIRY] Notification error: {e}')
-
         # Строим WHERE условия
         where_conditions = []
         if status_filter and status_filter != 'all':
             where_conditions.append(f"o.status = '{status_filter}'")
+        if status_filter == 'active':
+            # Архивацию выполняет archive-expired по расписанию; до её запуска
+            # истёкшие предложения просто не попадают в выдачу
+            where_conditions.append(ACTIVE_NOT_EXPIRED_SQL)
         if user_id_filter:
             where_conditions.append(f"o.user_id = {user_id_filter}")
         else:
@@ -269,12 +257,38 @@ def get_offers_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
                 "(o.quantity = 0 OR (o.sold_quantity + COALESCE(o.reserved_quantity, 0)) < o.quantity)"
             )
         
+        # Полнотекстовый поиск по search_vector (GIN) + подстрока заголовка (триграммы)
+        where_params = []
+        search_sql, search_params = search_filter('o', search_text)
+        if search_sql:
+            where_conditions.append(search_sql)
+            where_params += search_params
+        
         where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
         
-        # Получаем общее количество записей (для hasMore на фронте)
-        count_sql = f"SELECT COUNT(*) as total FROM t_p42562714_web_app_creation_1.offers o {where_clause}"
-        cur.execute(count_sql)
-        total_count = cur.fetchone()['total']
+        # Общее количество: в режиме offset — всегда (для совместимости),
+        # в режиме курсора — только по запросу, точно или по оценке планировщика
+        total_count = None
+        if not cursor_mode or total_mode == 'exact':
+            count_sql = f"SELECT COUNT(*) as total FROM t_p42562714_web_app_creation_1.offers o {where_clause}"
+            cur.execute(count_sql, where_params or None)
+            total_count = cur.fetchone()['total']
+        elif total_mode == 'approx':
+            total_count = estimate_count(cur, f"SELECT 1 FROM t_p42562714_web_app_creation_1.offers o {where_clause}", where_params or None)
+        
+        # Релевантность поиска; в режиме offset результаты поиска сортируются по ней
+        rank_sql, rank_params = search_rank('o', search_text) if search_sql else ('0.0', [])
+        order_sql = "o.created_at DESC, o.id DESC"
+        if search_sql and not cursor_mode:
+            order_sql = "search_rank DESC, " + order_sql
+        
+        page_clause = where_clause
+        page_params = rank_params + where_params
+        if cursor:
+            keyset = "(o.created_at, o.id) < (%s, %s)"
+            page_clause = f"{where_clause} AND {keyset}" if where_clause else f"WHERE {keyset}"
+            page_params += list(cursor)
+        pagination_sql = f"LIMIT {limit + 1}" if cursor_mode else f"LIMIT {limit} OFFSET {offset}"
         
         # Получаем записи с пагинацией с JOIN на users для получения рейтинга
         sql = f"""
@@ -289,30 +303,41 @@ def get_offers_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
                 o.auto_make, o.auto_model, o.auto_year, o.auto_body_type, o.auto_color,
                 o.auto_fuel_type, o.auto_transmission, o.auto_drive_type, o.auto_mileage,
                 o.auto_pts_records, o.auto_description,
-                COALESCE(u.rating, 100.0) as seller_rating
+                COALESCE(u.rating, 100.0) as seller_rating,
+                {rank_sql} as search_rank
             FROM t_p42562714_web_app_creation_1.offers o
             LEFT JOIN t_p42562714_web_app_creation_1.users u ON o.user_id = u.id
-            {where_clause}
-            ORDER BY o.created_at DESC 
-            LIMIT {limit} OFFSET {offset}
+            {page_clause}
+            ORDER BY {order_sql}
+            {pagination_sql}
         """
         
-        cur.execute(sql)
+        cur.execute(sql, page_params or None)
         offers = cur.fetchall()
         
+        if cursor_mode:
+            offers, has_more, next_cursor = split_page(offers, limit, 'created_at')
+        
         images_map = {}
         favorites_map = {}
         if len(offers) > 0:
             offer_ids = [str(offer['id']) for offer in offers]
             ids_list = ','.join([f"'{oid}'" for oid in offer_ids])
-            # Загружаем только CDN изображения (которые уже мигрированы в S3)
-            images_sql = f"SELECT DISTINCT ON (oir.offer_id) oir.offer_id, oi.id, oi.url FROM t_p42562714_web_app_creation_1.offer_image_relations oir JOIN t_p42562714_web_app_creation_1.offer_images oi ON oir.image_id = oi.id WHERE oir.offer_id IN ({ids_list}) AND oi.url LIKE 'https://%' ORDER BY oir.offer_id, oir.sort_order"
+            # Загружаем только CDN изображения (которые уже мигрированы в S3) с готовыми вариантами:
+            # необработанный исходник (до 25 МБ, heic) карточке не отдаём — без изображений она показывает плейсхолдер
+            images_sql = f"SELECT DISTINCT ON (oir.offer_id) oir.offer_id, oi.id, oi.url, oi.variants FROM t_p42562714_web_app_creation_1.offer_image_relations oir JOIN t_p42562714_web_app_creation_1.offer_images oi ON oir.image_id = oi.id WHERE oir.offer_id IN ({ids_list}) AND oi.url LIKE 'https://%' AND oi.processing_status IS NULL ORDER BY oir.offer_id, oir.sort_order"
             
             cur.execute(images_sql)
             images_results = cur.fetchall()
             
             for img_row in images_results:
-                images_map[img_row['offer_id']] = [{'id': str(img_row['id']), 'url': img_row['url'], 'alt': ''}]
+                images_map[img_row['offer_id']] = [{
+                    'id': str(img_row['id']),
+                    'url': img_row['url'],
+                    'thumbnailUrl': thumbnail_url(img_row['variants'], img_row['url']),
+                    'thumbnailJpegUrl': thumbnail_url(img_row['variants'], img_row['url'], fmt='jpeg'),
+                    'alt': ''
+                }]
             
             # Загружаем количество избранного отдельным запросом
             try:
@@ -379,27 +404,34 @@ def get_offers_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
                     'rating': seller_rating
                 }
             })
+            if search_sql:
+                result[-1]['searchRank'] = float(offer.get('search_rank') or 0)
         
         cur.close()
         conn.close()
         
-        response_data = {
-            'offers': result, 
-            'total': total_count,
-            'limit': limit,
-            'offset': offset,
-            'hasMore': offset + len(result) < total_count
-        }
+        if cursor_mode:
+            response_data = {
+                'offers': result,
+                **page_meta(limit, has_more, next_cursor, total_count, approximate=total_mode == 'approx')
+            }
+        else:
+            response_data = {
+                'offers': result, 
+                'total': total_count,
+                'limit': limit,
+                'offset': offset,
+                'hasMore': offset + len(result) < total_count
+            }
         
-        # ⚡ Кэшируем результат на 2 минуты
-        offers_cache.set(cache_key, response_data, ttl=120)
+        # ⚡ Кэшируем готовый ответ (JSON + gzip + ETag) на 2 минуты;
+        # теги позволяют сбросить только затронутые страницы
+        response = CachedResponse(response_data, default=decimal_default)
+        page_tags = [offers_list_tag(status_filter, user_id_filter)]
+        page_tags += [offer_tag(offer['id']) for offer in result]
+        offers_cache.set(cache_key, response, ttl=120, tags=page_tags, size=response.size)
         
-        return {
-            'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps(response_data),
-            'isBase64Encoded': False
-        }
+        return response.to_http(event, headers)
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -434,7 +466,7 @@ def get_offer_by_id(offer_id: str, event: Dict[str, Any], headers: Dict[str, str
             ov.url as video_url,
             COALESCE(
                 json_agg(
-                    json_build_object('id', oi.id, 'url', oi.url, 'alt', oi.alt)
+                    json_build_object('id', oi.id, 'url', oi.url, 'alt', oi.alt, 'variants', oi.variants)
                     ORDER BY oir.sort_order
                 ) FILTER (WHERE oi.id IS NOT NULL),
                 '[]'
@@ -462,6 +494,7 @@ def get_offer_by_id(offer_id: str, event: Dict[str, Any], headers: Dict[str, str
         }
     
     offer_dict = dict(offer)
+    offer_dict.pop('search_vector', None)
     
     # Увеличиваем счетчик просмотров — только не для автора
     author_id = str(offer_dict.get('user_id', ''))
@@ -760,46 +793,30 @@ def create_offer(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
     result = cur.fetchone()
     offer_id = result['id']
     
-    s3 = None
-    
-    if body.get('images') or body.get('video'):
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        )
+    queued_images = 0
+    skipped_images = 0
     
     if body.get('images'):
         for idx, img in enumerate(body['images']):
-            img_url = img['url']
-            
-            # Если изображение base64 - автоматически мигрируем в S3
-            if img_url.startswith('data:image'):
-                try:
-                    header, base64_data = img_url.split(',', 1)
-                    image_data = base64.b64decode(base64_data)
-                    optimized_data = optimize_image(image_data)
-                    
-                    # Генерируем уникальное имя файла
-                    import uuid
-                    file_id = str(uuid.uuid4())
-                    s3_key = f"offer-images/{file_id}.jpg"
-                    
-                    s3.put_object(Bucket='files', Key=s3_key, Body=optimized_data, ContentType='image/jpeg')
-                    img_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}"
-                except Exception as e:
-                    print(f"Failed to auto-migrate image: {str(e)}")
-                    # Если миграция не удалась, сохраняем base64 как есть
+            # Исходник из папки загрузок (или data URL старого клиента, положенный в S3 как есть)
+            # ставится в очередь; варианты строит process-images после ответа
+            try:
+                img_url, source_key = prepare_image(lambda: migration_workers.s3, img['url'], 'offer-uploads')
+            except ImageUploadError as e:
+                print(f"Failed to accept image: {str(e)}")
+                skipped_images += 1
+                continue
             
-            url_esc = img_url.replace("'", "''")
-            alt_esc = img.get('alt', '').replace("'", "''")
             cur.execute(
-                f"INSERT INTO t_p42562714_web_app_creation_1.offer_images (url, alt) VALUES ('{url_esc}', '{alt_esc}') RETURNING id"
+                "INSERT INTO t_p42562714_web_app_creation_1.offer_images (url, alt, processing_status, source_key) VALUES (%s, %s, %s, %s) RETURNING id",
+                (img_url, img.get('alt', ''), 'pending' if source_key else None, source_key)
             )
             image_id = cur.fetchone()['id']
             cur.execute(
                 f"INSERT INTO t_p42562714_web_app_creation_1.offer_image_relations (offer_id, image_id, sort_order) VALUES ('{offer_id}', '{image_id}', {idx})"
             )
+            if source_key:
+                queued_images += 1
     
     # Обработка видео (теперь принимаем готовый URL)
     if body.get('videoUrl'):
@@ -830,13 +847,21 @@ def create_offer(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
     cur.close()
     conn.close()
     
-    # ⚡ Инвалидируем кэш после создания предложения
-    offers_cache.invalidate('offers_list')
+    if queued_images:
+        kick_image_processing()
+    
+    # ⚡ Инвалидируем страницы, куда может попасть новое предложение
+    invalidate_offer(user_id=user_id, statuses=(body.get('status', 'active'),))
     
     return {
         'statusCode': 201,
         'headers': headers,
-        'body': json.dumps({'id': str(offer_id), 'message': 'Offer created successfully'}, default=decimal_default),
+        'body': json.dumps({
+            'id': str(offer_id),
+            'message': 'Offer created successfully',
+            'imagesProcessing': queued_images,
+            'imagesSkipped': skipped_images
+        }, default=decimal_default),
         'isBase64Encoded': False
     }
 
@@ -862,6 +887,13 @@ def update_offer(offer_id: str, event: Dict[str, Any], headers: Dict[str, str])
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
+        # Владелец и текущий статус — для точечной инвалидации кэша
+        cur.execute(
+            "SELECT user_id, status FROM t_p42562714_web_app_creation_1.offers WHERE id = %s",
+            (offer_id,)
+        )
+        offer_before = cur.fetchone() or {}
+        
         # Валидация изменения количества
         if 'quantity' in body:
             offer_id_esc = offer_id.replace("'", "''")
@@ -1031,13 +1063,8 @@ def update_offer(offer_id: str, event: Dict[str, Any], headers: Dict[str, str])
             print(f"UPDATE OFFER - Video processed, video_data={video_data}")
         
         # Обработка изображений
+        queued_images = 0
         if 'images' in body:
-            s3 = boto3.client('s3',
-                endpoint_url='https://bucket.poehali.dev',
-                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-            )
-            
             offer_id_esc = offer_id.replace("'", "''")
             
             # Удаляем старые связи изображений
@@ -1045,27 +1072,14 @@ def update_offer(offer_id: str, event: Dict[str, Any], headers: Dict[str, str])
             
             # Добавляем новые изображения
             for idx, img in enumerate(body['images']):
-                img_url = img['url']
-                
-                # Если изображение base64 - загружаем в S3
-                if img_url.startswith('data:image'):
-                    try:
-                        header, base64_data = img_url.split(',', 1)
-                        image_data = base64.b64decode(base64_data)
-                        optimized_data = optimize_image(image_data)
-                        
-                        import uuid
-                        file_id = str(uuid.uuid4())
-                        s3_key = f"offer-images/{file_id}.jpg"
-                        
-                        s3.put_object(Bucket='files', Key=s3_key, Body=optimized_data, ContentType='image/jpeg')
-                        img_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}"
-                    except Exception as e:
-                        print(f"Failed to upload image to S3: {str(e)}")
-                        continue
+                # Новые исходники ставятся в очередь обработки, data URL в БД не сохраняется
+                try:
+                    img_url, source_key = prepare_image(lambda: migration_workers.s3, img['url'], 'offer-uploads')
+                except ImageUploadError as e:
+                    print(f"Failed to accept image: {str(e)}")
+                    continue
                 
                 url_esc = img_url.replace("'", "''")
-                alt_esc = img.get('alt', '').replace("'", "''")
                 
                 # Проверяем существует ли изображение с таким URL
                 cur.execute(f"SELECT id FROM t_p42562714_web_app_creation_1.offer_images WHERE url = '{url_esc}'")
@@ -1075,9 +1089,12 @@ def update_offer(offer_id: str, event: Dict[str, Any], headers: Dict[str, str])
                     image_id = existing_image['id']
                 else:
                     cur.execute(
-                        f"INSERT INTO t_p42562714_web_app_creation_1.offer_images (url, alt) VALUES ('{url_esc}', '{alt_esc}') RETURNING id"
+                        "INSERT INTO t_p42562714_web_app_creation_1.offer_images (url, alt, processing_status, source_key) VALUES (%s, %s, %s, %s) RETURNING id",
+                        (img_url, img.get('alt', ''), 'pending' if source_key else None, source_key)
                     )
                     image_id = cur.fetchone()['id']
+                    if source_key:
+                        queued_images += 1
                 
                 # Создаем связь
                 cur.execute(
@@ -1096,9 +1113,16 @@ def update_offer(offer_id: str, event: Dict[str, Any], headers: Dict[str, str])
         cur.close()
         conn.close()
         
-        # ⚡ Инвалидируем кэш после обновления предложения
-        offers_cache.invalidate('offers_list')
-        offers_cache.invalidate(f'offer_detail:{offer_id}')
+        if queued_images:
+            kick_image_processing()
+        
+        # ⚡ Инвалидируем страницы с этим предложением и списки его старого/нового статуса
+        new_status = body.get('status') or ('active' if body.get('expiryDate') else None)
+        invalidate_offer(
+            offer_id,
+            user_id=offer_before.get('user_id'),
+            statuses=[s for s in (offer_before.get('status'), new_status) if s]
+        )
         
         return {
             'statusCode': 200,
@@ -1157,8 +1181,8 @@ def delete_offer(offer_id: str, headers: Dict[str, str]) -> Dict[str, Any]:
         cur.close()
         conn.close()
         
-        # Инвалидируем кэш
-        offers_cache.invalidate('offers_list')
+        # Инвалидируем страницы, на которых было предложение
+        invalidate_offer(offer_id)
         
         print(f"Successfully deleted offer {offer_id}")
         
@@ -1180,83 +1204,25 @@ def delete_offer(offer_id: str, headers: Dict[str, str]) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
 
-def optimize_image(image_data: bytes, max_width: int = 800, quality: int = 85) -> bytes:
-    """Оптимизация изображения: resize + сжатие + исправление EXIF ориентации"""
-    img = Image.open(BytesIO(image_data))
-    
-    # КРИТИЧНО: Исправляем ориентацию по EXIF (для фото с мобильных камер)
+def run_image_migration(job: str, query_params: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Очередная порция фоновой миграции изображений; повторные вызовы продолжают с курсора"""
+    conn = get_db_connection()
     try:
-        from PIL import ImageOps
-        img = ImageOps.exif_transpose(img)
-    except Exception as e:
-        print(f"Warning: Could not fix EXIF orientation: {str(e)}")
-    
-    # Конвертируем RGBA в RGB
-    if img.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        if img.mode == 'P':
-            img = img.convert('RGBA')
-        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-        img = background
-    
-    # Resize если нужно
-    if img.width > max_width:
-        ratio = max_width / img.width
-        new_height = int(img.height * ratio)
-        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-    
-    output = BytesIO()
-    img.save(output, format='JPEG', quality=quality, optimize=True)
-    return output.getvalue()
+        result = run_migration(conn, job, restart=query_params.get('restart') in ('1', 'true'))
+    finally:
+        conn.close()
 
-def migrate_images_to_s3(headers: Dict[str, str]) -> Dict[str, Any]:
-    """Миграция base64 изображений в S3 с оптимизацией"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    s3 = boto3.client('s3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
-    
-    cur.execute("SELECT id, url FROM t_p42562714_web_app_creation_1.offer_images WHERE url LIKE 'data:image%' LIMIT 10")
-    images = cur.fetchall()
-    
-    migrated_count = 0
-    errors = []
-    
-    for img in images:
-        try:
-            data_url = img['url']
-            header, base64_data = data_url.split(',', 1)
-            image_data = base64.b64decode(base64_data)
-            optimized_data = optimize_image(image_data)
-            
-            s3_key = f"offer-images/{img['id']}.jpg"
-            s3.put_object(Bucket='files', Key=s3_key, Body=optimized_data, ContentType='image/jpeg')
-            
-            cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}"
-            cdn_url_esc = cdn_url.replace("'", "''")
-            img_id_esc = str(img['id']).replace("'", "''")
-            
-            cur.execute(f"UPDATE t_p42562714_web_app_creation_1.offer_images SET url = '{cdn_url_esc}' WHERE id = '{img_id_esc}'")
-            migrated_count += 1
-            
-        except Exception as e:
-            errors.append({'id': str(img['id']), 'error': str(e)})
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
     return {
-        'statusCode': 200,
+        'statusCode': 409 if result.get('locked') else 200,
         'headers': headers,
-        'body': json.dumps({'migrated': migrated_count, 'errors': errors}),
+        'body': json.dumps(result),
         'isBase64Encoded': False
     }
 
+def migrate_images_to_s3(query_params: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Миграция base64 изображений в S3 с оптимизацией"""
+    return run_image_migration('to-s3', query_params, headers)
+
 def get_migration_status(headers: Dict[str, str]) -> Dict[str, Any]:
     """Получить статус миграции изображений"""
     conn = get_db_connection()
@@ -1269,6 +1235,8 @@ def get_migration_status(headers: Dict[str, str]) -> Dict[str, Any]:
     cdn_count = cur.fetchone()['count']
     
     cur.close()
+    jobs = job_status(conn)
+    processing_queue = queue_status(conn)
     conn.close()
     
     total = base64_count + cdn_count
@@ -1281,65 +1249,39 @@ def get_migration_status(headers: Dict[str, str]) -> Dict[str, Any]:
             'total': total,
             'base64': base64_count,
             'cdn': cdn_count,
-            'progress': round(progress, 2)
+            'progress': round(progress, 2),
+            'jobs': jobs,
+            'processingQueue': processing_queue,
+            'encodeMode': migration_workers.encode_mode
         }),
         'isBase64Encoded': False
     }
 
-def remigrate_all_images(headers: Dict[str, str]) -> Dict[str, Any]:
-    """Ре-миграция всех CDN изображений с исправлением EXIF ориентации"""
+def process_uploaded_images(headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Обработка очереди загруженных изображений (варианты размеров); вызывается
+    после создания/изменения и по расписанию из archive-expired
+    """
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    s3 = boto3.client('s3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
-    
-    # Получаем CDN изображения
-    cur.execute("SELECT id, url FROM t_p42562714_web_app_creation_1.offer_images WHERE url LIKE 'https://%' LIMIT 5")
-    images = cur.fetchall()
-    
-    remigrated_count = 0
-    errors = []
-    
-    for img in images:
-        try:
-            import requests
-            cdn_url = img['url']
-            
-            # Скачиваем изображение с CDN
-            response = requests.get(cdn_url, timeout=10)
-            if response.status_code != 200:
-                raise Exception(f"Failed to download: {response.status_code}")
-            
-            image_data = response.content
-            
-            # Оптимизируем с исправлением EXIF
-            optimized_data = optimize_image(image_data)
-            
-            # Загружаем обратно в S3 (перезаписываем)
-            s3_key = f"offer-images/{img['id']}.jpg"
-            s3.put_object(Bucket='files', Key=s3_key, Body=optimized_data, ContentType='image/jpeg')
-            
-            remigrated_count += 1
-            
-        except Exception as e:
-            errors.append({'id': str(img['id']), 'error': str(e)})
-            print(f"Failed to remigrate image {img['id']}: {str(e)}")
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    try:
+        result = process_pending_images(conn)
+    finally:
+        conn.close()
+    # В списках вместо исходника был плейсхолдер — страницы с этими предложениями сбрасываем
+    for processed_offer_id in result['offerIds']:
+        invalidate_offer(processed_offer_id)
     
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'remigrated': remigrated_count, 'errors': errors}),
+        'body': json.dumps(result),
         'isBase64Encoded': False
     }
 
+def remigrate_all_images(query_params: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Ре-миграция всех CDN изображений с исправлением EXIF ориентации (restart=1 — новый проход)"""
+    return run_image_migration('remigrate', query_params, headers)
+
 def rotate_image(image_id: str, degrees: int, headers: Dict[str, str]) -> Dict[str, Any]:
     """Повернуть изображение на заданное количество градусов"""
     conn = get_db_connection()
@@ -1376,8 +1318,8 @@ def rotate_image(image_id: str, degrees: int, headers: Dict[str, str]) -> Dict[s
         if response.status_code != 200:
             raise Exception(f"Failed to download: {response.status_code}")
         
-        # Открываем и поворачиваем
-        img = Image.open(BytesIO(response.content))
+        # Открываем (одно декодирование, EXIF уже учтён) и поворачиваем
+        img = load_image(response.content)
         
         # Поворачиваем (PIL поворачивает против часовой стрелки)
         if degrees == -90 or degrees == 270:
@@ -1387,22 +1329,14 @@ def rotate_image(image_id: str, degrees: int, headers: Dict[str, str]) -> Dict[s
         elif degrees == 180 or degrees == -180:
             img = img.transpose(Image.Transpose.ROTATE_180)
         
-        # Сохраняем
-        output = BytesIO()
-        img.save(output, format='JPEG', quality=85, optimize=True)
-        rotated_data = output.getvalue()
-        
-        # Загружаем обратно в S3
-        s3_key = f"offer-images/{image_id}.jpg"
-        s3.put_object(Bucket='files', Key=s3_key, Body=rotated_data, ContentType='image/jpeg')
-        
-        # Обновляем URL с версией для обхода CDN кэша
-        import time
+        # Загружаем обратно в S3 все варианты; URL с версией для обхода CDN кэша
         version = int(time.time())
-        new_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}?v={version}"
-        new_url_esc = new_url.replace("'", "''")
+        new_url, variants = upload_variants(s3, f"offer-images/{image_id}", render_image_variants(img), version)
         
-        cur.execute(f"UPDATE t_p42562714_web_app_creation_1.offer_images SET url = '{new_url_esc}' WHERE id = '{image_id_esc}'")
+        cur.execute(
+            "UPDATE t_p42562714_web_app_creation_1.offer_images SET url = %s, variants = %s WHERE id = %s",
+            (new_url, json.dumps(variants), image_id)
+        )
         conn.commit()
         
         cur.close()
@@ -1454,11 +1388,18 @@ def recalculate_quantities(user_id, headers):
                       AND ord.status = 'accepted'
                 ), 0)
             WHERE true {offer_filter}
+            RETURNING o.id
         """)
-        updated = cur.rowcount
+        updated_ids = [row[0] for row in cur.fetchall()]
+        updated = len(updated_ids)
         conn.commit()
         print(f"[RECALC] Recalculated quantities for {updated} offers (user_id={user_id})")
-        offers_cache.clear()
+        if user_id:
+            for updated_id in updated_ids:
+                invalidate_offer(updated_id)
+            invalidate_offer(user_id=user_id, statuses=('active',))
+        else:
+            offers_cache.clear()
 
         cur.close()
         conn.close()
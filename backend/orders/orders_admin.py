@@ -3,7 +3,7 @@ import json
 from typing import Dict, Any
 from datetime import datetime
 from psycopg2.extras import RealDictCursor
-from orders_utils import get_db_connection, get_schema, send_notification, offers_cache
+from orders_utils import get_db_connection, get_schema, send_notification, invalidate_offer, refresh_request_stats
 
 
 def cancel_trip_handler(offer_id: str, event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
@@ -65,7 +65,7 @@ def cancel_trip_handler(offer_id: str, event: Dict[str, Any], headers: Dict[str,
             """).format(schema=pgsql.Identifier(schema)),
             (total_returned, offer_id)
         )
-        offers_cache.clear()
+        invalidate_offer(offer_id, user_id=seller_user_id, statuses=('active',))
 
         cur.execute(
             pgsql.SQL("""
@@ -132,10 +132,12 @@ def cleanup_orphaned_orders(event: Dict[str, Any], headers: Dict[str, str]) -> D
         ids_str = "', '".join([str(oid).replace("'", "''") for oid in orphaned_ids])
         sql_delete_messages = f"DELETE FROM {schema}.order_messages WHERE order_id IN ('{ids_str}')"
         cur.execute(sql_delete_messages)
+        cur.execute(f"DELETE FROM {schema}.order_unread_counters WHERE order_id IN ('{ids_str}')")
         
         sql_delete_orders = f"DELETE FROM {schema}.orders WHERE id IN ('{ids_str}')"
         cur.execute(sql_delete_orders)
         deleted_count = cur.rowcount
+        refresh_request_stats(cur, schema, [order['offer_id'] for order in orphaned])
         
         conn.commit()
     
@@ -175,7 +177,7 @@ def admin_archive_order(order_id: str, event: Dict[str, Any], headers: Dict[str,
     reason_escaped = reason.replace("'", "''")
     now = datetime.utcnow()
 
-    cur.execute(f"SELECT id, buyer_id, seller_id, order_number, title FROM {schema}.orders WHERE id = '{order_id_escaped}'")
+    cur.execute(f"SELECT id, buyer_id, seller_id, order_number, title, offer_id FROM {schema}.orders WHERE id = '{order_id_escaped}'")
     order = cur.fetchone()
     if not order:
         cur.close()
@@ -191,6 +193,7 @@ def admin_archive_order(order_id: str, event: Dict[str, Any], headers: Dict[str,
             updated_at = %s
         WHERE id = '{order_id_escaped}'
     """, (now, now))
+    refresh_request_stats(cur, schema, [order['offer_id']])
 
     conn.commit()
     cur.close()
@@ -234,7 +237,7 @@ def delete_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
     
     order_id_escaped = order_id.replace("'", "''")
     
-    cur.execute(f"SELECT buyer_id, seller_id, status FROM {schema}.orders WHERE id = '{order_id_escaped}'")
+    cur.execute(f"SELECT buyer_id, seller_id, status, offer_id FROM {schema}.orders WHERE id = '{order_id_escaped}'")
     order = cur.fetchone()
     
     if not order:
@@ -270,7 +273,9 @@ def delete_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
         }
     
     cur.execute(f"DELETE FROM {schema}.order_messages WHERE order_id = '{order_id_escaped}'")
+    cur.execute(f"DELETE FROM {schema}.order_unread_counters WHERE order_id = '{order_id_escaped}'")
     cur.execute(f"DELETE FROM {schema}.orders WHERE id = '{order_id_escaped}'")
+    refresh_request_stats(cur, schema, [order['offer_id']])
     
     conn.commit()
     cur.close()
@@ -308,7 +313,9 @@ def cleanup_all_orders(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[s
     messages_count = cur.fetchone()['cnt']
     
     cur.execute(f"DELETE FROM {schema}.order_messages")
+    cur.execute(f"DELETE FROM {schema}.order_unread_counters")
     cur.execute(f"DELETE FROM {schema}.orders")
+    cur.execute(f"DELETE FROM {schema}.request_stats")
     
     conn.commit()
     cur.close()
@@ -1,16 +1,19 @@
 """CRUD операции с заказами: создание, получение, обновление, проверка отклика"""
 import json
 import uuid
-import threading
 from decimal import Decimal
 from datetime import datetime, date
 from typing import Dict, Any
 from psycopg2.extras import RealDictCursor
 from orders_utils import (
-    get_db_connection, get_schema, send_notification,
+    get_db_connection, get_schema,
     generate_order_number, reject_other_responses,
-    decimal_to_float, offers_cache
+    decimal_to_float, invalidate_offer, queue_order_event, refresh_request_stats,
+    ORDER_CREATED, ORDER_COUNTER_OFFER, ORDER_COUNTER_ACCEPTED, ORDER_ACCEPTED,
+    ORDER_REJECTED, ORDER_CANCELLED, ORDER_COMPLETION_REQUESTED, ORDER_COMPLETED
 )
+from notification_outbox import kick_dispatcher
+from pagination import decode_cursor, split_page, estimate_count, page_meta
 
 
 class SafeJSONEncoder(json.JSONEncoder):
@@ -92,7 +95,12 @@ def get_user_orders(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
     limit = int(params.get('limit', '50'))
     offset = int(params.get('offset', '0'))
     
-    print(f"[GET_USER_ORDERS] type={order_type}, status={status}, limit={limit}, offset={offset}")
+    # Keyset-пагинация: ?cursor= (пустой для первой страницы) вместо offset
+    cursor_mode = 'cursor' in params
+    cursor = decode_cursor(params.get('cursor')) if cursor_mode else None
+    total_mode = params.get('total')
+    
+    print(f"[GET_USER_ORDERS] type={order_type}, status={status}, limit={limit}, offset={offset}, cursor={cursor}")
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -101,21 +109,26 @@ def get_user_orders(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
     
     schema = get_schema()
     
-    count_sql = f"SELECT COUNT(*) as total FROM {schema}.orders WHERE 1=1"
+    count_from = f"FROM {schema}.orders WHERE 1=1"
     
     if order_type == 'purchase':
-        count_sql += f" AND buyer_id = {user_id_int}"
+        count_from += f" AND buyer_id = {user_id_int}"
     elif order_type == 'sale':
-        count_sql += f" AND seller_id = {user_id_int}"
+        count_from += f" AND seller_id = {user_id_int}"
     else:
-        count_sql += f" AND (buyer_id = {user_id_int} OR seller_id = {user_id_int})"
+        count_from += f" AND (buyer_id = {user_id_int} OR seller_id = {user_id_int})"
     
     if status != 'all':
         status_escaped = status.replace("'", "''")
-        count_sql += f" AND status = '{status_escaped}'"
+        count_from += f" AND status = '{status_escaped}'"
     
-    cur.execute(count_sql)
-    total_count = cur.fetchone()['total']
+    # В режиме курсора COUNT(*) считается только по запросу (total=exact|approx)
+    total_count = None
+    if not cursor_mode or total_mode == 'exact':
+        cur.execute(f"SELECT COUNT(*) as total {count_from}")
+        total_count = cur.fetchone()['total']
+    elif total_mode == 'approx':
+        total_count = estimate_count(cur, f"SELECT 1 {count_from}")
     
     sql = f"""
         SELECT 
@@ -129,20 +142,19 @@ def get_user_orders(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
             o.offer_transport_date_time as _o_transport_date_time,
             of.transport_negotiable as offer_transport_negotiable,
             CASE WHEN r.id IS NOT NULL THEN true ELSE false END as is_request,
-            COALESCE((
-                SELECT COUNT(*) FROM {schema}.order_messages om 
-                WHERE om.order_id = o.id AND om.is_read = false 
-                AND om.sender_id != {user_id_int}
-            ), 0) as unread_messages,
+            COALESCE(CASE WHEN o.buyer_id = {user_id_int} THEN uc.buyer_unread ELSE uc.seller_unread END, 0) as unread_messages,
             ub.rating as buyer_rating,
             us.rating as seller_rating,
-            (SELECT AVG(rv.rating) FROM {schema}.reviews rv WHERE rv.reviewed_user_id = o.seller_id) as seller_avg_review_rating,
-            (SELECT AVG(rv.rating) FROM {schema}.reviews rv WHERE rv.reviewed_user_id = o.buyer_id) as buyer_avg_review_rating
+            rs_seller.rating_sum::numeric / NULLIF(rs_seller.reviews_count, 0) as seller_avg_review_rating,
+            rs_buyer.rating_sum::numeric / NULLIF(rs_buyer.reviews_count, 0) as buyer_avg_review_rating
         FROM {schema}.orders o
         LEFT JOIN {schema}.offers of ON o.offer_id = of.id
         LEFT JOIN {schema}.requests r ON o.offer_id = r.id
         LEFT JOIN {schema}.users ub ON o.buyer_id = ub.id
         LEFT JOIN {schema}.users us ON o.seller_id = us.id
+        LEFT JOIN {schema}.order_unread_counters uc ON uc.order_id = o.id
+        LEFT JOIN {schema}.user_rating_summary rs_seller ON rs_seller.user_id = o.seller_id
+        LEFT JOIN {schema}.user_rating_summary rs_buyer ON rs_buyer.user_id = o.buyer_id
         WHERE 1=1
     """
     
@@ -157,13 +169,24 @@ def get_user_orders(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
         status_escaped = status.replace("'", "''")
         sql += f" AND o.status = '{status_escaped}'"
     
-    sql += f" ORDER BY order_date DESC LIMIT {limit} OFFSET {offset}"
+    page_params = []
+    if cursor:
+        sql += " AND (o.order_date, o.id) < (%s, %s)"
+        page_params = list(cursor)
+    
+    if cursor_mode:
+        sql += f" ORDER BY o.order_date DESC, o.id DESC LIMIT {limit + 1}"
+    else:
+        sql += f" ORDER BY o.order_date DESC, o.id DESC LIMIT {limit} OFFSET {offset}"
     
     print(f"[GET_USER_ORDERS] SQL: {sql}")
     
-    cur.execute(sql)
+    cur.execute(sql, page_params or None)
     orders = cur.fetchall()
     
+    if cursor_mode:
+        orders, has_more, next_cursor = split_page(orders, limit, 'order_date')
+    
     print(f"[GET_USER_ORDERS] Found {len(orders)} orders")
     
     result = []
@@ -221,6 +244,9 @@ def get_user_orders(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
         'statusCode': 200,
         'headers': headers,
         'body': json.dumps({
+            'orders': result,
+            **page_meta(limit, has_more, next_cursor, total_count, approximate=total_mode == 'approx')
+        } if cursor_mode else {
             'orders': result,
             'total': total_count,
             'limit': limit,
@@ -523,45 +549,33 @@ def create_order(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
             WHERE id = '{offer_id_escaped}'
         """
         cur.execute(update_offer_sql)
-        offers_cache.clear()
-    
+        invalidate_offer(offer_id)
+    else:
+        refresh_request_stats(cur, schema, [body['offerId']])
+
+    if initial_status == 'negotiating':
+        notification_title = 'Новое встречное предложение по заказу'
+        notification_message = f'Покупатель предложил {counter_price} ₽ за единицу товара "{body["title"]}"'
+    else:
+        notification_title = 'Новый заказ на ваше предложение'
+        pickup = body.get('passengerPickupAddress', '')
+        pickup_info = f' | Посадка: {pickup}' if pickup else ''
+        notification_message = f'Получен заказ на "{body["title"]}" на сумму {total_amount:,.0f} ₽{pickup_info}'
+
+    seller_tab = 'my-requests' if is_request else 'seller'
+    order_url = f'/my-orders?tab={seller_tab}&orderId={result["id"]}'
+
+    # Уведомление продавцу ставится в очередь в той же транзакции, что и заказ;
+    # отправляет его диспетчер, ответ клиенту ограничен только транзакцией
+    queue_order_event(
+        cur, ORDER_COUNTER_OFFER if initial_status == 'negotiating' else ORDER_CREATED,
+        result['id'], seller_id, notification_title, notification_message, order_url
+    )
+
     conn.commit()
     cur.close()
     conn.close()
-    
-    try:
-        if initial_status == 'negotiating':
-            notification_title = 'Новое встречное предложение по заказу'
-            notification_message = f'Покупатель предложил {counter_price} ₽ за единицу товара "{body["title"]}"'
-        else:
-            notification_title = 'Новый заказ на ваше предложение'
-            pickup = body.get('passengerPickupAddress', '')
-            pickup_info = f' | Посадка: {pickup}' if pickup else ''
-            notification_message = f'Получен заказ на "{body["title"]}" на сумму {total_amount:,.0f} ₽{pickup_info}'
-
-        call_type = 'response' if is_request else 'order'
-        seller_tab = 'my-requests' if is_request else 'seller'
-        order_url = f'/my-orders?tab={seller_tab}&orderId={result["id"]}'
-
-        # Push и звонок запускаем параллельно — не ждём друг друга
-        t_notif = threading.Thread(
-            target=send_notification,
-            args=(seller_id, notification_title, notification_message, order_url),
-            daemon=False
-        )
-        t_call = threading.Thread(
-            target=send_call,
-            args=(seller_phone,),
-            kwargs={'call_type': call_type},
-            daemon=False
-        )
-        t_notif.start()
-        t_call.start()
-        # Ждём оба завершения (таймаут 25 сек суммарно)
-        t_notif.join(timeout=12)
-        t_call.join(timeout=12)
-    except Exception as e:
-        print(f'Notification error: {e}')
+    kick_dispatcher()
     
     return {
         'statusCode': 201,
@@ -652,6 +666,8 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
                     pgsql.SQL("UPDATE {schema}.offers SET reserved_quantity = GREATEST(0, COALESCE(reserved_quantity, 0) + %s) WHERE id = %s").format(schema=pgsql.Identifier(schema)),
                     (qty_diff, str(order['offer_id']))
                 )
+            if qty_diff != 0 and order.get('offer_id'):
+                refresh_request_stats(cur, schema, [order['offer_id']])
             conn.commit()
             cur.close()
             conn.close()
@@ -723,7 +739,7 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
             """).format(schema=pgsql.Identifier(schema)),
             (order_quantity, order_quantity, str(order['offer_id']))
         )
-        offers_cache.clear()
+        invalidate_offer(order['offer_id'])
     
     # Покупатель принимает встречное предложение продавца
     if 'acceptCounter' in body and body['acceptCounter'] and is_buyer:
@@ -763,7 +779,7 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
             """).format(schema=pgsql.Identifier(schema)),
             (order_quantity, order_quantity, str(order['offer_id']))
         )
-        offers_cache.clear()
+        invalidate_offer(order['offer_id'])
     
     # Сторона соглашается с заказом (двойное подтверждение)
     if 'agreeOrder' in body and body['agreeOrder'] and not counter_accepted and order['status'] in ('new', 'pending', 'negotiating'):
@@ -807,7 +823,7 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
                     """).format(schema=pgsql.Identifier(schema)),
                     (order_quantity, order_quantity, str(order['offer_id']))
                 )
-                offers_cache.clear()
+                invalidate_offer(order['offer_id'])
             updates.append("status = 'accepted'")
 
     # Продавец принимает заказ напрямую (старая логика, обратная совместимость)
@@ -845,22 +861,18 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
                 """).format(schema=pgsql.Identifier(schema)),
                 (order_quantity, order_quantity, str(order['offer_id']))
             )
-            offers_cache.clear()
+            invalidate_offer(order['offer_id'])
         
         updates.append(f"status = 'accepted'")
     
     # Запрос на завершение от исполнителя
     if body.get('completionRequested') is True and is_seller:
         updates.append(f"completion_requested = TRUE")
-        try:
-            send_notification(
-                order['buyer_id'],
-                'Запрос на завершение заказа',
-                f'Исполнитель запрашивает подтверждение завершения заказа №{order.get("order_number", order_id[:8])}',
-                f'/my-orders?orderId={order_id}'
-            )
-        except Exception as e:
-            print(f'Notification error: {e}')
+        queue_order_event(
+            cur, ORDER_COMPLETION_REQUESTED, order_id, order['buyer_id'],
+            'Запрос на завершение заказа',
+            f'Исполнитель запрашивает подтверждение завершения заказа №{order.get("order_number", order_id[:8])}'
+        )
 
     # Завершить заказ может только покупатель
     if 'status' in body and body['status'] == 'completed':
@@ -918,7 +930,7 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
         )
         rows_updated = cur.rowcount
         if rows_updated > 0:
-            offers_cache.clear()
+            invalidate_offer(offer_id_for_complete, user_id=seller_id_complete, statuses=('active', 'completed'))
             print(f"[COMPLETE_ORDER] Offer {offer_id_for_complete} auto-completed (sold_quantity >= quantity)")
     
     # Отмена заказа
@@ -942,7 +954,8 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
                 (order_quantity, str(order['offer_id']))
             )
         
-        offers_cache.clear()
+        # Возвращённое количество может снова показать предложение в публичном списке
+        invalidate_offer(order['offer_id'], user_id=order['seller_id'], statuses=('active',))
         print(f"[CANCEL_ORDER] Returned {order_quantity} units to offer {order['offer_id']} (from {current_status})")
 
         # Если это отклик на запрос (is_request) и был принят — возвращаем запрос в active
@@ -1063,89 +1076,82 @@ def update_order(order_id: str, event: Dict[str, Any], headers: Dict[str, str])
         except Exception as e:
             print(f"[AUTO_REJECT] Error: {e}")
     
-    conn.commit()
-    
-    try:
-        new_status = body.get('status')
-        
-        if 'counterPrice' in body and is_buyer:
-            send_notification(
-                order['seller_id'],
-                'Встречное предложение по заказу',
-                f'Покупатель предложил {body["counterPrice"]} ₽ за единицу товара',
-                f'/my-orders?orderId={order_id}'
-            )
-        
-        elif 'counterPrice' in body and is_seller:
-            send_notification(
-                order['buyer_id'],
-                'Встречное предложение от продавца',
-                f'Продавец предложил {body["counterPrice"]} ₽ за единицу товара',
-                f'/my-orders?orderId={order_id}'
+    order_number = order.get("order_number", order_id[:8])
+    new_status = body.get('status')
+
+    # Уведомления о событии заказа фиксируются в той же транзакции
+    if 'counterPrice' in body and is_buyer:
+        queue_order_event(
+            cur, ORDER_COUNTER_OFFER, order_id, order['seller_id'],
+            'Встречное предложение по заказу',
+            f'Покупатель предложил {body["counterPrice"]} ₽ за единицу товара'
+        )
+
+    elif 'counterPrice' in body and is_seller:
+        queue_order_event(
+            cur, ORDER_COUNTER_OFFER, order_id, order['buyer_id'],
+            'Встречное предложение от продавца',
+            f'Продавец предложил {body["counterPrice"]} ₽ за единицу товара'
+        )
+
+    elif counter_accepted:
+        if is_seller:
+            queue_order_event(
+                cur, ORDER_COUNTER_ACCEPTED, order_id, order['buyer_id'],
+                'Встречное предложение принято',
+                'Продавец согласился на вашу цену. Заказ принят!'
             )
-        
-        elif counter_accepted:
-            if is_seller:
-                send_notification(
-                    order['buyer_id'],
-                    'Встречное предложение принято',
-                    f'Продавец согласился на вашу цену. Заказ принят!',
-                    f'/my-orders?orderId={order_id}'
-                )
-            elif is_buyer:
-                send_notification(
-                    order['seller_id'],
-                    'Встречное предложение принято',
-                    f'Покупатель согласился на вашу цену. Заказ принят!',
-                    f'/my-orders?orderId={order_id}'
-                )
-        
-        elif new_status == 'accepted':
-            if is_seller:
-                send_notification(
-                    order['buyer_id'],
-                    'Заказ принят',
-                    f'Ваш заказ №{order.get("order_number", order_id[:8])} принят в работу',
-                    f'/my-orders?orderId={order_id}'
-                )
-            elif is_buyer:
-                send_notification(
-                    order['seller_id'],
-                    'Ваш отклик принят',
-                    f'Заказчик принял ваш отклик по заказу №{order.get("order_number", order_id[:8])}',
-                    f'/my-orders?orderId={order_id}'
-                )
-        
-        elif new_status == 'rejected':
-            send_notification(
-                order['buyer_id'],
-                'Заказ отклонен',
-                f'К сожалению, ваш заказ №{order.get("order_number", order_id[:8])} был отклонен',
-                f'/my-orders?orderId={order_id}'
+        elif is_buyer:
+            queue_order_event(
+                cur, ORDER_COUNTER_ACCEPTED, order_id, order['seller_id'],
+                'Встречное предложение принято',
+                'Покупатель согласился на вашу цену. Заказ принят!'
             )
-        
-        elif new_status == 'cancelled':
-            notify_user = order['buyer_id'] if is_seller else order['seller_id']
-            who_cancelled = 'Продавец' if is_seller else 'Покупатель'
-            send_notification(
-                notify_user,
-                'Заказ отменён',
-                f'{who_cancelled} отменил заказ №{order.get("order_number", order_id[:8])}',
-                f'/my-orders?orderId={order_id}'
+
+    elif new_status == 'accepted':
+        if is_seller:
+            queue_order_event(
+                cur, ORDER_ACCEPTED, order_id, order['buyer_id'],
+                'Заказ принят',
+                f'Ваш заказ №{order_number} принят в работу'
             )
-        
-        elif new_status == 'completed':
-            send_notification(
-                order['seller_id'],
-                'Заказ завершён',
-                f'Покупатель подтвердил получение заказа №{order.get("order_number", order_id[:8])}',
-                f'/my-orders?orderId={order_id}'
+        elif is_buyer:
+            queue_order_event(
+                cur, ORDER_ACCEPTED, order_id, order['seller_id'],
+                'Ваш отклик принят',
+                f'Заказчик принял ваш отклик по заказу №{order_number}'
             )
-    except Exception as e:
-        print(f'Notification error: {e}')
-    
+
+    elif new_status == 'rejected':
+        queue_order_event(
+            cur, ORDER_REJECTED, order_id, order['buyer_id'],
+            'Заказ отклонен',
+            f'К сожалению, ваш заказ №{order_number} был отклонен'
+        )
+
+    elif new_status == 'cancelled':
+        notify_user = order['buyer_id'] if is_seller else order['seller_id']
+        who_cancelled = 'Продавец' if is_seller else 'Покупатель'
+        queue_order_event(
+            cur, ORDER_CANCELLED, order_id, notify_user,
+            'Заказ отменён',
+            f'{who_cancelled} отменил заказ №{order_number}'
+        )
+
+    elif new_status == 'completed':
+        queue_order_event(
+            cur, ORDER_COMPLETED, order_id, order['seller_id'],
+            'Заказ завершён',
+            f'Покупатель подтвердил получение заказа №{order_number}'
+        )
+
+    # Сводка откликов запроса (число откликов, принятое количество)
+    refresh_request_stats(cur, schema, [order['offer_id']])
+
+    conn.commit()
     cur.close()
     conn.close()
+    kick_dispatcher()
     
     return {
         'statusCode': 200,
@@ -6,7 +6,7 @@ import uuid
 import mimetypes
 import boto3
 from typing import Dict, Any
-from orders_utils import get_db_connection, get_schema, send_push_only
+from orders_utils import get_db_connection, get_schema, send_push_only, increment_unread_counters, mark_messages_read
 
 
 def get_messages_by_offer(offer_id: str, headers: Dict[str, str]) -> Dict[str, Any]:
@@ -95,13 +95,7 @@ def get_messages_by_order(order_id: str, headers: Dict[str, str], event: Dict[st
         user_id = user_headers.get('X-User-Id') or user_headers.get('x-user-id')
     
     if user_id:
-        cur.execute(f"""
-            UPDATE {schema}.order_messages 
-            SET is_read = true 
-            WHERE order_id = '{order_id_escaped}' 
-            AND sender_id != {int(user_id)} 
-            AND is_read = false
-        """)
+        mark_messages_read(cur, schema, order_id, int(user_id))
         conn.commit()
     
     sql = f"SELECT * FROM {schema}.order_messages WHERE order_id = '{order_id_escaped}' ORDER BY created_at ASC"
@@ -223,6 +217,8 @@ def create_message(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
     
     cur.execute(sql)
     result = cur.fetchone()
+    if order:
+        increment_unread_counters(cur, schema, body['orderId'], order['buyer_id'], order['seller_id'], int(sender_id))
     conn.commit()
     cur.close()
     conn.close()
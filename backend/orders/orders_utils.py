@@ -1,24 +1,26 @@
 """Вспомогательные утилиты для orders: подключение к БД, уведомления, вспомогательные функции"""
-import json
 import os
 import sys
-import http.client
-import threading
-from typing import Dict, Any
+from typing import Any
 from datetime import datetime
 from decimal import Decimal
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db_pool import get_connection
+from notification_outbox import enqueue_notifications, kick_dispatcher
 
 # Импортируем offers_cache для инвалидации кэша
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'offers'))
 try:
-    from cache import offers_cache
+    from cache import offers_cache, invalidate_offer
 except ImportError:
     class DummyCache:
         def clear(self): pass
+        def invalidate_tags(self, *tags): return 0
     offers_cache = DummyCache()
 
+    def invalidate_offer(offer_id=None, user_id=None, statuses=()):
+        return 0
+
 
 def decimal_to_float(obj):
     """Рекурсивно конвертирует Decimal в float"""
@@ -31,7 +33,7 @@ def decimal_to_float(obj):
     return obj
 
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
+    return get_connection(cursor_factory=RealDictCursor)
 
 def get_schema():
     return os.environ.get('DB_SCHEMA', 'public')
@@ -44,58 +46,132 @@ def generate_order_number():
     return f'ORD-{timestamp}-{random_part}'
 
 
-def _send_email_async(notification_data: str):
-    """Email-уведомление в фоновом потоке"""
-    try:
-        conn = http.client.HTTPSConnection('functions.poehali.dev', timeout=5)
-        conn.request('POST', '/dd3295a9-ffa3-4842-8c95-de00a018ecf0',  # email-notify
-                    notification_data, {'Content-Type': 'application/json'})
-        response = conn.getresponse()
-        response.read()
-        conn.close()
-    except Exception as e:
-        print(f'[NOTIFICATION] Email error: {e}')
-
-
-def _send_push(notification_data: str, user_id: int, title: str):
-    """Отправка Web Push уведомления"""
+def _enqueue(user_id: int, title: str, message: str, url: str, channels: tuple):
+    """Ставит уведомление в notification_outbox отдельной короткой транзакцией и будит диспетчер"""
+    conn = get_db_connection()
     try:
-        conn = http.client.HTTPSConnection('functions.poehali.dev', timeout=10)
-        conn.request('POST', '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a',  # push-send
-                    notification_data, {'Content-Type': 'application/json'})
-        response = conn.getresponse()
-        body_resp = response.read()
+        cur = conn.cursor()
+        enqueue_notifications(cur, [user_id], title, message, url, channels=channels)
+        conn.commit()
+        cur.close()
+    finally:
         conn.close()
-        print(f'[NOTIFICATION] Push sent to user {user_id}: {title} | status={response.status} resp={body_resp[:200]}')
-    except Exception as e:
-        print(f'[NOTIFICATION] Push error: {e}')
+    kick_dispatcher()
+    print(f'[NOTIFICATION] Queued {"+".join(channels)} for user {user_id}: {title}')
 
 
 def send_push_only(user_id: int, title: str, message: str, url: str = '/my-orders'):
-    """Отправка только push-уведомления (без email)"""
-    notification_data = json.dumps({
-        'userId': user_id,
-        'title': title,
-        'message': message,
-        'url': url
-    })
-    _send_push(notification_data, user_id, title)
+    """Постановка в очередь только push-уведомления (без email)"""
+    _enqueue(user_id, title, message, url, ('push',))
 
 
 def send_notification(user_id: int, title: str, message: str, url: str = '/my-orders'):
-    """Отправка push (синхронно) и email (асинхронно) уведомлений"""
-    notification_data = json.dumps({
-        'userId': user_id,
-        'title': title,
-        'message': message,
-        'url': url
-    })
-
-    _send_push(notification_data, user_id, title)
+    """
+    Постановка в очередь push и email уведомлений.
+    Отправляет их диспетчер в push-send — обработчик запроса не ждёт сети.
+    """
+    _enqueue(user_id, title, message, url, ('push', 'email'))
+
+def increment_unread_counters(cur, schema: str, order_id: Any, buyer_id: int, seller_id: int, sender_id: int):
+    """Новое сообщение становится непрочитанным для каждой стороны заказа, кроме отправителя"""
+    cur.execute(f"""
+        INSERT INTO {schema}.order_unread_counters AS c (order_id, buyer_unread, seller_unread)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (order_id) DO UPDATE
+        SET buyer_unread = c.buyer_unread + EXCLUDED.buyer_unread,
+            seller_unread = c.seller_unread + EXCLUDED.seller_unread,
+            updated_at = CURRENT_TIMESTAMP
+    """, (str(order_id), int(sender_id != buyer_id), int(sender_id != seller_id)))
+
+
+def mark_messages_read(cur, schema: str, order_id: Any, reader_id: int) -> int:
+    """
+    Отмечает чужие сообщения заказа прочитанными и тем же запросом уменьшает
+    счётчики непрочитанных каждой стороны на число сообщений, которые для неё
+    были непрочитанными.
+    """
+    cur.execute(f"""
+        WITH marked AS (
+            UPDATE {schema}.order_messages
+            SET is_read = true
+            WHERE order_id = %s AND sender_id != %s AND is_read = false
+            RETURNING sender_id
+        ), updated AS (
+            UPDATE {schema}.order_unread_counters c
+            SET buyer_unread = GREATEST(0, c.buyer_unread - (SELECT COUNT(*) FROM marked m WHERE m.sender_id <> o.buyer_id)),
+                seller_unread = GREATEST(0, c.seller_unread - (SELECT COUNT(*) FROM marked m WHERE m.sender_id <> o.seller_id)),
+                updated_at = CURRENT_TIMESTAMP
+            FROM {schema}.orders o
+            WHERE c.order_id = %s AND o.id = c.order_id AND EXISTS (SELECT 1 FROM marked)
+        )
+        SELECT COUNT(*) AS marked FROM marked
+    """, (str(order_id), int(reader_id), str(order_id)))
+    row = cur.fetchone()
+    return row['marked'] if row else 0
+
+
+def refresh_request_stats(cur, schema: str, request_ids) -> None:
+    """
+    Пересчитывает сводку откликов request_stats для запросов request_ids по индексу
+    orders.offer_id. Id предложений (не запросов) пропускаются без ошибки.
+    Строки запросов сначала блокируются: пересчёт в параллельной транзакции
+    дождётся коммита этой и увидит её изменения, а не перезапишет их.
+    Вызывать в транзакции, изменившей отклики, после их изменения.
+    """
+    ids = sorted({str(rid) for rid in request_ids if rid})
+    if not ids:
+        return
+    cur.execute(f"""
+        SELECT id FROM {schema}.requests WHERE id = ANY(%s::uuid[]) ORDER BY id FOR UPDATE
+    """, (ids,))
+    if not cur.fetchall():
+        return
+    cur.execute(f"""
+        INSERT INTO {schema}.request_stats AS s (request_id, responses_count, accepted_quantity, has_accepted)
+        SELECT r.id,
+               COUNT(o.id) FILTER (WHERE o.status <> 'cancelled'),
+               COALESCE(SUM(o.quantity) FILTER (WHERE o.status = 'accepted'), 0),
+               COALESCE(BOOL_OR(o.status = 'accepted'), FALSE)
+        FROM {schema}.requests r
+        LEFT JOIN {schema}.orders o ON o.offer_id = r.id
+        WHERE r.id = ANY(%s::uuid[])
+        GROUP BY r.id
+        ON CONFLICT (request_id) DO UPDATE
+        SET responses_count = EXCLUDED.responses_count,
+            accepted_quantity = EXCLUDED.accepted_quantity,
+            has_accepted = EXCLUDED.has_accepted,
+            updated_at = CURRENT_TIMESTAMP
+    """, (ids,))
+
+
+# События жизненного цикла заказа, для которых есть побочные эффекты (уведомления)
+ORDER_CREATED = 'created'
+ORDER_COUNTER_OFFER = 'counter_offer'
+ORDER_COUNTER_ACCEPTED = 'counter_accepted'
+ORDER_ACCEPTED = 'accepted'
+ORDER_REJECTED = 'rejected'
+ORDER_CANCELLED = 'cancelled'
+ORDER_COMPLETION_REQUESTED = 'completion_requested'
+ORDER_COMPLETED = 'completed'
+
+
+def queue_order_event(cur, event: str, order_id: Any, recipient_id: int, title: str, message: str, url: str = None):
+    """
+    Асинхронная стадия побочных эффектов заказа.
+    Намерение уведомить получателя записывается в notification_outbox в той же
+    транзакции, что и изменение заказа: откат заказа отменяет и уведомление,
+    а доставка идёт вне запроса. После commit вызывающий код будит диспетчер.
+    tag push-уведомления — свой у каждого заказа и события, чтобы уведомление
+    по одному заказу не заменяло в браузере уведомление по другому.
+    """
+    enqueue_notifications(
+        cur, [recipient_id], title, message,
+        url or f'/my-orders?orderId={order_id}',
+        channels=('push', 'email'),
+        notification_type=f'order_{event}',
+        extra={'orderId': str(order_id), 'event': event, 'tag': f'order:{order_id}:{event}'}
+    )
 
-    # Email — в фоне, не блокирует
-    t = threading.Thread(target=_send_email_async, args=(notification_data,), daemon=True)
-    t.start()
 
 def reject_other_responses(cur, schema: str, offer_id: str, accepted_order_id: str, title: str, is_request: bool = True):
     """Отклоняет все остальные отклики на тот же запрос/предложение при принятии одного"""
@@ -134,14 +210,13 @@ def reject_other_responses(cur, schema: str, offer_id: str, accepted_order_id: s
     
     print(f"[AUTO_REJECT] Rejected {len(other_orders)} other responses for {entity_type} {offer_id}")
     
+    # Одно уведомление всем отклонённым — в той же транзакции, что и смена статуса
     notify_text = f'К сожалению, по {entity_type}у «{title}» выбран другой исполнитель'
-    for o in other_orders:
-        try:
-            send_notification(
-                o['buyer_id'],
-                'Ваш отклик отклонён',
-                notify_text,
-                f'/my-orders?tab=my-responses'
-            )
-        except Exception as e:
-            print(f"[AUTO_REJECT] Notification error for user {o['buyer_id']}: {e}")
\ No newline at end of file
+    enqueue_notifications(
+        cur,
+        [o['buyer_id'] for o in other_orders],
+        'Ваш отклик отклонён',
+        notify_text,
+        '/my-orders?tab=my-responses',
+        channels=('push', 'email')
+    )
\ No newline at end of file
@@ -1,65 +1,232 @@
 '''
-Простая система rate limiting для защиты API заказов
+Rate limiting для защиты API: скользящее окно со счётчиками в памяти
+и необязательной пакетной синхронизацией с таблицей rate_limits
 '''
 
+import math
+import os
 import time
-from typing import Dict, Tuple
-from collections import defaultdict
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+
+class _Window:
+    """
+    Счётчик скользящего окна: запросы текущего и предыдущего фиксированного окна.
+    Оценка числа запросов за последние window_seconds:
+        prev * (доля предыдущего окна, ещё попадающая в интервал) + cur
+    Память на ключ постоянна и не зависит от числа запросов.
+    """
+    __slots__ = ('index', 'cur', 'prev', 'window_seconds', 'limit', 'pending')
+
+    def __init__(self, index: int, window_seconds: int, limit: int):
+        self.index = index
+        self.cur = 0
+        self.prev = 0
+        self.window_seconds = window_seconds
+        self.limit = limit
+        self.pending = 0  # запросы текущего окна, ещё не записанные в БД
+
+    def roll(self, index: int) -> None:
+        if index == self.index:
+            return
+        self.prev = self.cur if index == self.index + 1 else 0
+        self.cur = 0
+        # Незаписанные запросы прошлого окна в БД уже не нужны: лимит по ним
+        # считается из prev в памяти
+        self.pending = 0
+        self.index = index
+
+    def estimate(self, now: float) -> float:
+        elapsed = now - self.index * self.window_seconds
+        return self.prev * (1 - elapsed / self.window_seconds) + self.cur
+
 
 class RateLimiter:
-    def __init__(self):
-        self._requests: Dict[str, list] = defaultdict(list)
-        
+    """
+    Лимиты по ключу (endpoint, identifier).
+    - check_rate_limit не ходит в БД: решение принимается по счётчику в памяти;
+    - при persist=True накопленные запросы раз в flush_interval секунд
+      записываются в rate_limits одним upsert на все ключи (flush_if_due),
+      а в ответ приходят суммарные счётчики всех контейнеров функции;
+    - число ключей ограничено max_keys, устаревшие ключи удаляются
+      с головы LRU-очереди, поэтому очистка стоит O(1) в среднем на запрос.
+    """
+
+    def __init__(
+        self,
+        max_keys: int = 10000,
+        persist: bool = False,
+        flush_interval: float = 5.0,
+        schema: Optional[str] = None
+    ):
+        self._windows: 'OrderedDict[Hashable, _Window]' = OrderedDict()
+        self._max_keys = max_keys
+        self._persist = persist
+        self._flush_interval = flush_interval
+        self._schema = schema or os.environ.get('DB_SCHEMA', 't_p42562714_web_app_creation_1')
+        self._dirty: Dict[Hashable, _Window] = {}
+        self._last_flush = time.monotonic()
+        self._stats = {'allowed': 0, 'limited': 0, 'evicted': 0, 'flushes': 0, 'flushed_keys': 0, 'flush_errors': 0}
+
     def check_rate_limit(
-        self, 
-        identifier: str, 
+        self,
+        identifier: str,
         max_requests: int = 60,
-        window_seconds: int = 60
+        window_seconds: int = 60,
+        endpoint: str = 'default'
     ) -> Tuple[bool, int]:
         """
         Проверяет rate limit для идентификатора (IP или user_id)
-        
+
         Возвращает:
         - (True, оставшихся запросов) если лимит не превышен
         - (False, 0) если лимит превышен
         """
         now = time.time()
-        window_start = now - window_seconds
-        
-        if identifier in self._requests:
-            self._requests[identifier] = [
-                req_time for req_time in self._requests[identifier]
-                if req_time > window_start
-            ]
-        
-        current_requests = len(self._requests[identifier])
-        
-        if current_requests >= max_requests:
+        key = (endpoint, str(identifier))
+        window = self._windows.get(key)
+        index = int(now // window_seconds)
+
+        if window is None or window.window_seconds != window_seconds:
+            window = _Window(index, window_seconds, max_requests)
+            self._windows[key] = window
+        else:
+            window.roll(index)
+            window.limit = max_requests
+            self._windows.move_to_end(key)
+
+        self.cleanup()
+
+        used = window.estimate(now)
+        if used + 1 > max_requests:
+            self._stats['limited'] += 1
             return False, 0
-        
-        self._requests[identifier].append(now)
-        
-        remaining = max_requests - current_requests - 1
-        return True, remaining
-    
-    def get_retry_after(self, identifier: str, window_seconds: int = 60) -> int:
-        """Возвращает количество секунд до сброса лимита"""
-        if identifier not in self._requests or not self._requests[identifier]:
+
+        window.cur += 1
+        if self._persist:
+            window.pending += 1
+            self._dirty[key] = window
+        self._stats['allowed'] += 1
+        return True, max(0, max_requests - math.ceil(used) - 1)
+
+    def get_retry_after(self, identifier: str, window_seconds: int = 60, endpoint: str = 'default') -> int:
+        """Возвращает количество секунд до момента, когда запрос снова будет разрешён"""
+        window = self._windows.get((endpoint, str(identifier)))
+        if window is None or window.window_seconds != window_seconds:
             return 0
-        
-        oldest_request = min(self._requests[identifier])
-        retry_after = int(window_seconds - (time.time() - oldest_request))
-        return max(0, retry_after)
-    
-    def cleanup(self, max_identifiers: int = 10000):
-        """Очистка старых идентификаторов для экономии памяти"""
-        if len(self._requests) > max_identifiers:
-            sorted_identifiers = sorted(
-                self._requests.items(),
-                key=lambda x: max(x[1]) if x[1] else 0
-            )
-            to_remove = int(max_identifiers * 0.2)
-            for identifier, _ in sorted_identifiers[:to_remove]:
-                del self._requests[identifier]
+
+        now = time.time()
+        window.roll(int(now // window_seconds))
+        if window.estimate(now) + 1 <= window.limit:
+            return 0
+
+        limit = window.limit
+        window_end = (window.index + 1) * window_seconds
+        if window.cur + 1 > limit or window.prev == 0:
+            return max(0, math.ceil(window_end - now))
+
+        # Момент, когда вклад предыдущего окна упадёт настолько, что запрос пройдёт
+        fraction = 1 - (limit - 1 - window.cur) / window.prev
+        retry_at = window.index * window_seconds + fraction * window_seconds
+        return max(0, math.ceil(retry_at - now))
+
+    def cleanup(self, max_identifiers: Optional[int] = None) -> int:
+        """
+        Удаляет ключи с головы LRU-очереди, пока они устарели (не было запросов
+        два окна) или пока ключей больше лимита. Каждый ключ удаляется не более
+        одного раза после добавления, поэтому амортизированная стоимость O(1).
+        """
+        limit = self._max_keys if max_identifiers is None else max_identifiers
+        now = time.time()
+        removed = 0
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            stale = (window.index + 2) * window.window_seconds <= now
+            if not stale and len(self._windows) <= limit:
+                break
+            self._windows.popitem(last=False)
+            self._dirty.pop(key, None)
+            removed += 1
+        self._stats['evicted'] += removed
+        return removed
+
+    def flush_if_due(self, conn) -> int:
+        """Синхронизирует счётчики с БД, если прошло flush_interval секунд с прошлой записи"""
+        if not self._persist or not self._dirty:
+            return 0
+        if time.monotonic() - self._last_flush < self._flush_interval:
+            return 0
+        return self.flush(conn)
+
+    def flush(self, conn) -> int:
+        """
+        Записывает накопленные запросы всех ключей одним upsert и подтягивает
+        суммарные счётчики (с учётом других контейнеров) в память.
+        Коммитит транзакцию conn — вызывать, когда в ней нет незавершённой работы.
+        """
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, {}
+        by_db_key = {
+            (identifier[:255], endpoint[:255]): window
+            for (endpoint, identifier), window in dirty.items()
+            if window.pending > 0
+        }
+        rows = [
+            (identifier, endpoint, window.pending, datetime.utcfromtimestamp(window.index * window.window_seconds))
+            for (identifier, endpoint), window in by_db_key.items()
+        ]
+        if not rows:
+            return 0
+
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                result = execute_values(cur, f"""
+                    INSERT INTO {self._schema}.rate_limits AS rl (identifier, endpoint, request_count, window_start)
+                    VALUES %s
+                    ON CONFLICT (identifier, endpoint) DO UPDATE SET
+                        request_count = CASE
+                            WHEN rl.window_start = EXCLUDED.window_start THEN rl.request_count + EXCLUDED.request_count
+                            WHEN rl.window_start > EXCLUDED.window_start THEN rl.request_count
+                            ELSE EXCLUDED.request_count
+                        END,
+                        window_start = GREATEST(rl.window_start, EXCLUDED.window_start)
+                    RETURNING identifier, endpoint, request_count, window_start
+                """, rows, fetch=True)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            # Не теряем накопленное: допишем при следующей синхронизации
+            for key, window in dirty.items():
+                self._dirty.setdefault(key, window)
+            self._stats['flush_errors'] += 1
+            print(f'[RATE_LIMIT] flush error: {e}')
+            return 0
+
+        for window in by_db_key.values():
+            window.pending = 0
+        for identifier, endpoint, total, window_start in result:
+            window = by_db_key.get((identifier, endpoint))
+            if window is None:
+                continue
+            synced_index = int((window_start - datetime(1970, 1, 1)).total_seconds() // window.window_seconds)
+            if synced_index == window.index:
+                # Суммарный счётчик текущего окна по всем контейнерам функции
+                window.cur = max(window.cur, total)
+
+        self._stats['flushes'] += 1
+        self._stats['flushed_keys'] += len(rows)
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'keys': len(self._windows), 'dirty_keys': len(self._dirty), 'max_keys': self._max_keys}
+
 
 rate_limiter = RateLimiter()
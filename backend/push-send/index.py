@@ -1,9 +1,20 @@
 import json
 import os
 import base64
+import threading
+from urllib.parse import urlparse
 import psycopg2
+import requests
 from cryptography.hazmat.primitives.serialization import load_pem_private_key, Encoding, PrivateFormat, NoEncryption
 from pywebpush import webpush, WebPushException
+from outbox_dispatcher import dispatch_outbox
+
+VAPID_CLAIMS = {'sub': 'mailto:noreply@erttp.ru'}
+
+# Keep-alive соединения к push-сервисам, общие для вызовов в контейнере
+_push_session = requests.Session()
+_vapid_key_lock = threading.Lock()
+_vapid_key_b64 = None
 
 
 def load_vapid_key_b64() -> str:
@@ -27,6 +38,15 @@ def load_vapid_key_b64() -> str:
         return raw
 
 
+def get_vapid_key_b64() -> str:
+    """VAPID ключ, разобранный один раз на контейнер"""
+    global _vapid_key_b64
+    with _vapid_key_lock:
+        if _vapid_key_b64 is None:
+            _vapid_key_b64 = load_vapid_key_b64()
+        return _vapid_key_b64
+
+
 def send_web_push(subscription_info: dict, payload: str, vapid_key_b64: str, vapid_claims: dict) -> tuple:
     """Отправляет Web Push через pywebpush"""
     try:
@@ -35,6 +55,7 @@ def send_web_push(subscription_info: dict, payload: str, vapid_key_b64: str, vap
             data=payload,
             vapid_private_key=vapid_key_b64,
             vapid_claims=vapid_claims,
+            requests_session=_push_session,
         )
         return 201, 'ok'
     except WebPushException as e:
@@ -43,6 +64,106 @@ def send_web_push(subscription_info: dict, payload: str, vapid_key_b64: str, vap
         return status, body
 
 
+def build_notification_payload(title: str, message: str, url: str, notification_type, call_data=None, tag=None) -> str:
+    """tag — ключ замены уведомления в браузере; по умолчанию тип (одно уведомление каждого типа)"""
+    notification_data = {'url': url, 'type': notification_type}
+    if call_data:
+        notification_data['callData'] = call_data
+
+    return json.dumps({
+        'title': title,
+        'body': message,
+        'icon': '/favicon.png',
+        'badge': '/favicon.png',
+        'data': notification_data,
+        'tag': tag or notification_type,
+        'requireInteraction': notification_type in ('video_call', 'online_invite'),
+    })
+
+
+def push_to_subscription(subscription_json: str, payload: str, vapid_key_b64: str) -> tuple:
+    """Отправка одной подписке; aud должен быть origin URL подписки (требуется Firefox)"""
+    subscription_info = json.loads(subscription_json)
+    parsed = urlparse(subscription_info.get('endpoint', ''))
+    per_sub_claims = {**VAPID_CLAIMS, 'aud': f'{parsed.scheme}://{parsed.netloc}'}
+    return send_web_push(subscription_info, payload, vapid_key_b64, per_sub_claims)
+
+
+def deactivate_subscriptions(cur, schema: str, subscriptions: list) -> None:
+    """Деактивирует истёкшие подписки (404/410) одним запросом"""
+    if subscriptions:
+        cur.execute(
+            f"UPDATE {schema}.push_subscriptions SET active=false WHERE subscription_data = ANY(%s)",
+            (subscriptions,)
+        )
+
+
+def send_push_to_users(user_ids: list, row: dict) -> dict:
+    """
+    Один push сразу нескольким получателям (используется диспетчером очереди).
+    Подписки всех получателей выбираются одним запросом.
+    Возвращает {user_id: ошибка} для тех, кому доставка не удалась по временной причине.
+    """
+    schema = os.environ.get('DB_SCHEMA', 'public')
+    extra = row.get('extra') or {}
+    if isinstance(extra, str):
+        extra = json.loads(extra)
+    payload = build_notification_payload(row['title'], row['message'], row['url'], row['notification_type'],
+                                         extra.get('callData'), extra.get('tag'))
+
+    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    try:
+        cur = conn.cursor()
+        cur.execute(f'''
+            SELECT user_id, subscription_data FROM {schema}.push_subscriptions
+            WHERE user_id = ANY(%s) AND active = true
+        ''', ([str(uid) for uid in user_ids],))
+        subscriptions = cur.fetchall()
+
+        vapid_key_b64 = get_vapid_key_b64()
+        delivered = set()
+        errors = {}
+        expired = []
+        for sub_user_id, sub_json in subscriptions:
+            try:
+                status_code, resp_text = push_to_subscription(sub_json, payload, vapid_key_b64)
+            except Exception as e:
+                status_code, resp_text = 0, str(e)
+            if status_code in (200, 201, 202):
+                delivered.add(sub_user_id)
+            elif status_code in (404, 410):
+                expired.append(sub_json)
+            elif status_code == 429 or status_code >= 500 or status_code == 0:
+                errors[sub_user_id] = f'push status {status_code}: {resp_text}'
+            else:
+                print(f'[PUSH] Failed status={status_code} body={resp_text}')
+
+        deactivate_subscriptions(cur, schema, expired)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    print(f'[PUSH] batch users={len(user_ids)} subscriptions={len(subscriptions)} delivered_users={len(delivered)} expired={len(expired)}')
+    # Если хотя бы одна подписка пользователя получила push — повтор не нужен
+    by_id = {str(uid): uid for uid in user_ids}
+    return {by_id[uid]: error for uid, error in errors.items() if uid not in delivered and uid in by_id}
+
+
+def run_dispatcher() -> dict:
+    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    try:
+        stats = dispatch_outbox(conn, os.environ.get('DB_SCHEMA', 'public'), send_push_to_users)
+    finally:
+        conn.close()
+    print(f'[OUTBOX] {stats}')
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, **stats})
+    }
+
+
 def handler(event: dict, context) -> dict:
     '''API для отправки push-уведомлений пользователям'''
     method = event.get('httpMethod', 'POST')
@@ -67,7 +188,13 @@ def handler(event: dict, context) -> dict:
 
     try:
         body = json.loads(event.get('body', '{}'))
+
+        # Разбор очереди notification_outbox
+        if body.get('action') == 'dispatch':
+            return run_dispatcher()
+
         user_id = body.get('userId')
+        user_ids = body.get('userIds')
         district = body.get('district')
         notification_type = body.get('type')
         title = body.get('title')
@@ -88,7 +215,13 @@ def handler(event: dict, context) -> dict:
         conn = psycopg2.connect(db_url)
         cur = conn.cursor()
 
-        if user_id:
+        if user_ids:
+            # Многоадресная рассылка: подписки всех получателей одним запросом
+            cur.execute(f'''
+                SELECT subscription_data FROM {schema}.push_subscriptions
+                WHERE user_id = ANY(%s) AND active = true
+            ''', ([str(uid) for uid in user_ids],))
+        elif user_id:
             # Если передан не числовой ID — ищем пользователя по телефону/email
             resolved_id = str(user_id)
             if not str(user_id).lstrip('-').isdigit():
@@ -129,11 +262,11 @@ def handler(event: dict, context) -> dict:
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'userId or district is required'})
+                'body': json.dumps({'error': 'userId, userIds or district is required'})
             }
 
         subscriptions = cur.fetchall()
-        print(f'[PUSH] user_id={user_id} (resolved={resolved_id if user_id else "n/a"}) found {len(subscriptions)} subscriptions')
+        print(f'[PUSH] user_id={user_id} user_ids={len(user_ids or [])} (resolved={resolved_id if user_id and not user_ids else "n/a"}) found {len(subscriptions)} subscriptions')
         cur.close()
         conn.close()
 
@@ -146,10 +279,7 @@ def handler(event: dict, context) -> dict:
 
         # Загружаем VAPID ключ
         try:
-            raw_key = os.environ.get('VAPID_PRIVATE_KEY', '')
-            print(f'[PUSH] VAPID raw key starts with: {repr(raw_key[:30])}')
-            vapid_key_b64 = load_vapid_key_b64()
-            print(f'[PUSH] VAPID key loaded OK, len={len(vapid_key_b64)}')
+            vapid_key_b64 = get_vapid_key_b64()
         except Exception as e:
             print(f'[PUSH] VAPID key error: {e}')
             return {
@@ -158,38 +288,15 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'error': f'Invalid VAPID key: {e}'})
             }
 
-        vapid_claims = {'sub': 'mailto:noreply@erttp.ru'}
-
-        notification_data = {'url': url, 'type': notification_type}
-        if call_data:
-            notification_data['callData'] = call_data
-
-        notification_payload = json.dumps({
-            'title': title,
-            'body': message,
-            'icon': '/favicon.png',
-            'badge': '/favicon.png',
-            'data': notification_data,
-            'tag': notification_type,
-            'requireInteraction': notification_type in ('video_call', 'online_invite'),
-        })
+        notification_payload = build_notification_payload(title, message, url, notification_type, call_data)
 
         sent_count = 0
         failed_count = 0
+        expired = []
 
         for sub_data in subscriptions:
             try:
-                subscription_info = json.loads(sub_data[0])
-                # aud должен быть origin URL подписки (требуется Firefox)
-                endpoint = subscription_info.get('endpoint', '')
-                from urllib.parse import urlparse
-                parsed = urlparse(endpoint)
-                aud = f'{parsed.scheme}://{parsed.netloc}'
-                per_sub_claims = {**vapid_claims, 'aud': aud}
-                status_code, resp_text = send_web_push(
-                    subscription_info, notification_payload,
-                    vapid_key_b64, per_sub_claims
-                )
+                status_code, resp_text = push_to_subscription(sub_data[0], notification_payload, vapid_key_b64)
                 if status_code in (200, 201, 202):
                     sent_count += 1
                     print(f'[PUSH] Sent OK status={status_code}')
@@ -198,22 +305,22 @@ def handler(event: dict, context) -> dict:
                     print(f'[PUSH] Failed status={status_code} body={resp_text}')
                     # Если подписка истекла — деактивируем
                     if status_code in (404, 410):
-                        try:
-                            conn2 = psycopg2.connect(db_url)
-                            cur2 = conn2.cursor()
-                            cur2.execute(
-                                f"UPDATE {schema}.push_subscriptions SET active=false WHERE subscription_data=%s",
-                                (sub_data[0],)
-                            )
-                            conn2.commit()
-                            cur2.close()
-                            conn2.close()
-                        except Exception:
-                            pass
+                        expired.append(sub_data[0])
             except Exception as e:
                 failed_count += 1
                 print(f'[PUSH] Error: {e}')
 
+        if expired:
+            try:
+                conn2 = psycopg2.connect(db_url)
+                cur2 = conn2.cursor()
+                deactivate_subscriptions(cur2, schema, expired)
+                conn2.commit()
+                cur2.close()
+                conn2.close()
+            except Exception:
+                pass
+
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,233 @@
+'''
+Диспетчер очереди notification_outbox.
+Забирает пачку готовых к отправке уведомлений, объединяет push с одинаковым
+содержимым в одну многоадресную рассылку, отправляет с ограничением
+параллельности по keep-alive соединениям и планирует повтор с backoff.
+'''
+
+import json
+import time
+import threading
+import http.client
+import psycopg2
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+BATCH_SIZE = 200
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 30
+STALE_CLAIM_MINUTES = 5
+MAX_RUNTIME_SECONDS = 20
+
+FUNCTIONS_HOST = 'functions.poehali.dev'
+EMAIL_NOTIFY_PATH = '/dd3295a9-ffa3-4842-8c95-de00a018ecf0'
+
+_local = threading.local()
+
+
+class DeliveryError(Exception):
+    """Временная ошибка доставки — уведомление будет отправлено повторно"""
+
+
+def _post_json(path: str, payload: Dict[str, Any], timeout: float = 5) -> int:
+    """POST в functions.poehali.dev по keep-alive соединению, своему для каждого потока"""
+    conn = getattr(_local, 'conn', None)
+    for attempt in range(2):
+        if conn is None:
+            conn = http.client.HTTPSConnection(FUNCTIONS_HOST, timeout=timeout)
+            _local.conn = conn
+        try:
+            conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            # Сервер мог закрыть простаивающее соединение — переподключаемся один раз
+            conn.close()
+            conn = _local.conn = None
+            if attempt == 1:
+                raise
+    return 0
+
+
+def claim_batch(conn, schema: str, batch_size: int = BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Помечает пачку уведомлений как 'sending' и возвращает её.
+    SKIP LOCKED позволяет нескольким диспетчерам работать параллельно;
+    зависшие в 'sending' дольше STALE_CLAIM_MINUTES забираются повторно.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {schema}.notification_outbox
+        SET status = 'sending', attempts = attempts + 1, claimed_at = NOW()
+        WHERE id IN (
+            SELECT id FROM {schema}.notification_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= NOW())
+               OR (status = 'sending' AND claimed_at < NOW() - INTERVAL '{STALE_CLAIM_MINUTES} minutes')
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, channel, endpoint, title, message, url, notification_type, extra, attempts
+    """, (batch_size,))
+    columns = [desc[0] for desc in cur.description]
+    rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    return rows
+
+
+def _extra(row: Dict[str, Any]) -> Dict[str, Any]:
+    extra = row.get('extra')
+    if isinstance(extra, str):
+        extra = json.loads(extra)
+    return extra or {}
+
+
+def _send_email(row: Dict[str, Any]) -> None:
+    status = _post_json(EMAIL_NOTIFY_PATH, {
+        'userId': row['user_id'],
+        'title': row['title'],
+        'message': row['message'],
+        'url': row['url'],
+    })
+    if status >= 500 or status == 429:
+        raise DeliveryError(f'email-notify status {status}')
+
+
+def _send_webhook(row: Dict[str, Any]) -> None:
+    status = _post_json(row['endpoint'], {
+        'userId': row['user_id'],
+        'title': row['title'],
+        'message': row['message'],
+        'url': row['url'],
+        **_extra(row),
+    })
+    if status >= 500 or status == 429:
+        raise DeliveryError(f'{row["endpoint"]} status {status}')
+
+
+def dispatch_outbox(conn, schema: str, send_push_group: Callable[[List[Any], Dict[str, Any]], Dict[Any, str]]) -> Dict[str, Any]:
+    """
+    Отправляет уведомления из очереди, пока они есть, но не дольше MAX_RUNTIME_SECONDS.
+    send_push_group(user_ids, row) рассылает один push сразу нескольким получателям
+    и возвращает {user_id: ошибка} для получателей с временной ошибкой.
+    """
+    started = time.monotonic()
+    deadline = started + MAX_RUNTIME_SECONDS
+    stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'batches': 0, 'push_groups': 0}
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        while time.monotonic() < deadline:
+            rows = claim_batch(conn, schema)
+            if not rows:
+                break
+            stats['batches'] += 1
+            stats['claimed'] += len(rows)
+
+            # Одинаковые push объединяются в одну рассылку по списку получателей
+            push_groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+            tasks = []
+            for row in rows:
+                if row['channel'] == 'push':
+                    key = (row['title'], row['message'], row['url'], row['notification_type'], json.dumps(_extra(row), sort_keys=True))
+                    push_groups.setdefault(key, []).append(row)
+                elif row['channel'] == 'email':
+                    tasks.append(([row], pool.submit(_send_email, row)))
+                else:
+                    tasks.append(([row], pool.submit(_send_webhook, row)))
+
+            for group in push_groups.values():
+                user_ids = [row['user_id'] for row in group]
+                tasks.append((group, pool.submit(send_push_group, user_ids, group[0])))
+            stats['push_groups'] += len(push_groups)
+
+            sent_ids: List[int] = []
+            failed: List[Tuple[int, str]] = []
+            for group, future in tasks:
+                try:
+                    user_errors = future.result() or {}
+                except Exception as e:
+                    user_errors = {row['user_id']: str(e) for row in group}
+                for row in group:
+                    error = user_errors.get(row['user_id'])
+                    if error is None:
+                        sent_ids.append(row['id'])
+                    else:
+                        failed.append((row['id'], error[:500]))
+
+            _record_results(conn, schema, sent_ids, failed)
+            stats['sent'] += len(sent_ids)
+            failed_ids = {failed_id for failed_id, _ in failed}
+            for row in rows:
+                if row['id'] in failed_ids:
+                    if row['attempts'] >= MAX_ATTEMPTS:
+                        stats['failed'] += 1
+                    else:
+                        stats['retried'] += 1
+
+            if len(rows) < BATCH_SIZE:
+                break
+
+    stats['duration_ms'] = int((time.monotonic() - started) * 1000)
+    return stats
+
+
+def _record_results(conn, schema: str, sent_ids: List[int], failed: List[Tuple[int, str]]) -> None:
+    """
+    Фиксирует результат пачки. Отправленные — 'sent' отдельной транзакцией,
+    чтобы ошибка при записи неудач не откатила уже доставленные.
+    Ошибки — повтор с backoff или 'failed'. Запись с coalesce_key не возвращается
+    в 'pending', если с тем же ключом уже есть ожидающая (она новее и её
+    перекрывает — уникальный индекс idx_notification_outbox_coalesce):
+    такая запись помечается 'failed' с last_error 'superseded: ...'.
+    """
+    cur = conn.cursor()
+    if sent_ids:
+        cur.execute(f"""
+            UPDATE {schema}.notification_outbox
+            SET status = 'sent', sent_at = NOW(), last_error = NULL
+            WHERE id = ANY(%s)
+        """, (sent_ids,))
+        conn.commit()
+    if failed:
+        for attempt in range(2):
+            try:
+                cur.execute(f"""
+                    UPDATE {schema}.notification_outbox o
+                    SET status = CASE WHEN o.attempts >= %(max_attempts)s OR f.superseded THEN 'failed' ELSE 'pending' END,
+                        next_attempt_at = NOW() + make_interval(secs => %(retry_base)s * power(2, o.attempts - 1)),
+                        last_error = CASE WHEN f.superseded THEN 'superseded: ' || f.error ELSE f.error END
+                    FROM (
+                        SELECT x.id, x.error,
+                               r.coalesce_key IS NOT NULL AND (
+                                   EXISTS(
+                                       SELECT 1 FROM {schema}.notification_outbox p
+                                       WHERE p.status = 'pending' AND p.user_id = r.user_id
+                                         AND p.channel = r.channel AND p.coalesce_key = r.coalesce_key
+                                   )
+                                   -- Несколько неудачных с одним ключом в пачке: в 'pending' — только одна
+                                   OR row_number() OVER (
+                                       PARTITION BY r.user_id, r.channel, r.coalesce_key
+                                       ORDER BY (r.attempts < %(max_attempts)s) DESC, r.id DESC
+                                   ) > 1
+                               ) AS superseded
+                        FROM unnest(%(ids)s::bigint[], %(errors)s::text[]) AS x(id, error)
+                        JOIN {schema}.notification_outbox r ON r.id = x.id
+                    ) AS f
+                    WHERE o.id = f.id
+                """, {
+                    'max_attempts': MAX_ATTEMPTS,
+                    'retry_base': RETRY_BASE_SECONDS,
+                    'ids': [i for i, _ in failed],
+                    'errors': [e for _, e in failed],
+                })
+                conn.commit()
+                break
+            except psycopg2.IntegrityError:
+                # Ожидающая запись с тем же ключом появилась параллельно — после отката она видна
+                conn.rollback()
+                if attempt == 1:
+                    raise
+    cur.close()
@@ -0,0 +1,136 @@
+'''
+In-memory LRU кэш с TTL и инвалидацией по тегам для backend функций
+'''
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'size', 'tags')
+
+    def __init__(self, value: Any, expires_at: float, size: int, tags: Tuple[Hashable, ...]):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.tags = tags
+
+
+def estimate_size(value: Any) -> int:
+    """Приблизительный размер значения в байтах"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 1024
+
+
+class LRUCache:
+    """
+    LRU кэш с TTL: get/set/вытеснение за O(1).
+    Ключи — кортежи, например ('offers_list', 'active', None, 20, 0).
+    Каждой записи можно назначить теги и затем сбросить все записи с тегом,
+    не перебирая весь кэш.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024, default_ttl: float = 120):
+        self._data: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._default_ttl = default_ttl
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0, 'sets': 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return None
+
+        self._data.move_to_end(key)
+        self._stats['hits'] += 1
+        return entry.value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+        tags: Iterable[Hashable] = (),
+        size: Optional[int] = None
+    ) -> None:
+        if key in self._data:
+            self._remove(key)
+
+        size = estimate_size(value) if size is None else size
+        if size > self._max_bytes:
+            return
+
+        ttl = self._default_ttl if ttl is None else ttl
+        entry = _Entry(value, time.monotonic() + ttl, size, tuple(tags))
+        self._data[key] = entry
+        self._bytes += size
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        self._stats['sets'] += 1
+
+        while len(self._data) > self._max_entries or self._bytes > self._max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self._stats['evictions'] += 1
+
+    def delete(self, key: Hashable) -> bool:
+        if key not in self._data:
+            return False
+        self._remove(key)
+        return True
+
+    def invalidate_tags(self, *tags: Hashable) -> int:
+        """Удаляет все записи, помеченные хотя бы одним из тегов"""
+        removed = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                removed += 1
+        self._stats['invalidations'] += removed
+        return removed
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._tags.clear()
+        self._bytes = 0
+
+    def size(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'max_entries': self._max_entries,
+            'max_bytes': self._max_bytes,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
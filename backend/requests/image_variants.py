@@ -0,0 +1,109 @@
+'''
+Варианты изображения для разных экранов: 200/400/800 px по ширине,
+каждый в WebP и JPEG (для браузеров без WebP). Генерируются один раз при
+загрузке: исходник декодируется один раз (image_processing.load_image),
+меньшие размеры получаются уменьшением предыдущего.
+
+Метаданные хранятся в offer_images.variants:
+    {"w200": {"width": 200, "height": 150, "webp": "<url>", "jpeg": "<url>"}, ...}
+offer_images.url остаётся JPEG 800 px — его читают старые клиенты и og-превью.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from image_processing import encode, load_image, resize_within
+
+VARIANT_WIDTHS = (800, 400, 200)
+FULL_WIDTH = 800
+# Карточки списков занимают до ~200 css px, на экранах с DPR 2 нужен 400 px
+LIST_THUMBNAIL_WIDTH = 400
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+S3_BUCKET = 'files'
+
+# Загрузка всех вариантов одного изображения идёт параллельно
+_upload_pool = ThreadPoolExecutor(max_workers=6)
+
+
+def render_variants(image_data: bytes) -> Dict[int, Dict[str, Any]]:
+    """
+    Кодирует все варианты: {ширина: {'width', 'height', 'webp': bytes, 'jpeg': bytes}}.
+    Узкие исходники не увеличиваются: такие варианты совпадают по размеру
+    с исходником.
+    """
+    return render_image_variants(load_image(image_data, max_width=max(VARIANT_WIDTHS)))
+
+
+def render_image_variants(img: Image.Image) -> Dict[int, Dict[str, Any]]:
+    """То же для уже декодированного RGB-изображения (например, после поворота)"""
+    rendered = {}
+    for width in VARIANT_WIDTHS:
+        img = resize_within(img, max_width=width)
+        rendered[width] = {
+            'width': img.width,
+            'height': img.height,
+            'jpeg': encode(img, 'JPEG', JPEG_QUALITY),
+            'webp': encode(img, 'WEBP', WEBP_QUALITY),
+        }
+    return rendered
+
+
+def cdn_url(s3_key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}"
+
+
+def variant_keys(base_key: str, width: int) -> Dict[str, str]:
+    """Ключи S3 варианта; полный JPEG лежит под прежним ключом <base>.jpg"""
+    jpeg_key = f'{base_key}.jpg' if width == FULL_WIDTH else f'{base_key}_{width}.jpg'
+    return {'jpeg': jpeg_key, 'webp': f'{base_key}_{width}.webp'}
+
+
+def plan_uploads(base_key: str, rendered: Dict[int, Dict[str, Any]],
+                 version: Optional[int] = None) -> Tuple[str, Dict[str, Any], List[Tuple[str, bytes, str]]]:
+    """
+    Раскладывает варианты по ключам S3.
+    version добавляется к url как ?v=, когда ключи перезаписываются.
+    Возвращает (url полного JPEG, метаданные для offer_images.variants,
+    [(ключ, тело, content-type)] для загрузки).
+    """
+    suffix = f'?v={version}' if version else ''
+    uploads = []
+    variants: Dict[str, Any] = {}
+    for width, variant in rendered.items():
+        keys = variant_keys(base_key, width)
+        meta = {'width': variant['width'], 'height': variant['height']}
+        for fmt, content_type in (('jpeg', 'image/jpeg'), ('webp', 'image/webp')):
+            uploads.append((keys[fmt], variant[fmt], content_type))
+            meta[fmt] = cdn_url(keys[fmt]) + suffix
+        variants[f'w{width}'] = meta
+    return variants[f'w{FULL_WIDTH}']['jpeg'], variants, uploads
+
+
+def upload_variants(s3, base_key: str, rendered: Dict[int, Dict[str, Any]],
+                    version: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    """Загружает варианты в S3 параллельно (клиент boto3 потокобезопасен); (url, variants)"""
+    url, variants, uploads = plan_uploads(base_key, rendered, version)
+    futures = [
+        _upload_pool.submit(s3.put_object, Bucket=S3_BUCKET, Key=key, Body=body, ContentType=content_type)
+        for key, body, content_type in uploads
+    ]
+    for future in futures:
+        future.result()
+    return url, variants
+
+
+def thumbnail_url(variants: Optional[Dict[str, Any]], fallback: str,
+                  width: int = LIST_THUMBNAIL_WIDTH, fmt: str = 'webp') -> str:
+    """
+    URL превью для карточек списков в формате fmt ('webp' или 'jpeg' — запасной
+    для браузеров без WebP); для изображений без вариантов — исходный url
+    """
+    if not variants:
+        return fallback
+    variant = variants.get(f'w{width}') or variants.get(f'w{FULL_WIDTH}') or {}
+    return variant.get(fmt) or variant.get('jpeg') or fallback
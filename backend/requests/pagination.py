@@ -0,0 +1,59 @@
+'''
+Keyset (cursor) пагинация списков по (дата создания, id)
+'''
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def encode_cursor(sort_value: Any, row_id: Any) -> str:
+    """Непрозрачный курсор на последнюю выданную запись"""
+    if hasattr(sort_value, 'isoformat'):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, str(row_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Разбирает курсор; при битом курсоре возвращает None (первая страница)"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(sort_value), str(row_id)
+    except Exception:
+        return None
+
+
+def split_page(rows: List[Any], limit: int, sort_key: str, id_key: str = 'id') -> Tuple[List[Any], bool, Optional[str]]:
+    """
+    Строки выбраны с LIMIT limit + 1: лишняя строка означает, что есть следующая страница.
+    Возвращает (строки страницы, hasMore, nextCursor).
+    """
+    has_more = len(rows) > limit
+    page = rows[:limit]
+    next_cursor = None
+    if has_more and page:
+        last = page[-1]
+        next_cursor = encode_cursor(last[sort_key], last[id_key])
+    return page, has_more, next_cursor
+
+
+def estimate_count(cur, sql: str, params: Any = None) -> int:
+    """Приблизительное число строк по оценке планировщика (без выполнения COUNT(*))"""
+    cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    row = cur.fetchone()
+    plan = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def page_meta(limit: int, has_more: bool, next_cursor: Optional[str], total: Optional[int] = None, approximate: bool = False) -> Dict[str, Any]:
+    meta = {'limit': limit, 'hasMore': has_more, 'nextCursor': next_cursor}
+    if total is not None:
+        meta['total'] = total
+        meta['totalApproximate'] = approximate
+    return meta
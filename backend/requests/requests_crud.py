@@ -2,7 +2,8 @@ import json
 from typing import Dict, Any, List
 from psycopg2.extras import RealDictCursor
 
-from requests_utils import get_db_connection, upload_image_to_s3
+from requests_utils import get_db_connection, get_s3_client, request_counts
+from image_uploads import prepare_image, kick_image_processing, ImageUploadError
 
 
 def create_request(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
@@ -81,14 +82,23 @@ def create_request(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
     result = cur.fetchone()
     request_id = result['id']
 
+    queued_images = 0
     if body.get('images'):
         for idx, img in enumerate(body['images']):
-            img_url = upload_image_to_s3(img['url'])
+            # Исходник ставится в очередь обработки (offers ?action=process-images),
+            # data URL в БД не сохраняется
+            try:
+                img_url, source_key = prepare_image(get_s3_client, img['url'], 'request-uploads')
+            except ImageUploadError as e:
+                print(f"Failed to accept image: {e}")
+                continue
             cur.execute(
-                "INSERT INTO t_p42562714_web_app_creation_1.offer_images (url, alt) VALUES (%s, %s) RETURNING id",
-                (img_url, img.get('alt', ''))
+                "INSERT INTO t_p42562714_web_app_creation_1.offer_images (url, alt, processing_status, source_key) VALUES (%s, %s, %s, %s) RETURNING id",
+                (img_url, img.get('alt', ''), 'pending' if source_key else None, source_key)
             )
             image_id = cur.fetchone()['id']
+            if source_key:
+                queued_images += 1
             cur.execute(
                 "INSERT INTO t_p42562714_web_app_creation_1.request_image_relations (request_id, image_id, sort_order) VALUES (%s, %s, %s)",
                 (request_id, image_id, idx)
@@ -97,6 +107,9 @@ def create_request(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str,
     conn.commit()
     cur.close()
     conn.close()
+    request_counts.clear()
+    if queued_images:
+        kick_image_processing()
 
     return {
         'statusCode': 201,
@@ -182,6 +195,7 @@ def update_request(request_id: str, event: Dict[str, Any], headers: Dict[str, st
             params.append(body[js_key])
 
     images_changed = 'images' in body
+    queued_images = 0
     video_changed = 'video' in body
 
     if not updates and not images_changed and not video_changed:
@@ -213,6 +227,11 @@ def update_request(request_id: str, event: Dict[str, Any], headers: Dict[str, st
             alt = img.get('alt', '') if isinstance(img, dict) else ''
             if not url:
                 continue
+            try:
+                url, source_key = prepare_image(get_s3_client, url, 'request-uploads')
+            except ImageUploadError as e:
+                print(f"Failed to accept image: {e}")
+                continue
             cur.execute(
                 f"SELECT id FROM {SCHEMA}.offer_images WHERE url = %s",
                 (url,)
@@ -222,10 +241,12 @@ def update_request(request_id: str, event: Dict[str, Any], headers: Dict[str, st
                 image_id = existing['id']
             else:
                 cur.execute(
-                    f"INSERT INTO {SCHEMA}.offer_images (url, alt) VALUES (%s, %s) RETURNING id",
-                    (url, alt)
+                    f"INSERT INTO {SCHEMA}.offer_images (url, alt, processing_status, source_key) VALUES (%s, %s, %s, %s) RETURNING id",
+                    (url, alt, 'pending' if source_key else None, source_key)
                 )
                 image_id = cur.fetchone()['id']
+                if source_key:
+                    queued_images += 1
             cur.execute(
                 f"INSERT INTO {SCHEMA}.request_image_relations (request_id, image_id, sort_order) VALUES (%s, %s, %s)",
                 (request_id, image_id, idx)
@@ -260,6 +281,9 @@ def update_request(request_id: str, event: Dict[str, Any], headers: Dict[str, st
     conn.commit()
     cur.close()
     conn.close()
+    request_counts.clear()
+    if queued_images:
+        kick_image_processing()
 
     return {
         'statusCode': 200,
@@ -296,6 +320,7 @@ def delete_request(request_id: str, headers: Dict[str, str]) -> Dict[str, Any]:
         conn.commit()
         cur.close()
         conn.close()
+        request_counts.clear()
 
         return {
             'statusCode': 200,
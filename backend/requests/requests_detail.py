@@ -37,7 +37,7 @@ def get_request_by_id(request_id: str, event: Dict[str, Any], headers: Dict[str,
             ) as accepted_qty,
             COALESCE(
                 json_agg(
-                    json_build_object('id', ri.id, 'url', ri.url, 'alt', ri.alt)
+                    json_build_object('id', ri.id, 'url', ri.url, 'alt', ri.alt, 'variants', ri.variants)
                 ) FILTER (WHERE ri.id IS NOT NULL),
                 '[]'::json
             ) as images,
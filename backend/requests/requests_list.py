@@ -1,10 +1,12 @@
 import json
-import http.client
 from typing import Dict, Any
 from decimal import Decimal
 from psycopg2.extras import RealDictCursor
 
-from requests_utils import get_db_connection, json_default
+from requests_utils import get_db_connection, json_default, request_counts, COUNT_CACHE_TTL
+from pagination import decode_cursor, split_page, estimate_count, page_meta
+from search import search_filter, search_rank
+from image_variants import thumbnail_url
 
 
 def get_requests_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
@@ -19,148 +21,132 @@ def get_requests_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[st
     limit = min(int(params.get('limit', '10')), 20)
     offset = int(params.get('offset', '0'))
 
+    # Keyset-пагинация: ?cursor= (пустой для первой страницы) вместо offset
+    cursor_mode = 'cursor' in params
+    cursor = decode_cursor(params.get('cursor')) if cursor_mode else None
+    total_mode = params.get('total')
+
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    # Авто-архивация истёкших запросов по expiry_date
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.requests
-        SET status = 'archived', updated_at = NOW()
-        WHERE status = 'active'
-          AND expiry_date IS NOT NULL
-          AND expiry_date < NOW()
-        RETURNING user_id, title
-    """)
-    expired_requests = cur.fetchall()
-
-    # Авто-архивация запросов с истёкшим сроком поставки (deadline_end)
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.requests
-        SET status = 'archived', updated_at = NOW()
-        WHERE status = 'active'
-          AND deadline_end IS NOT NULL
-          AND deadline_end < CURRENT_DATE
-        RETURNING user_id, title
-    """)
-    expired_requests += cur.fetchall()
-    conn.commit()
-
-    # Авто-закрытие запросов только если принятое количество >= запрошенному (и quantity > 0)
-    cur.execute("""
-        UPDATE t_p42562714_web_app_creation_1.requests
-        SET status = 'closed', updated_at = NOW()
-        WHERE status = 'active'
-          AND requests.quantity > 0
-          AND COALESCE((
-              SELECT SUM(o.quantity) FROM t_p42562714_web_app_creation_1.orders o
-              WHERE o.offer_id = requests.id
-                AND o.status = 'accepted'
-          ), 0) >= requests.quantity
-        RETURNING user_id, title
-    """)
-    accepted_requests = cur.fetchall()
-    conn.commit()
-
-    # Уведомляем владельцев о закрытии принятых запросов
-    for row in accepted_requests:
-        try:
-            payload = json.dumps({
-                'userId': row['user_id'],
-                'title': 'Запрос закрыт — исполнитель найден',
-                'message': f'Запрос «{row["title"]}» скрыт из публичного списка, так как по нему принят исполнитель.',
-                'url': '/my-orders?tab=my-requests'
-            })
-            try:
-                conn2 = http.client.HTTPSConnection('functions.poehali.dev', timeout=3)
-                conn2.request('POST', '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a', payload, {'Content-Type': 'application/json'})
-                conn2.getresponse().read()
-                conn2.close()
-            except Exception:
-                pass
-        except Exception as e:
-            print(f'[ACCEPTED] Notification error: {e}')
-
-    # Уведомляем владельцев об архивации
-    for row in expired_requests:
-        try:
-            payload = json.dumps({
-                'userId': row['user_id'],
-                'title': 'Запрос снят с публикации',
-                'message': f'Срок публикации запроса «{row["title"]}» истёк. Перейдите в «Мои запросы» чтобы опубликовать снова.',
-                'url': '/my-requests'
-            })
-            try:
-                conn2 = http.client.HTTPSConnection('functions.poehali.dev', timeout=3)
-                conn2.request('POST', '/a1c8fafd-b64f-45e5-b9b9-0a050cca4f7a', payload, {'Content-Type': 'application/json'})
-                conn2.getresponse().read()
-                conn2.close()
-            except Exception:
-                pass
-        except Exception as e:
-            print(f'[EXPIRY] Notification error: {e}')
-
-    sql = """
-        SELECT 
-            r.*,
-            COALESCE(
-                (SELECT json_agg(json_build_object('id', oi.id, 'url', oi.url, 'alt', oi.alt))
-                 FROM t_p42562714_web_app_creation_1.request_image_relations rir
-                 JOIN t_p42562714_web_app_creation_1.offer_images oi ON rir.image_id = oi.id
-                 WHERE rir.request_id = r.id),
-                '[]'::json
-            ) as images,
-            (SELECT COUNT(*) FROM t_p42562714_web_app_creation_1.orders o 
-             WHERE o.offer_id = r.id AND o.status NOT IN ('cancelled')
-            ) as responses,
-            COALESCE(
-                (SELECT SUM(o.quantity) FROM t_p42562714_web_app_creation_1.orders o
-                 WHERE o.offer_id = r.id AND o.status = 'accepted'),
-                0
-            ) as accepted_qty
+    # Общая часть FROM/WHERE для страницы и для подсчёта total
+    filter_sql = """
         FROM t_p42562714_web_app_creation_1.requests r
+        LEFT JOIN t_p42562714_web_app_creation_1.request_stats rs ON rs.request_id = r.id
         WHERE r.status != 'archived' AND r.status != 'closed' AND (r.is_removed IS NULL OR r.is_removed = FALSE)
-          AND NOT (
-            r.category = 'transport'
-            AND EXISTS (
-              SELECT 1 FROM t_p42562714_web_app_creation_1.orders o
-              WHERE o.offer_id = r.id AND o.status = 'accepted'
-            )
-          )
+          AND NOT (r.category = 'transport' AND COALESCE(rs.has_accepted, FALSE))
+          -- Истёкшие и закрываемые запросы переводит в 'archived'/'closed' archive-expired
+          -- по расписанию; до его запуска они просто не показываются
+          AND NOT (r.status = 'active' AND ((r.expiry_date IS NOT NULL AND r.expiry_date < NOW())
+                                            OR (r.deadline_end IS NOT NULL AND r.deadline_end < CURRENT_DATE)))
+          AND NOT (r.status = 'active' AND r.quantity > 0 AND COALESCE(rs.has_accepted, FALSE)
+                   AND rs.accepted_quantity >= r.quantity)
     """
-
-    query_params = []
+    filter_params = []
 
     # Если передан конкретный статус (не 'all'), добавляем фильтр
     if status and status != 'all':
-        sql += " AND r.status = %s"
-        query_params.append(status)
+        filter_sql += " AND r.status = %s"
+        filter_params.append(status)
 
     if category:
-        sql += " AND r.category = %s"
-        query_params.append(category)
+        filter_sql += " AND r.category = %s"
+        filter_params.append(category)
 
     if subcategory:
-        sql += " AND r.subcategory = %s"
-        query_params.append(subcategory)
+        filter_sql += " AND r.subcategory = %s"
+        filter_params.append(subcategory)
 
     if district:
-        sql += " AND r.district = %s"
-        query_params.append(district)
-
-    if query:
-        sql += " AND (r.title ILIKE %s OR r.description ILIKE %s)"
-        search_term = f'%{query}%'
-        query_params.extend([search_term, search_term])
-
-    sql += " ORDER BY r.created_at DESC LIMIT %s OFFSET %s"
-    query_params.extend([limit, offset])
+        filter_sql += " AND r.district = %s"
+        filter_params.append(district)
+
+    # Полнотекстовый поиск по search_vector (GIN) + подстрока заголовка (триграммы)
+    search_sql, search_params = search_filter('r', query)
+    if search_sql:
+        filter_sql += f" AND {search_sql}"
+        filter_params.extend(search_params)
+
+    # Общее количество: в режиме offset — всегда, в режиме курсора — по запросу.
+    # Точный COUNT кэшируется на COUNT_CACHE_TTL секунд по набору фильтров
+    total_count = None
+    if not cursor_mode or total_mode == 'exact':
+        count_key = ('requests_count', status, category, subcategory, district, query.strip())
+        total_count = request_counts.get(count_key)
+        if total_count is None:
+            cur.execute(f"SELECT COUNT(*) AS total {filter_sql}", filter_params)
+            total_count = cur.fetchone()['total']
+            request_counts.set(count_key, total_count, ttl=COUNT_CACHE_TTL, size=64)
+    elif total_mode == 'approx':
+        total_count = estimate_count(cur, f"SELECT 1 {filter_sql}", filter_params)
+
+    # Релевантность поиска (0 без строки поиска)
+    rank_sql, rank_params = search_rank('r', query) if search_sql else ('0.0', [])
+
+    sql = f"""
+        SELECT 
+            r.*,
+            {rank_sql} AS search_rank,
+            COALESCE(rs.responses_count, 0) as responses,
+            COALESCE(rs.accepted_quantity, 0) as accepted_qty
+        {filter_sql}
+    """
+    query_params = rank_params + filter_params
+
+    if cursor:
+        sql += " AND (r.created_at, r.id) < (%s, %s)"
+        query_params.extend(cursor)
+
+    # Лишняя (limit + 1)-я строка означает, что есть следующая страница
+    if cursor_mode:
+        sql += " ORDER BY r.created_at DESC, r.id DESC LIMIT %s"
+        query_params.append(limit + 1)
+    elif search_sql:
+        # В режиме offset результаты поиска сортируются по релевантности
+        sql += " ORDER BY search_rank DESC, r.created_at DESC, r.id DESC LIMIT %s OFFSET %s"
+        query_params.extend([limit + 1, offset])
+    else:
+        sql += " ORDER BY r.created_at DESC, r.id DESC LIMIT %s OFFSET %s"
+        query_params.extend([limit + 1, offset])
 
     cur.execute(sql, query_params)
     requests_data = cur.fetchall()
 
+    if cursor_mode:
+        requests_data, has_more, next_cursor = split_page(requests_data, limit, 'created_at')
+    else:
+        has_more = len(requests_data) > limit
+        requests_data = requests_data[:limit]
+
+    # Изображения — одним запросом для всей страницы; необработанные исходники
+    # (ещё без вариантов) карточке не отдаём — вместо них плейсхолдер
+    images_map = {}
+    if requests_data:
+        cur.execute("""
+            SELECT rir.request_id, oi.id, oi.url, oi.alt, oi.variants
+            FROM t_p42562714_web_app_creation_1.request_image_relations rir
+            JOIN t_p42562714_web_app_creation_1.offer_images oi ON rir.image_id = oi.id
+            WHERE rir.request_id = ANY(%s::uuid[])
+              AND oi.processing_status IS NULL
+            ORDER BY rir.request_id, rir.sort_order
+        """, ([str(req['id']) for req in requests_data],))
+        for image_row in cur.fetchall():
+            images_map.setdefault(str(image_row['request_id']), []).append(
+                {
+                    'id': image_row['id'],
+                    'url': image_row['url'],
+                    'thumbnailUrl': thumbnail_url(image_row['variants'], image_row['url']),
+                    'thumbnailJpegUrl': thumbnail_url(image_row['variants'], image_row['url'], fmt='jpeg'),
+                    'alt': image_row['alt']
+                }
+            )
+
     result = []
     for req in requests_data:
         req_dict = dict(req)
+        req_dict.pop('search_vector', None)
+        req_dict['images'] = images_map.get(str(req_dict['id']), [])
+        search_rank_value = req_dict.pop('search_rank', 0)
         if isinstance(req_dict.get('price_per_unit'), Decimal):
             req_dict['price_per_unit'] = float(req_dict['price_per_unit'])
         if isinstance(req_dict.get('budget'), Decimal):
@@ -203,15 +189,31 @@ def get_requests_list(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[st
         req_dict['transportComment'] = req_dict.pop('transport_comment', None)
         req_dict['transportAllDistricts'] = req_dict.pop('transport_all_districts', False)
         req_dict['acceptedQty'] = float(req_dict.pop('accepted_qty', 0) or 0)
+        if search_sql:
+            req_dict['searchRank'] = float(search_rank_value or 0)
 
         result.append(req_dict)
 
     cur.close()
     conn.close()
 
+    if cursor_mode:
+        response_data = {
+            'requests': result,
+            **page_meta(limit, has_more, next_cursor, total_count, approximate=total_mode == 'approx')
+        }
+    else:
+        response_data = {
+            'requests': result,
+            'total': total_count,
+            'limit': limit,
+            'offset': offset,
+            'hasMore': has_more
+        }
+
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'requests': result, 'total': len(result)}, default=json_default),
+        'body': json.dumps(response_data, default=json_default),
         'isBase64Encoded': False
     }
\ No newline at end of file
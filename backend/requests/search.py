@@ -0,0 +1,58 @@
+'''
+Полнотекстовый поиск по спискам запросов и предложений.
+Строка поиска превращается в tsquery с префиксным совпадением каждого слова
+('карто молод' → 'карто:* & молод:*') и проверяется по колонке search_vector
+(GIN-индекс, русская морфология). Дополнительно заголовок сверяется через
+ILIKE '%...%' по триграммному индексу — так находятся части слов и артикулы.
+'''
+
+import re
+from typing import List, Optional, Tuple
+
+SEARCH_CONFIG = 'russian'
+MAX_SEARCH_TERMS = 8
+MAX_QUERY_LENGTH = 200
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_tsquery(text: str) -> Optional[str]:
+    """Слова строки поиска → 'w1:* & w2:*'; None, если слов нет"""
+    words = _WORD_RE.findall((text or '')[:MAX_QUERY_LENGTH].lower())
+    words = list(dict.fromkeys(words))[:MAX_SEARCH_TERMS]
+    if not words:
+        return None
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_filter(alias: str, text: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Условие WHERE для поиска и его параметры.
+    Возвращает (None, []), если строка поиска пустая.
+    """
+    text = (text or '').strip()[:MAX_QUERY_LENGTH]
+    if not text:
+        return None, []
+    tsquery = build_tsquery(text)
+    if tsquery is None:
+        return f"{alias}.title ILIKE %s", [_like_pattern(text)]
+    return (
+        f"({alias}.search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s) OR {alias}.title ILIKE %s)",
+        [tsquery, _like_pattern(text)]
+    )
+
+
+def search_rank(alias: str, text: str) -> Tuple[str, List[str]]:
+    """
+    Выражение релевантности для SELECT/ORDER BY: совпадения в заголовке (вес A)
+    выше, чем в описании; совпадение только по подстроке заголовка — минимальный ранг.
+    """
+    tsquery = build_tsquery(text)
+    if tsquery is None:
+        return '0.0', []
+    return f"ts_rank_cd({alias}.search_vector, to_tsquery('{SEARCH_CONFIG}', %s))", [tsquery]
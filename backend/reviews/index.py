@@ -122,6 +122,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             result = cur.fetchone()
             
+            # Сводка отзывов продавца для списков заказов — в той же транзакции
+            cur.execute(f'''
+                INSERT INTO {schema}.user_rating_summary AS s (user_id, reviews_count, rating_sum)
+                VALUES (%s, 1, %s)
+                ON CONFLICT (user_id) DO UPDATE
+                SET reviews_count = s.reviews_count + 1,
+                    rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+                    updated_at = NOW()
+            ''', (seller_id, int(rating)))
+            
             # Обновляем рейтинг продавца по звёздам
             star_delta = {5: 0.05, 4: 0.02, 3: 0.0, 2: -0.03, 1: -0.05}
             delta = star_delta.get(int(rating), 0.0)
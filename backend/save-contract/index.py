@@ -2,6 +2,7 @@ import json
 import os
 import traceback
 import psycopg2
+from contract_summary import refresh_seller_reliability
 
 CORS = {
     'Access-Control-Allow-Origin': '*',
@@ -95,6 +96,9 @@ def handler(event: dict, context) -> dict:
             body.get('termsConditions', ''), new_status, product_images,
             int(contract_id),
         ))
+        if new_status != row[1]:
+            # Публикация завершённого/отменённого контракта меняет надёжность продавца
+            refresh_seller_reliability(cur, [row[0]])
         conn.commit()
         cur.close(); conn.close()
         return {'statusCode': 200, 'headers': {**CORS, 'Content-Type': 'application/json'},
@@ -3,9 +3,11 @@ import os
 import base64
 import uuid
 import re
-import io
 from typing import Dict, Any, Optional, List, Tuple
 import boto3
+from botocore.config import Config
+from image_processing import encode, load_image, resize_within, to_rgb
+from plate_detector import detect_plate_regions
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -13,6 +15,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     API для загрузки видео и изображений.
     При загрузке фото авто (isAutoPhoto=true) автоматически скрывает гос. номер текстом ЕРТТП.
     POST / - загрузить медиа и получить URL
+    POST /?action=init     - начать загрузку видео чанками (S3 multipart)
+    POST /?action=chunk    - чанк видео (base64); каждые CHUNKS_PER_PART чанков — часть S3
+    POST /?action=complete - завершить загрузку по списку частей
+    POST /?action=abort    - отменить загрузку
     """
     method: str = event.get('httpMethod', 'GET')
 
@@ -38,10 +44,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if method == 'POST':
             params = event.get('queryStringParameters') or {}
             action = params.get('action', '')
+            if action == 'init':
+                return init_video_upload(event, headers)
             if action == 'chunk':
                 return upload_video_chunk(event, headers, params)
             if action == 'complete':
                 return complete_video_chunks(event, headers, params)
+            if action == 'abort':
+                return abort_video_upload(event, headers)
             if params.get('binary') == '1':
                 content_type = params.get('ct', 'video/mp4')
                 return upload_binary_video(event, headers, content_type)
@@ -67,118 +77,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
 
 
-def fix_image_orientation(img):
-    """
-    Исправляет ориентацию изображения по EXIF-тегу (актуально для фото с телефона).
-    """
-    try:
-        from PIL import ImageOps
-        return ImageOps.exif_transpose(img)
-    except Exception:
-        return img
-
-
-def detect_license_plate_regions(img) -> List[Tuple[int, int, int, int]]:
-    """
-    Детектирует вероятные зоны гос. номеров на изображении.
-    Ищет только в нижней половине кадра (где обычно находится номер авто).
-    Возвращает список (x, y, w, h) найденных зон в координатах оригинального изображения.
-    Использует numpy для быстрых матричных вычислений.
-    """
-    from PIL import Image
-    import math
-    import numpy as np
-
-    orig_width, orig_height = img.size
-
-    # Уменьшаем рабочий размер до 400px — достаточно для детекции, в 2× быстрее чем 600
-    MAX_DIM = 400
-    scale = min(MAX_DIM / orig_width, MAX_DIM / orig_height, 1.0)
-    work_w = max(1, int(orig_width * scale))
-    work_h = max(1, int(orig_height * scale))
-    small = img.resize((work_w, work_h), Image.BILINEAR)
-
-    width, height = small.size
-    # Конвертируем в numpy-массив сразу — быстрее чем crop+getdata на каждой итерации
-    gray_arr = np.array(small.convert('L'), dtype=np.float32)
-
-    # Номер авто — нижние 65% изображения (расширено для захвата тёмных номеров)
-    y_start = int(height * 0.35)
-
-    # Крупный шаг — достаточно для детекции
-    step_x = max(1, width // 20)
-    step_y = max(1, height // 20)
-
-    plate_configs = [
-        (0.15, 4.0),  # небольшой номер
-        (0.18, 4.2),  # небольшой номер
-        (0.22, 4.8),  # стандарт (520x112 мм ≈ 4.6:1)
-        (0.26, 5.2),  # крупный
-        (0.30, 5.5),  # очень крупный / квадратный кадр
-    ]
-
-    candidates = []
-
-    for pw_ratio, aspect in plate_configs:
-        pw = int(width * pw_ratio)
-        ph = max(5, int(pw / aspect))
-
-        if pw < 8 or ph < 4:
-            continue
-
-        for y in range(y_start, height - ph, step_y):
-            for x in range(0, width - pw, step_x):
-                region = gray_arr[y:y + ph, x:x + pw]
-
-                avg_brightness = region.mean()
-                contrast = float(region.max() - region.min())
-                variance = float(region.var())
-
-                # Принимаем и светлые (белые номера) и тёмные (затенённые)
-                # Главный признак — высокий контраст и дисперсия (текст на фоне)
-                if contrast <= 60:
-                    continue
-                if variance <= 500:
-                    continue
-                # Отсекаем только совсем однородные тёмные зоны без контраста
-                if avg_brightness <= 40 and contrast <= 80:
-                    continue
-
-                y_position_ratio = y / height
-                position_bonus = y_position_ratio * 60
-                # Для тёмных номеров снижаем вес яркости, повышаем вес контраста
-                score = min(avg_brightness, 200) * 0.1 + contrast * 0.6 + math.sqrt(variance) * 0.3 + position_bonus
-                candidates.append((score, x, y, pw, ph))
-
-    if not candidates:
-        return []
-
-    candidates.sort(reverse=True)
-    top_candidates = candidates[:15]
-
-    # NMS — убираем перекрывающиеся зоны
-    selected = []
-    for score, x, y, w, h in top_candidates:
-        is_duplicate = False
-        for sx, sy, sw, sh in selected:
-            overlap_x = max(0, min(x + w, sx + sw) - max(x, sx))
-            overlap_y = max(0, min(y + h, sy + sh) - max(y, sy))
-            overlap_area = overlap_x * overlap_y
-            min_area = min(w * h, sw * sh)
-            if min_area > 0 and overlap_area / min_area > 0.3:
-                is_duplicate = True
-                break
-        if not is_duplicate:
-            selected.append((x, y, w, h))
-
-    # Переводим координаты обратно в масштаб оригинального изображения
-    if scale < 1.0:
-        inv = 1.0 / scale
-        selected = [(int(x * inv), int(y * inv), int(w * inv), int(h * inv)) for x, y, w, h in selected]
-
-    return selected[:2]  # максимум 2 зоны (перед + зад)
-
-
 def detect_license_plate_google_vision(image_data: bytes) -> List[Tuple[int, int, int, int]]:
     """
     Использует Google Vision API для точного обнаружения гос. номеров.
@@ -368,22 +266,16 @@ def cover_license_plates(image_data: bytes, image_format: str) -> Optional[bytes
     Возвращает обработанные байты или None если обработка не нужна/не удалась.
     """
     try:
-        from PIL import Image
-
-        img = Image.open(io.BytesIO(image_data))
-
-        # Исправляем ориентацию по EXIF (критично для фото с телефона)
-        img = fix_image_orientation(img)
+        # Одно декодирование: JPEG сразу в уменьшенном масштабе (draft), поворот по EXIF
+        # (критично для фото с телефона). Очень большие изображения сжимаются до 2000 px,
+        # чтобы не было таймаута
+        max_side = 2000
+        img = load_image(image_data, max_side=max_side, flatten=False)
+        img = resize_within(img, max_side=max_side)
 
-        # Конвертируем в RGB для рисования (на случай RGBA/P)
+        # Конвертируем в RGB для рисования (на случай P/L/CMYK); прозрачность PNG сохраняем
         if img.mode not in ('RGB', 'RGBA'):
-            img = img.convert('RGB')
-
-        # Сжимаем очень большие изображения чтобы не было таймаута
-        max_side = 2000
-        if img.width > max_side or img.height > max_side:
-            img.thumbnail((max_side, max_side), Image.LANCZOS)
-            print(f'Image resized to {img.width}x{img.height} for processing')
+            img = img.convert('RGBA') if 'A' in img.getbands() or 'transparency' in img.info else to_rgb(img)
 
         # 1. Пробуем Google Vision API — самый точный метод
         raw_regions = detect_license_plate_google_vision(image_data)
@@ -395,7 +287,7 @@ def cover_license_plates(image_data: bytes, image_format: str) -> Optional[bytes
             draw_erttp_on_regions(img, pixel_regions)
         else:
             # 2. Запасной алгоритм — собственная детекция через PIL/numpy
-            fallback_regions = detect_license_plate_regions(img)
+            fallback_regions = detect_plate_regions(img)
             fallback_regions = merge_overlapping_regions(fallback_regions)
             if not fallback_regions:
                 print('License plate detection: no plates found (both methods)')
@@ -403,18 +295,11 @@ def cover_license_plates(image_data: bytes, image_format: str) -> Optional[bytes
             print(f'Using fallback detector: {len(fallback_regions)} plate(s) found')
             draw_erttp_on_regions(img, fallback_regions)
 
-        # Сохраняем в буфер
-        output = io.BytesIO()
+        # Сохраняем в исходном формате (остальные — в JPEG)
         save_format = 'JPEG' if image_format in ('jpg', 'jpeg') else image_format.upper()
-        if save_format == 'WEBP':
-            img.save(output, format='WEBP', quality=90)
-        elif save_format == 'PNG':
-            img.save(output, format='PNG')
-        else:
-            img = img.convert('RGB')
-            img.save(output, format='JPEG', quality=90)
-        output.seek(0)
-        return output.read()
+        if save_format not in ('WEBP', 'PNG'):
+            save_format = 'JPEG'
+        return encode(img, save_format, quality=90)
 
     except Exception as e:
         import traceback
@@ -626,103 +511,153 @@ def upload_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
         }
 
 
+# Видео приходит чанками по 1 МБ (лимит тела запроса функции), а части
+# S3 multipart, кроме последней, должны быть не меньше 5 МБ. Чанки одной
+# части копятся во временных объектах и отправляются в upload_part, когда
+# пришёл последний чанк группы: в памяти не больше одной части.
+CHUNKS_PER_PART = 8
+VIDEO_FOLDER = 'offer-videos'
+CHUNKS_FOLDER = 'tmp-video-chunks'
+
+
 def get_s3():
     return boto3.client('s3',
         endpoint_url='https://bucket.poehali.dev',
         aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
         aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        # Повторы при 503/таймаутах хранилища делает сам boto3
+        config=Config(retries={'max_attempts': 5, 'mode': 'standard'}),
     )
 
 
+def read_json_body(event: Dict[str, Any]) -> Dict[str, Any]:
+    body_raw = event.get('body') or '{}'
+    if event.get('isBase64Encoded'):
+        body_raw = base64.b64decode(body_raw).decode('utf-8')
+    return json.loads(body_raw)
+
+
+def chunk_key(key: str, index: int) -> str:
+    """Временный объект чанка: tmp-video-chunks/<id файла>/part_00000"""
+    file_id = key.rsplit('/', 1)[-1].split('.', 1)[0]
+    return f"{CHUNKS_FOLDER}/{file_id}/part_{str(index).zfill(5)}"
+
+
+def valid_upload(key: str, upload_id: str) -> bool:
+    return bool(upload_id) and key.startswith(f"{VIDEO_FOLDER}/") and '..' not in key
+
+
+def init_video_upload(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Создаёт multipart-загрузку итогового файла; клиент получает uploadId и key"""
+    body = read_json_body(event)
+    filename = body.get('filename', 'video.mp4')
+    content_type = body.get('contentType', 'video/mp4')
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else VIDEO_MIME_EXTENSIONS.get(content_type, 'mp4')
+
+    key = f"{VIDEO_FOLDER}/{uuid.uuid4()}.{ext}"
+    resp = get_s3().create_multipart_upload(Bucket='files', Key=key, ContentType=content_type)
+    print(f"Multipart upload started: {key}")
+
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'uploadId': resp['UploadId'], 'key': key}),
+        'isBase64Encoded': False
+    }
+
+
 def upload_video_chunk(event: Dict[str, Any], headers: Dict[str, str], params: Dict[str, str]) -> Dict[str, Any]:
-    """Принимает один чанк видео (base64) и сохраняет во временный S3-объект"""
+    """
+    Принимает один чанк видео (base64). Чанк, закрывающий группу из
+    CHUNKS_PER_PART (или последний, last=1), отправляет группу в S3 одной
+    частью и возвращает её partNumber и etag; остальные возвращают part=null.
+    """
     upload_id = params.get('uploadId', '')
-    part_number = params.get('part', '0')
-    if not upload_id:
-        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing uploadId'}), 'isBase64Encoded': False}
+    key = params.get('key', '')
+    if not valid_upload(key, upload_id):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing uploadId or key'}), 'isBase64Encoded': False}
+    index = int(params.get('part', '0'))
+    is_last = params.get('last') == '1'
 
-    body_raw = event.get('body', '')
-    if event.get('isBase64Encoded'):
-        body_raw = base64.b64decode(body_raw).decode('utf-8')
     try:
-        body_json = json.loads(body_raw)
-        chunk_data = base64.b64decode(body_json.get('chunk', ''))
+        chunk_data = base64.b64decode(read_json_body(event).get('chunk', ''))
     except Exception:
         chunk_data = b''
+    if not chunk_data:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Empty chunk'}), 'isBase64Encoded': False}
 
     s3 = get_s3()
-    tmp_key = f"tmp-video-chunks/{upload_id}/part_{part_number.zfill(5)}"
-    s3.put_object(Bucket='files', Key=tmp_key, Body=chunk_data)
-    print(f"Chunk {part_number} saved: {tmp_key}, size={len(chunk_data)}")
+    if not is_last and (index + 1) % CHUNKS_PER_PART:
+        s3.put_object(Bucket='files', Key=chunk_key(key, index), Body=chunk_data)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True, 'part': None}), 'isBase64Encoded': False}
+
+    # Чанк закрывает часть: добираем сохранённые чанки группы
+    first = index - index % CHUNKS_PER_PART
+    part_number = index // CHUNKS_PER_PART + 1
+    staged = [chunk_key(key, i) for i in range(first, index)]
+    pieces = []
+    for tmp_key in staged:
+        try:
+            pieces.append(s3.get_object(Bucket='files', Key=tmp_key)['Body'].read())
+        except s3.exceptions.NoSuchKey:
+            return {'statusCode': 409, 'headers': headers, 'body': json.dumps({'error': f'Missing chunk {tmp_key}'}), 'isBase64Encoded': False}
+    pieces.append(chunk_data)
+
+    resp = s3.upload_part(Bucket='files', Key=key, UploadId=upload_id, PartNumber=part_number, Body=b''.join(pieces))
+    if staged:
+        s3.delete_objects(Bucket='files', Delete={'Objects': [{'Key': k} for k in staged], 'Quiet': True})
 
+    print(f"Part {part_number} uploaded for {key} (chunks {first}..{index})")
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'ok': True, 'part': part_number}),
+        'body': json.dumps({'ok': True, 'part': {'partNumber': part_number, 'etag': resp['ETag']}}),
         'isBase64Encoded': False
     }
 
 
 def complete_video_chunks(event: Dict[str, Any], headers: Dict[str, str], params: Dict[str, str]) -> Dict[str, Any]:
-    """Склеивает все чанки, загружает финальный файл, удаляет временные"""
-    body_raw = event.get('body', '{}')
-    if event.get('isBase64Encoded'):
-        body_raw = base64.b64decode(body_raw).decode('utf-8')
-    body = json.loads(body_raw)
-
+    """Завершает multipart-загрузку: хранилище само склеивает части, данные через функцию не идут"""
+    body = read_json_body(event)
     upload_id = body.get('uploadId', '')
-    filename = body.get('filename', 'video.mp4')
-    content_type = body.get('contentType', 'video/mp4')
-    total_parts = int(body.get('totalParts', 0))
-
-    if not upload_id or not total_parts:
-        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing uploadId or totalParts'}), 'isBase64Encoded': False}
-
-    s3 = get_s3()
-
-    # Читаем и склеиваем все чанки по порядку
-    final_data = bytearray()
-    for i in range(total_parts):
-        tmp_key = f"tmp-video-chunks/{upload_id}/part_{str(i).zfill(5)}"
-        try:
-            obj = s3.get_object(Bucket='files', Key=tmp_key)
-            final_data.extend(obj['Body'].read())
-            print(f"Read chunk {i}: {tmp_key}")
-        except Exception as e:
-            print(f"ERROR reading chunk {i}: {e}")
-            return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': f'Missing chunk {i}'}), 'isBase64Encoded': False}
-
-    # Сохраняем финальный файл (с retry при 503)
-    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'mp4'
-    file_id = str(uuid.uuid4())
-    s3_key = f"offer-videos/{file_id}.{ext}"
-    import time as _time
-    last_err = None
-    for attempt in range(5):
-        try:
-            s3.put_object(Bucket='files', Key=s3_key, Body=bytes(final_data), ContentType=content_type)
-            last_err = None
-            break
-        except Exception as e:
-            last_err = e
-            print(f"put_object attempt {attempt+1} failed: {e}")
-            _time.sleep(2 ** attempt)
-    if last_err:
-        return {'statusCode': 503, 'headers': headers, 'body': json.dumps({'error': f'Storage unavailable after retries: {str(last_err)}'}), 'isBase64Encoded': False}
-    print(f"Final video uploaded: {s3_key}, size={len(final_data) / 1024 / 1024:.2f} MB")
-
-    # Удаляем временные чанки
-    for i in range(total_parts):
-        tmp_key = f"tmp-video-chunks/{upload_id}/part_{str(i).zfill(5)}"
-        try:
-            s3.delete_object(Bucket='files', Key=tmp_key)
-        except Exception:
-            pass
+    key = body.get('key', '')
+    parts = body.get('parts') or []
+    if not valid_upload(key, upload_id) or not parts:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing uploadId, key or parts'}), 'isBase64Encoded': False}
+
+    get_s3().complete_multipart_upload(
+        Bucket='files',
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': sorted(
+            ({'PartNumber': int(p['partNumber']), 'ETag': p['etag']} for p in parts),
+            key=lambda p: p['PartNumber']
+        )}
+    )
+    print(f"Multipart upload completed: {key}, parts={len(parts)}")
 
-    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{s3_key}"
+    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
     return {
         'statusCode': 200,
         'headers': headers,
         'body': json.dumps({'url': cdn_url, 'message': 'Video uploaded successfully'}),
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
+
+
+def abort_video_upload(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Отменяет загрузку: части в хранилище и временные чанки удаляются"""
+    body = read_json_body(event)
+    upload_id = body.get('uploadId', '')
+    key = body.get('key', '')
+    if valid_upload(key, upload_id):
+        s3 = get_s3()
+        try:
+            s3.abort_multipart_upload(Bucket='files', Key=key, UploadId=upload_id)
+        except Exception as e:
+            print(f"abort_multipart_upload failed for {key}: {e}")
+        prefix = chunk_key(key, 0).rsplit('/', 1)[0] + '/'
+        staged = s3.list_objects_v2(Bucket='files', Prefix=prefix).get('Contents', [])
+        if staged:
+            s3.delete_objects(Bucket='files', Delete={'Objects': [{'Key': o['Key']} for o in staged], 'Quiet': True})
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
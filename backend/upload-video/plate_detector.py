@@ -0,0 +1,164 @@
+'''
+Запасной детектор гос. номеров (когда Google Vision ничего не нашёл).
+Те же окна, пороги и оценка, что у прежнего перебора окон в двух циклах Python,
+но каждая конфигурация номера считается одним выражением над массивами:
+- среднее и дисперсия окна — по таблицам сумм (integral image) яркости и её квадрата;
+- контраст (max − min) — раздельными скользящими фильтрами max/min по строкам и столбцам,
+  только для позиций сетки шага;
+- подавление перекрытий (NMS) — по матрице попарных перекрытий лучших кандидатов.
+Сравнение скорости и результата с прежней реализацией: scripts/benchmark_plate_detector.py.
+'''
+
+from typing import List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+# Рабочий размер детекции — достаточно для номера и быстро
+MAX_DIM = 400
+
+# (ширина номера относительно кадра, соотношение сторон)
+PLATE_CONFIGS = (
+    (0.15, 4.0),  # небольшой номер
+    (0.18, 4.2),  # небольшой номер
+    (0.22, 4.8),  # стандарт (520x112 мм ≈ 4.6:1)
+    (0.26, 5.2),  # крупный
+    (0.30, 5.5),  # очень крупный / квадратный кадр
+)
+
+# Номер авто — нижние 65% изображения (расширено для захвата тёмных номеров)
+SEARCH_FROM_RATIO = 0.35
+GRID_STEPS = 20
+
+MIN_CONTRAST = 60
+MIN_VARIANCE = 500
+DARK_BRIGHTNESS = 40
+DARK_MIN_CONTRAST = 80
+
+TOP_CANDIDATES = 15
+NMS_OVERLAP = 0.3
+MAX_PLATES = 2  # перед + зад
+
+
+def _integral(arr: np.ndarray) -> np.ndarray:
+    """Таблица сумм с нулевой первой строкой и столбцом: сумма окна — 4 обращения"""
+    table = np.zeros((arr.shape[0] + 1, arr.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(arr, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+    return table
+
+
+def _window_sums(table: np.ndarray, ys: np.ndarray, xs: np.ndarray, h: int, w: int) -> np.ndarray:
+    y0 = ys[:, None]
+    x0 = xs[None, :]
+    return table[y0 + h, x0 + w] - table[y0, x0 + w] - table[y0 + h, x0] + table[y0, x0]
+
+
+def _window_extrema(gray: np.ndarray, ys: np.ndarray, xs: np.ndarray, h: int, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """max и min окон h×w с левым верхним углом в узлах сетки ys × xs"""
+    rows = gray[ys[0]:ys[-1] + h]
+    # По строкам: экстремумы горизонтальных отрезков длины w только в столбцах сетки
+    row_windows = sliding_window_view(rows, w, axis=1)[:, xs]
+    row_max = row_windows.max(axis=-1)
+    row_min = row_windows.min(axis=-1)
+    # По столбцам: экстремумы h подряд идущих строк только в строках сетки
+    offsets = ys - ys[0]
+    window_max = sliding_window_view(row_max, h, axis=0)[offsets].max(axis=-1)
+    window_min = sliding_window_view(row_min, h, axis=0)[offsets].min(axis=-1)
+    return window_max, window_min
+
+
+def _score_candidates(gray: np.ndarray) -> np.ndarray:
+    """Все прошедшие пороги окна всех конфигураций: строки (score, x, y, w, h)"""
+    height, width = gray.shape
+    sums = _integral(gray)
+    squares = _integral(gray.astype(np.float64) ** 2)
+
+    y_start = int(height * SEARCH_FROM_RATIO)
+    step_x = max(1, width // GRID_STEPS)
+    step_y = max(1, height // GRID_STEPS)
+
+    found = []
+    for pw_ratio, aspect in PLATE_CONFIGS:
+        pw = int(width * pw_ratio)
+        ph = max(5, int(pw / aspect))
+        if pw < 8 or ph < 4:
+            continue
+        ys = np.arange(y_start, height - ph, step_y)
+        xs = np.arange(0, width - pw, step_x)
+        if ys.size == 0 or xs.size == 0:
+            continue
+
+        area = pw * ph
+        mean = _window_sums(sums, ys, xs, ph, pw) / area
+        variance = np.maximum(_window_sums(squares, ys, xs, ph, pw) / area - mean ** 2, 0.0)
+        window_max, window_min = _window_extrema(gray, ys, xs, ph, pw)
+        contrast = (window_max - window_min).astype(np.float64)
+
+        # Принимаем и светлые (белые номера) и тёмные (затенённые) номера;
+        # главный признак — высокий контраст и дисперсия (текст на фоне)
+        passed = (
+            (contrast > MIN_CONTRAST)
+            & (variance > MIN_VARIANCE)
+            & ~((mean <= DARK_BRIGHTNESS) & (contrast <= DARK_MIN_CONTRAST))
+        )
+        if not passed.any():
+            continue
+
+        position_bonus = (ys / height * 60)[:, None]
+        score = np.minimum(mean, 200) * 0.1 + contrast * 0.6 + np.sqrt(variance) * 0.3 + position_bonus
+
+        iy, ix = np.nonzero(passed)
+        found.append(np.column_stack((
+            score[iy, ix], xs[ix], ys[iy], np.full(iy.size, pw), np.full(iy.size, ph)
+        )))
+
+    if not found:
+        return np.empty((0, 5))
+    return np.concatenate(found)
+
+
+def _suppress_overlaps(boxes: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    """
+    Жадный NMS по уже отсортированным кандидатам. Перекрытие считается
+    относительно меньшей из двух рамок, матрица строится одной операцией.
+    """
+    x, y, w, h = (boxes[:, i] for i in range(4))
+    overlap_x = np.clip(np.minimum((x + w)[:, None], (x + w)[None, :]) - np.maximum(x[:, None], x[None, :]), 0, None)
+    overlap_y = np.clip(np.minimum((y + h)[:, None], (y + h)[None, :]) - np.maximum(y[:, None], y[None, :]), 0, None)
+    area = w * h
+    min_area = np.minimum(area[:, None], area[None, :])
+    duplicate = (min_area > 0) & (overlap_x * overlap_y > NMS_OVERLAP * min_area)
+
+    keep = np.zeros(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if not (duplicate[i] & keep).any():
+            keep[i] = True
+    return [tuple(int(v) for v in box) for box in boxes[keep]]
+
+
+def detect_plate_regions(img: Image.Image) -> List[Tuple[int, int, int, int]]:
+    """
+    Вероятные зоны гос. номеров (x, y, w, h) в координатах исходного изображения,
+    не более MAX_PLATES.
+    """
+    orig_width, orig_height = img.size
+    scale = min(MAX_DIM / orig_width, MAX_DIM / orig_height, 1.0)
+    work_w = max(1, int(orig_width * scale))
+    work_h = max(1, int(orig_height * scale))
+    # Яркость до уменьшения: фильтр считает один канал вместо трёх
+    small = img.convert('L').resize((work_w, work_h), Image.BILINEAR)
+    gray = np.asarray(small, dtype=np.float32)
+
+    candidates = _score_candidates(gray)
+    if candidates.size == 0:
+        return []
+
+    # Порядок как у сортировки кортежей по убыванию: score, затем x, y, w, h
+    order = np.lexsort(tuple(-candidates[:, i] for i in range(4, -1, -1)))[:TOP_CANDIDATES]
+    selected = _suppress_overlaps(candidates[order, 1:])
+
+    if scale < 1.0:
+        inv = 1.0 / scale
+        selected = [(int(x * inv), int(y * inv), int(w * inv), int(h * inv)) for x, y, w, h in selected]
+    return selected[:MAX_PLATES]
@@ -0,0 +1,16 @@
+-- Индексы для keyset-пагинации списков по (дата, id)
+
+-- Offers: ORDER BY created_at DESC, id DESC с фильтром по статусу
+CREATE INDEX IF NOT EXISTS idx_offers_status_created_id
+ON t_p42562714_web_app_creation_1.offers (status, created_at DESC, id DESC);
+
+-- Requests: ORDER BY created_at DESC, id DESC с фильтром по статусу
+CREATE INDEX IF NOT EXISTS idx_requests_status_created_id
+ON t_p42562714_web_app_creation_1.requests (status, created_at DESC, id DESC);
+
+-- Orders: заказы покупателя и продавца по order_date DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_orders_buyer_order_date_id
+ON t_p42562714_web_app_creation_1.orders (buyer_id, order_date DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_seller_order_date_id
+ON t_p42562714_web_app_creation_1.orders (seller_id, order_date DESC, id DESC);
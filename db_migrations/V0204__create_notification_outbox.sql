@@ -0,0 +1,32 @@
+-- Очередь исходящих уведомлений: обработчики только ставят запись в очередь,
+-- отправку пачками выполняет диспетчер в push-send (action=dispatch)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    channel VARCHAR(20) NOT NULL CHECK (channel IN ('push', 'email', 'webhook')),
+    endpoint TEXT,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    url TEXT NOT NULL DEFAULT '/',
+    notification_type VARCHAR(50),
+    extra JSONB,
+    coalesce_key TEXT,
+    coalesced_count INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    claimed_at TIMESTAMPTZ,
+    sent_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Выборка готовых к отправке записей диспетчером
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+ON t_p42562714_web_app_creation_1.notification_outbox (next_attempt_at, id)
+WHERE status IN ('pending', 'sending');
+
+-- Склейка: пока уведомление не отправлено, повторное с тем же ключом обновляет его
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_outbox_coalesce
+ON t_p42562714_web_app_creation_1.notification_outbox (user_id, channel, coalesce_key)
+WHERE status = 'pending' AND coalesce_key IS NOT NULL;
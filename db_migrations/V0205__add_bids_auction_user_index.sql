@@ -0,0 +1,4 @@
+-- Список участников аукциона (DISTINCT user_id по auction_id) при размещении ставки
+-- читается из индекса без обращения к таблице
+CREATE INDEX IF NOT EXISTS idx_bids_auction_user
+    ON t_p42562714_web_app_creation_1.bids (auction_id, user_id);
@@ -0,0 +1,39 @@
+-- Сводка отзывов по пользователю: вместо AVG(rating) по reviews на каждую строку списка заказов.
+-- Поддерживается при записи отзыва (backend/reviews), средняя = rating_sum / reviews_count
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.user_rating_summary (
+    user_id INTEGER PRIMARY KEY,
+    reviews_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.user_rating_summary (user_id, reviews_count, rating_sum)
+SELECT reviewed_user_id, COUNT(rating), COALESCE(SUM(rating), 0)
+FROM t_p42562714_web_app_creation_1.reviews
+WHERE reviewed_user_id IS NOT NULL
+GROUP BY reviewed_user_id
+ON CONFLICT (user_id) DO UPDATE
+SET reviews_count = EXCLUDED.reviews_count,
+    rating_sum = EXCLUDED.rating_sum,
+    updated_at = CURRENT_TIMESTAMP;
+
+-- Непрочитанные сообщения по заказу для каждой из сторон: вместо COUNT(*) по order_messages
+-- на каждую строку. Поддерживается при отправке и прочтении сообщений (backend/orders)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.order_unread_counters (
+    order_id UUID PRIMARY KEY,
+    buyer_unread INTEGER NOT NULL DEFAULT 0,
+    seller_unread INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.order_unread_counters (order_id, buyer_unread, seller_unread)
+SELECT o.id,
+       COUNT(*) FILTER (WHERE m.is_read = false AND m.sender_id <> o.buyer_id),
+       COUNT(*) FILTER (WHERE m.is_read = false AND m.sender_id <> o.seller_id)
+FROM t_p42562714_web_app_creation_1.orders o
+JOIN t_p42562714_web_app_creation_1.order_messages m ON m.order_id = o.id
+GROUP BY o.id
+ON CONFLICT (order_id) DO UPDATE
+SET buyer_unread = EXCLUDED.buyer_unread,
+    seller_unread = EXCLUDED.seller_unread,
+    updated_at = CURRENT_TIMESTAMP;
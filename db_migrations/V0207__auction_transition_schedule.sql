@@ -0,0 +1,21 @@
+-- Срок следующей смены статуса аукциона (upcoming → active → ending-soon → ended → archived).
+-- Колонка вычисляется из статуса и дат, поэтому всегда актуальна после любых UPDATE;
+-- планировщик выбирает по частичному индексу только аукционы с наступившим сроком.
+ALTER TABLE t_p42562714_web_app_creation_1.auctions
+    ADD COLUMN IF NOT EXISTS next_transition_at TIMESTAMP GENERATED ALWAYS AS (
+        CASE
+            WHEN status = 'upcoming' THEN start_date
+            WHEN status = 'active' THEN end_date - INTERVAL '24 hours'
+            WHEN status = 'ending-soon' THEN end_date
+            WHEN status = 'ended' AND COALESCE(bid_count, 0) = 0 THEN end_date
+        END
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_auctions_next_transition
+    ON t_p42562714_web_app_creation_1.auctions (next_transition_at)
+    WHERE next_transition_at IS NOT NULL;
+
+-- Keyset-пагинация списка аукционов:
+-- ORDER BY COALESCE(is_premium, false) DESC, created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_auctions_premium_created_id
+    ON t_p42562714_web_app_creation_1.auctions ((COALESCE(is_premium, false)) DESC, created_at DESC, id DESC);
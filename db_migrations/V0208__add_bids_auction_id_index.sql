@@ -0,0 +1,4 @@
+-- История ставок аукциона: страницы и приращения по id ставки
+-- (WHERE auction_id = ? AND id > ? / id < ? ORDER BY id) читаются по индексу
+CREATE INDEX IF NOT EXISTS idx_bids_auction_bid_id
+    ON t_p42562714_web_app_creation_1.bids (auction_id, id);
@@ -0,0 +1,23 @@
+-- Журнал изменений аукционов для long-poll подписки (auctions-list action=events).
+-- Событие пишется в транзакции ставки или смены статуса после блокировки строки
+-- аукциона, поэтому в пределах одного аукциона порядок id совпадает с порядком коммитов.
+-- После коммита отправляется NOTIFY auction_events с payload '<auction_id>:<event_id>'.
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.auction_events (
+    id BIGSERIAL PRIMARY KEY,
+    auction_id INTEGER NOT NULL,
+    event_type VARCHAR(20) NOT NULL CHECK (event_type IN ('bid', 'status')),
+    current_bid DECIMAL(15, 2),
+    bid_count INTEGER,
+    status VARCHAR(20),
+    bid_id INTEGER,
+    user_id INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- События аукциона новее известного клиенту: WHERE auction_id = ? AND id > ?
+CREATE INDEX IF NOT EXISTS idx_auction_events_auction_id
+ON t_p42562714_web_app_creation_1.auction_events (auction_id, id);
+
+-- Очистка старых событий (archive-expired)
+CREATE INDEX IF NOT EXISTS idx_auction_events_created_at
+ON t_p42562714_web_app_creation_1.auction_events (created_at);
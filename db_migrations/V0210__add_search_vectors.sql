@@ -0,0 +1,62 @@
+-- Полнотекстовый поиск по запросам и предложениям.
+-- search_vector (русская морфология): заголовок с весом A, описание — B.
+-- Колонка поддерживается триггером при INSERT и при изменении title/description.
+
+ALTER TABLE t_p42562714_web_app_creation_1.requests ADD COLUMN IF NOT EXISTS search_vector tsvector;
+ALTER TABLE t_p42562714_web_app_creation_1.offers ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION t_p42562714_web_app_creation_1.update_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_requests_search_vector ON t_p42562714_web_app_creation_1.requests;
+CREATE TRIGGER trg_requests_search_vector
+    BEFORE INSERT OR UPDATE OF title, description ON t_p42562714_web_app_creation_1.requests
+    FOR EACH ROW EXECUTE FUNCTION t_p42562714_web_app_creation_1.update_search_vector();
+
+DROP TRIGGER IF EXISTS trg_offers_search_vector ON t_p42562714_web_app_creation_1.offers;
+CREATE TRIGGER trg_offers_search_vector
+    BEFORE INSERT OR UPDATE OF title, description ON t_p42562714_web_app_creation_1.offers
+    FOR EACH ROW EXECUTE FUNCTION t_p42562714_web_app_creation_1.update_search_vector();
+
+-- Заполнение существующих строк
+UPDATE t_p42562714_web_app_creation_1.requests
+SET search_vector = setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+                    setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+WHERE search_vector IS NULL;
+
+UPDATE t_p42562714_web_app_creation_1.offers
+SET search_vector = setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+                    setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_requests_search_vector
+    ON t_p42562714_web_app_creation_1.requests USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_offers_search_vector
+    ON t_p42562714_web_app_creation_1.offers USING GIN (search_vector);
+
+-- Триграммный индекс по заголовку: поиск подстроки внутри слова (артикулы, номера,
+-- части слов) через ILIKE '%...%' без последовательного сканирования.
+-- Если расширение pg_trgm недоступно, остаётся только полнотекстовый индекс.
+DO $$
+BEGIN
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN insufficient_privilege OR feature_not_supported OR undefined_file THEN
+        RAISE NOTICE 'pg_trgm недоступно: триграммные индексы не созданы';
+    END;
+
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        EXECUTE 'CREATE INDEX IF NOT EXISTS idx_requests_title_trgm
+                 ON t_p42562714_web_app_creation_1.requests USING GIN (title gin_trgm_ops)';
+        EXECUTE 'CREATE INDEX IF NOT EXISTS idx_offers_title_trgm
+                 ON t_p42562714_web_app_creation_1.offers USING GIN (title gin_trgm_ops)';
+    END IF;
+END
+$$;
@@ -0,0 +1,30 @@
+-- Сводка откликов по запросу: вместо коррелированных подзапросов к orders
+-- на каждую строку списка запросов и в авто-закрытии.
+-- Пересчитывается по orders.offer_id (индекс) при создании, изменении и удалении
+-- откликов (backend/orders)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.request_stats (
+    request_id UUID PRIMARY KEY,
+    responses_count INTEGER NOT NULL DEFAULT 0,      -- отклики, кроме отменённых
+    accepted_quantity NUMERIC NOT NULL DEFAULT 0,    -- сумма quantity принятых откликов
+    has_accepted BOOLEAN NOT NULL DEFAULT FALSE,     -- есть хотя бы один принятый отклик
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.request_stats (request_id, responses_count, accepted_quantity, has_accepted)
+SELECT r.id,
+       COUNT(o.id) FILTER (WHERE o.status <> 'cancelled'),
+       COALESCE(SUM(o.quantity) FILTER (WHERE o.status = 'accepted'), 0),
+       COALESCE(BOOL_OR(o.status = 'accepted'), FALSE)
+FROM t_p42562714_web_app_creation_1.requests r
+JOIN t_p42562714_web_app_creation_1.orders o ON o.offer_id = r.id
+GROUP BY r.id
+ON CONFLICT (request_id) DO UPDATE
+SET responses_count = EXCLUDED.responses_count,
+    accepted_quantity = EXCLUDED.accepted_quantity,
+    has_accepted = EXCLUDED.has_accepted,
+    updated_at = CURRENT_TIMESTAMP;
+
+-- Авто-закрытие: активные запросы, по которым принят хотя бы один отклик
+CREATE INDEX IF NOT EXISTS idx_request_stats_has_accepted
+ON t_p42562714_web_app_creation_1.request_stats (request_id)
+WHERE has_accepted;
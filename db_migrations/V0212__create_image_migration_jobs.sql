@@ -0,0 +1,20 @@
+-- Состояние фоновых заданий миграции изображений предложений (backend/offers/image_migration.py).
+-- Курсор last_id коммитится вместе с обновлёнными url каждой пачки, поэтому
+-- прерванный запуск продолжается со следующей пачки, а не с начала таблицы.
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.image_migration_jobs (
+    job VARCHAR(32) PRIMARY KEY,                 -- 'to-s3' (base64 → S3), 'remigrate' (перекодирование CDN)
+    last_id UUID,                                -- последний обработанный offer_images.id текущего прохода
+    processed BIGINT NOT NULL DEFAULT 0,         -- обработано строк за проход
+    migrated BIGINT NOT NULL DEFAULT 0,          -- успешно перекодировано и загружено
+    failed BIGINT NOT NULL DEFAULT 0,
+    work_ms BIGINT NOT NULL DEFAULT 0,           -- суммарное время обработки пачек за проход
+    last_error TEXT,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    finished_at TIMESTAMP,                       -- проход дошёл до конца таблицы
+    locked_until TIMESTAMP                       -- аренда: задание выполняет один вызов одновременно
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.image_migration_jobs (job)
+VALUES ('to-s3'), ('remigrate')
+ON CONFLICT (job) DO NOTHING;
@@ -0,0 +1,6 @@
+-- Варианты изображения 200/400/800 px в WebP и JPEG (backend/offers/image_variants.py):
+-- {"w200": {"width": 200, "height": 150, "webp": "<url>", "jpeg": "<url>"}, "w400": ..., "w800": ...}
+-- NULL — изображение загружено до появления вариантов; списки отдают исходный url,
+-- варианты заполняет задание remigrate (offers ?action=remigrate-all)
+ALTER TABLE t_p42562714_web_app_creation_1.offer_images
+ADD COLUMN IF NOT EXISTS variants JSONB;
@@ -0,0 +1,15 @@
+-- Асинхронная обработка загруженных изображений (backend/offers/image_migration.py).
+-- Создание предложения/запроса только сохраняет ссылку на исходник в S3
+-- (загружен браузером напрямую по подписанной ссылке get-upload-url) и ставит
+-- строку в очередь; варианты 200/400/800 строит offers ?action=process-images.
+ALTER TABLE t_p42562714_web_app_creation_1.offer_images
+ADD COLUMN IF NOT EXISTS processing_status VARCHAR(16),          -- NULL — обработано; 'pending', 'processing', 'failed'
+ADD COLUMN IF NOT EXISTS source_key TEXT,                        -- ключ S3 исходника (offer-uploads/..., request-uploads/...)
+ADD COLUMN IF NOT EXISTS processing_attempts INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS processing_claimed_at TIMESTAMP,
+ADD COLUMN IF NOT EXISTS processing_error TEXT;
+
+-- Очередь обработки: только необработанные строки (включая 'failed' для счётчиков статуса)
+CREATE INDEX IF NOT EXISTS idx_offer_images_processing
+ON t_p42562714_web_app_creation_1.offer_images (created_at)
+WHERE processing_status IS NOT NULL;
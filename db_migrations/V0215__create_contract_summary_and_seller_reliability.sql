@@ -0,0 +1,65 @@
+-- Сводка откликов по контракту для списка контрактов: вместо JOIN contract_responses
+-- с GROUP BY и коррелированных подзапросов на каждую строку.
+-- Пересчитывается при создании откликов и смене их статуса
+-- (backend/contracts-list, backend/contract-chat)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.contract_summary (
+    contract_id INTEGER PRIMARY KEY,
+    responses_count INTEGER NOT NULL DEFAULT 0,                -- отклики, кроме cancelled / rejected
+    has_cancelled_responses BOOLEAN NOT NULL DEFAULT FALSE,    -- есть отклик cancelled / rejected
+    recent_respondents JSONB NOT NULL DEFAULT '[]'::jsonb,     -- последние 5 активных откликов: id, userId, status, createdAt
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.contract_summary (contract_id, responses_count, has_cancelled_responses, recent_respondents)
+SELECT c.id,
+       (SELECT COUNT(*) FROM t_p42562714_web_app_creation_1.contract_responses cr
+        WHERE cr.contract_id = c.id AND cr.status NOT IN ('cancelled', 'rejected')),
+       EXISTS(SELECT 1 FROM t_p42562714_web_app_creation_1.contract_responses cr
+              WHERE cr.contract_id = c.id AND cr.status IN ('cancelled', 'rejected')),
+       COALESCE((
+           SELECT jsonb_agg(jsonb_build_object('id', r.id, 'userId', r.user_id, 'status', r.status, 'createdAt', r.created_at)
+                            ORDER BY r.created_at DESC)
+           FROM (
+               SELECT cr.id, cr.user_id, cr.status, cr.created_at
+               FROM t_p42562714_web_app_creation_1.contract_responses cr
+               WHERE cr.contract_id = c.id AND cr.status NOT IN ('cancelled', 'rejected')
+               ORDER BY cr.created_at DESC
+               LIMIT 5
+           ) r
+       ), '[]'::jsonb)
+FROM t_p42562714_web_app_creation_1.contracts c
+WHERE EXISTS(SELECT 1 FROM t_p42562714_web_app_creation_1.contract_responses cr WHERE cr.contract_id = c.id)
+ON CONFLICT (contract_id) DO UPDATE
+SET responses_count = EXCLUDED.responses_count,
+    has_cancelled_responses = EXCLUDED.has_cancelled_responses,
+    recent_respondents = EXCLUDED.recent_respondents,
+    updated_at = CURRENT_TIMESTAMP;
+
+-- Надёжность продавца: завершённые и отменённые контракты вместо подсчёта по всем
+-- контрактам продавца на каждую строку списка. Надёжность = completed / (completed + cancelled).
+-- Пересчитывается при смене статуса и удалении контрактов
+-- (backend/contracts-list, backend/contract-chat, backend/save-contract)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.seller_reliability (
+    seller_id INTEGER PRIMARY KEY,
+    completed_count INTEGER NOT NULL DEFAULT 0,
+    cancelled_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.seller_reliability (seller_id, completed_count, cancelled_count)
+SELECT seller_id,
+       COUNT(*) FILTER (WHERE status = 'completed'),
+       COUNT(*) FILTER (WHERE status = 'cancelled')
+FROM t_p42562714_web_app_creation_1.contracts
+WHERE seller_id IS NOT NULL
+GROUP BY seller_id
+ON CONFLICT (seller_id) DO UPDATE
+SET completed_count = EXCLUDED.completed_count,
+    cancelled_count = EXCLUDED.cancelled_count,
+    updated_at = CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_contract_responses_contract_created
+ON t_p42562714_web_app_creation_1.contract_responses (contract_id, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_contracts_seller_status
+ON t_p42562714_web_app_creation_1.contracts (seller_id, status);
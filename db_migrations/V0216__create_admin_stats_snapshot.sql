@@ -0,0 +1,28 @@
+-- Снимок статистики админ-панели: вместо десяти COUNT(*) / GROUP BY по users,
+-- user_verifications, offers, requests, auctions и orders при каждом открытии панели.
+-- Одна строка (id = 1); обновляется archive-expired по расписанию и admin-stats,
+-- если снимок старше допустимого (backend/admin-stats/stats_snapshot.py)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.admin_stats_snapshot (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    stats JSONB NOT NULL DEFAULT '{}'::jsonb,
+    refreshed_at TIMESTAMP,                 -- момент подсчёта; NULL — ещё не считался
+    refresh_ms INTEGER,                     -- длительность последнего подсчёта
+    refreshing_until TIMESTAMP              -- аренда: пока не истекла, пересчёт уже идёт
+);
+
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_snapshot (id) VALUES (1)
+ON CONFLICT (id) DO NOTHING;
+
+-- Почасовая история счётчиков для графиков динамики: одна точка на час,
+-- повторный пересчёт в том же часе перезаписывает её
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.admin_stats_history (
+    captured_at TIMESTAMP PRIMARY KEY,      -- начало часа
+    total_users INTEGER NOT NULL DEFAULT 0,
+    active_users INTEGER NOT NULL DEFAULT 0,
+    verified_users INTEGER NOT NULL DEFAULT 0,
+    active_offers INTEGER NOT NULL DEFAULT 0,
+    active_requests INTEGER NOT NULL DEFAULT 0,
+    active_auctions INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0,
+    pending_verifications INTEGER NOT NULL DEFAULT 0
+);
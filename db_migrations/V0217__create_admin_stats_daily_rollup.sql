@@ -0,0 +1,102 @@
+-- Дневные агрегаты для графиков админ-панели (admin-stats ?action=series):
+-- вместо повторных агрегатов по исходным таблицам за каждый диапазон.
+-- Дополняются инкрементально по водяным знакам created_at / updated_at / reviewed_at
+-- (backend/admin-stats/stats_rollup.py, запускает archive-expired)
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.admin_stats_daily (
+    day DATE PRIMARY KEY,
+    new_users INTEGER NOT NULL DEFAULT 0,
+    new_offers INTEGER NOT NULL DEFAULT 0,
+    new_requests INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0,
+    completed_gmv NUMERIC NOT NULL DEFAULT 0,              -- сумма total_amount завершённых заказов
+    verifications_approved INTEGER NOT NULL DEFAULT 0,
+    verifications_rejected INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Завершённые заказы и оборот по категориям за день
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.admin_stats_daily_categories (
+    day DATE NOT NULL,
+    category TEXT NOT NULL,
+    completed_orders INTEGER NOT NULL DEFAULT 0,
+    completed_gmv NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, category)
+);
+
+-- Водяной знак по каждому источнику: строки с меткой времени до него уже учтены
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.admin_stats_rollup_state (
+    source VARCHAR(32) PRIMARY KEY,
+    watermark TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индексы для поиска изменённых строк и пересчёта дня
+-- (users, offers, requests по created_at уже проиндексированы)
+CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON t_p42562714_web_app_creation_1.orders (updated_at);
+CREATE INDEX IF NOT EXISTS idx_orders_completed_day
+ON t_p42562714_web_app_creation_1.orders ((COALESCE(completed_date, updated_at)))
+WHERE status = 'completed';
+CREATE INDEX IF NOT EXISTS idx_user_verifications_reviewed_at ON t_p42562714_web_app_creation_1.user_verifications (reviewed_at);
+
+-- Начальное заполнение по всей истории
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_daily (day, new_users)
+SELECT created_at::date, COUNT(*)
+FROM t_p42562714_web_app_creation_1.users
+WHERE created_at IS NOT NULL
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE SET new_users = EXCLUDED.new_users;
+
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_daily (day, new_offers)
+SELECT created_at::date, COUNT(*)
+FROM t_p42562714_web_app_creation_1.offers
+WHERE created_at IS NOT NULL
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE SET new_offers = EXCLUDED.new_offers;
+
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_daily (day, new_requests)
+SELECT created_at::date, COUNT(*)
+FROM t_p42562714_web_app_creation_1.requests
+WHERE created_at IS NOT NULL
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE SET new_requests = EXCLUDED.new_requests;
+
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_daily (day, completed_orders, completed_gmv)
+SELECT COALESCE(completed_date, updated_at)::date, COUNT(*), COALESCE(SUM(total_amount), 0)
+FROM t_p42562714_web_app_creation_1.orders
+WHERE status = 'completed' AND COALESCE(completed_date, updated_at) IS NOT NULL
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE
+SET completed_orders = EXCLUDED.completed_orders,
+    completed_gmv = EXCLUDED.completed_gmv;
+
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_daily (day, verifications_approved, verifications_rejected)
+SELECT reviewed_at::date,
+       COUNT(*) FILTER (WHERE status = 'approved'),
+       COUNT(*) FILTER (WHERE status = 'rejected')
+FROM t_p42562714_web_app_creation_1.user_verifications
+WHERE status IN ('approved', 'rejected') AND reviewed_at IS NOT NULL
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE
+SET verifications_approved = EXCLUDED.verifications_approved,
+    verifications_rejected = EXCLUDED.verifications_rejected;
+
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_daily_categories (day, category, completed_orders, completed_gmv)
+SELECT COALESCE(completed_date, updated_at)::date,
+       COALESCE(NULLIF(offer_category, ''), 'Другое'),
+       COUNT(*),
+       COALESCE(SUM(total_amount), 0)
+FROM t_p42562714_web_app_creation_1.orders
+WHERE status = 'completed' AND COALESCE(completed_date, updated_at) IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (day, category) DO UPDATE
+SET completed_orders = EXCLUDED.completed_orders,
+    completed_gmv = EXCLUDED.completed_gmv;
+
+-- Водяные знаки — с запасом назад: строки последних минут пересчитает первый запуск
+INSERT INTO t_p42562714_web_app_creation_1.admin_stats_rollup_state (source, watermark)
+VALUES ('users', NOW() - INTERVAL '10 minutes'),
+       ('offers', NOW() - INTERVAL '10 minutes'),
+       ('requests', NOW() - INTERVAL '10 minutes'),
+       ('orders', NOW() - INTERVAL '10 minutes'),
+       ('verifications', NOW() - INTERVAL '10 minutes')
+ON CONFLICT (source) DO NOTHING;
@@ -0,0 +1,62 @@
+-- Дневные агрегаты заказов (admin_stats_daily) привязываются к completed_date,
+-- а дни, из которых заказ ушёл (удаление, архивирование, смена статуса или суммы),
+-- отмечает триггер: по водяному знаку updated_at их не найти — удалённой строки нет,
+-- а у архивированной статус уже не 'completed' (backend/admin-stats/stats_rollup.py)
+
+-- Стабильный день завершения: у завершённых заказов completed_date всегда заполнен
+UPDATE t_p42562714_web_app_creation_1.orders
+SET completed_date = updated_at
+WHERE status = 'completed' AND completed_date IS NULL;
+
+DROP INDEX IF EXISTS t_p42562714_web_app_creation_1.idx_orders_completed_day;
+CREATE INDEX IF NOT EXISTS idx_orders_completed_date
+ON t_p42562714_web_app_creation_1.orders (completed_date)
+WHERE status = 'completed';
+
+-- Дни, которые нужно пересчитать при следующем запуске свёртки
+CREATE TABLE IF NOT EXISTS t_p42562714_web_app_creation_1.admin_stats_dirty_days (
+    source VARCHAR(32) NOT NULL,
+    day DATE NOT NULL,
+    marked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, day)
+);
+
+CREATE OR REPLACE FUNCTION t_p42562714_web_app_creation_1.mark_order_stats_days() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'DELETE' AND NEW.status = 'completed' AND NEW.completed_date IS NULL THEN
+        NEW.completed_date := CURRENT_TIMESTAMP;
+    END IF;
+
+    IF TG_OP = 'UPDATE'
+       AND OLD.status IS NOT DISTINCT FROM NEW.status
+       AND OLD.completed_date IS NOT DISTINCT FROM NEW.completed_date
+       AND OLD.total_amount IS NOT DISTINCT FROM NEW.total_amount
+       AND OLD.offer_category IS NOT DISTINCT FROM NEW.offer_category THEN
+        RETURN NEW;
+    END IF;
+
+    -- DO UPDATE, а не DO NOTHING: блокировка строки дня заставляет свёртку,
+    -- забирающую этот день, дождаться commit изменения заказа
+    IF TG_OP <> 'INSERT' AND OLD.status = 'completed' AND OLD.completed_date IS NOT NULL THEN
+        INSERT INTO t_p42562714_web_app_creation_1.admin_stats_dirty_days (source, day)
+        VALUES ('orders', OLD.completed_date::date)
+        ON CONFLICT (source, day) DO UPDATE SET marked_at = CURRENT_TIMESTAMP;
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.status = 'completed' THEN
+        INSERT INTO t_p42562714_web_app_creation_1.admin_stats_dirty_days (source, day)
+        VALUES ('orders', NEW.completed_date::date)
+        ON CONFLICT (source, day) DO UPDATE SET marked_at = CURRENT_TIMESTAMP;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_stats_days ON t_p42562714_web_app_creation_1.orders;
+CREATE TRIGGER trg_orders_stats_days
+    BEFORE INSERT OR DELETE OR UPDATE OF status, completed_date, total_amount, offer_category
+    ON t_p42562714_web_app_creation_1.orders
+    FOR EACH ROW EXECUTE FUNCTION t_p42562714_web_app_creation_1.mark_order_stats_days();
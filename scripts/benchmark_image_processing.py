@@ -0,0 +1,145 @@
+'''
+Бенчмарк обработки фото: прежний путь (полное декодирование, exif_transpose,
+LANCZOS до 800 px, JPEG) против image_processing (draft-декодирование JPEG,
+поворот и заливка альфы за один проход) — для одного JPEG 800 px и для
+полного набора вариантов 200/400/800 (WebP + JPEG).
+
+Каждый режим выполняется в отдельном процессе, чтобы пиковый RSS
+(ru_maxrss) относился только к нему.
+
+Фото — из каталога (снимки с телефона), иначе генерируются синтетические
+JPEG 4032×3024 (12 Мп) с EXIF Orientation=6, как у портретных фото с камеры.
+
+Запуск:
+    python scripts/benchmark_image_processing.py [--photos DIR] [--count 10] [--repeat 3]
+'''
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+from io import BytesIO
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'offers'))
+
+from PIL import Image, ImageOps  # noqa: E402
+
+from image_processing import encode, load_image, resize_within  # noqa: E402
+from image_variants import render_variants  # noqa: E402
+
+
+def legacy_optimize(image_data: bytes) -> bytes:
+    """Прежний optimize_image из offers/index.py"""
+    img = Image.open(BytesIO(image_data))
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        img = background
+    if img.width > 800:
+        img = img.resize((800, int(img.height * 800 / img.width)), Image.Resampling.LANCZOS)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=85, optimize=True)
+    return output.getvalue()
+
+
+def shared_optimize(image_data: bytes) -> bytes:
+    return encode(resize_within(load_image(image_data, max_width=800), max_width=800), 'JPEG', 85)
+
+
+def legacy_variants(image_data: bytes) -> List[bytes]:
+    """Те же варианты, если каждый строить прежним способом из исходника"""
+    outputs = []
+    for width in (800, 400, 200):
+        img = ImageOps.exif_transpose(Image.open(BytesIO(image_data))).convert('RGB')
+        img = img.resize((width, int(img.height * width / img.width)), Image.Resampling.LANCZOS)
+        for fmt in ('JPEG', 'WEBP'):
+            output = BytesIO()
+            img.save(output, format=fmt, quality=85)
+            outputs.append(output.getvalue())
+    return outputs
+
+
+MODES: Dict[str, Callable[[bytes], object]] = {
+    'legacy 800 jpeg': legacy_optimize,
+    'shared 800 jpeg': shared_optimize,
+    'legacy variants': legacy_variants,
+    'shared variants': render_variants,
+}
+
+
+def synthetic_photos(count: int) -> List[bytes]:
+    """Шум поверх градиента — JPEG такого же размера, как у реальных снимков 12 Мп"""
+    photos = []
+    for index in range(count):
+        base = Image.linear_gradient('L').resize((4032, 3024)).convert('RGB')
+        noise = Image.effect_noise((4032, 3024), 40 + index).convert('RGB')
+        img = Image.blend(base, noise, 0.5)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=92, exif=exif)
+        photos.append(output.getvalue())
+    return photos
+
+
+def load_photos(directory: str, count: int) -> List[bytes]:
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.heic'))
+    )[:count]
+    photos = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            photos.append(f.read())
+    return photos
+
+
+def run_mode(mode: str, photos: List[bytes], repeat: int, queue) -> None:
+    func = MODES[mode]
+    func(photos[0])  # прогрев: загрузка плагинов Pillow
+    timings = []
+    for _ in range(repeat):
+        for photo in photos:
+            started = time.perf_counter()
+            func(photo)
+            timings.append((time.perf_counter() - started) * 1000)
+    # ru_maxrss в Linux — в килобайтах
+    queue.put((timings, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--photos', help='каталог с фото (по умолчанию — синтетические 12 Мп)')
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    photos = load_photos(args.photos, args.count) if args.photos else synthetic_photos(args.count)
+    if not photos:
+        sys.exit('Нет фото для замера')
+    sizes = [Image.open(BytesIO(photo)).size for photo in photos]
+    print(f'{len(photos)} фото, {statistics.mean(w * h for w, h in sizes) / 1e6:.1f} Мп в среднем, '
+          f'{statistics.mean(len(photo) for photo in photos) / 1024 / 1024:.1f} МБ в среднем\n')
+
+    context = multiprocessing.get_context('fork')
+    print(f'{"режим":<18}{"медиана, мс":>13}{"p95, мс":>10}{"пик RSS, МБ":>14}')
+    for mode in MODES:
+        queue = context.Queue()
+        process = context.Process(target=run_mode, args=(mode, photos, args.repeat, queue))
+        process.start()
+        timings, peak_rss = queue.get()
+        process.join()
+        timings.sort()
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        print(f'{mode:<18}{statistics.median(timings):>13.1f}{p95:>10.1f}{peak_rss:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+'''
+Бенчмарк поиска по спискам: прежний ILIKE '%...%' по title/description
+против полнотекстового поиска (search_vector + GIN, подстрока заголовка по триграммам).
+
+Данные — временная таблица той же структуры на N строк (по умолчанию 100 000)
+со случайными заголовками и описаниями из русских слов; рабочие таблицы не затрагиваются.
+
+Запуск:
+    DATABASE_URL=postgres://... python scripts/benchmark_search.py [--rows 100000] [--repeat 20]
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'requests'))
+from search import search_filter, search_rank  # noqa: E402
+
+WORDS = [
+    'картофель', 'молодой', 'морковь', 'капуста', 'свёкла', 'лук', 'чеснок', 'огурцы', 'томаты',
+    'говядина', 'свинина', 'конина', 'оленина', 'рыба', 'омуль', 'карась', 'щука', 'молоко',
+    'сметана', 'творог', 'масло', 'яйца', 'мёд', 'ягоды', 'брусника', 'голубика', 'смородина',
+    'доставка', 'самовывоз', 'оптом', 'розница', 'свежий', 'замороженный', 'домашний', 'фермерский',
+    'грузоперевозка', 'газель', 'камаз', 'якутск', 'покровск', 'мирный', 'нерюнгри', 'алдан',
+    'дрова', 'уголь', 'сено', 'комбикорм', 'запчасти', 'шины', 'ремонт', 'услуги', 'бригада',
+]
+
+QUERIES = ['картофель', 'молодой картофель', 'рыба омуль', 'доставка якутск', 'брусн', 'камаз', 'сено оптом', 'xyzнет']
+
+
+def setup(cur, rows: int) -> None:
+    cur.execute("CREATE TEMP TABLE bench_items (id SERIAL PRIMARY KEY, title TEXT, description TEXT, created_at TIMESTAMP, search_vector tsvector)")
+    cur.execute("""
+        INSERT INTO bench_items (title, description, created_at)
+        SELECT
+            (SELECT string_agg(w, ' ') FROM (SELECT %(words)s[1 + floor(random() * %(n)s)::int] AS w
+                                             FROM generate_series(1, 3 + (g %% 3))) t),
+            (SELECT string_agg(w, ' ') FROM (SELECT %(words)s[1 + floor(random() * %(n)s)::int] AS w
+                                             FROM generate_series(1, 25 + (g %% 20))) t),
+            NOW() - make_interval(secs => g * 37)
+        FROM generate_series(1, %(rows)s) g
+    """, {'words': WORDS, 'n': len(WORDS), 'rows': rows})
+
+    started = time.perf_counter()
+    cur.execute("""
+        UPDATE bench_items
+        SET search_vector = setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+                            setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+    """)
+    print(f'tsvector для {rows} строк: {(time.perf_counter() - started) * 1000:.0f} мс')
+
+    cur.execute("CREATE INDEX ON bench_items USING GIN (search_vector)")
+    cur.execute("CREATE INDEX ON bench_items (created_at DESC, id DESC)")
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+    if cur.fetchone()[0]:
+        cur.execute("CREATE INDEX ON bench_items USING GIN (title gin_trgm_ops)")
+    else:
+        print('pg_trgm не установлено: подстрока заголовка проверяется без индекса')
+    cur.execute("ANALYZE bench_items")
+
+
+def measure(cur, sql: str, params: list, repeat: int):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        rows = len(cur.fetchall())
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], rows
+
+
+def plan_root(cur, sql: str, params: list) -> str:
+    cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cur.fetchone()[0][0]['Plan']
+    nodes = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        nodes.append(node['Node Type'])
+        stack.extend(node.get('Plans', []))
+    return ', '.join(dict.fromkeys(nodes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    setup(cur, args.rows)
+
+    print(f'\n{"запрос":<22}{"путь":<8}{"медиана, мс":>13}{"p95, мс":>10}{"строк":>7}  план')
+    for text in QUERIES:
+        like = f'%{text}%'
+        ilike_sql = f"""
+            SELECT id FROM bench_items r
+            WHERE r.title ILIKE %s OR r.description ILIKE %s
+            ORDER BY r.created_at DESC, r.id DESC LIMIT {args.limit}
+        """
+        ilike_params = [like, like]
+
+        condition, condition_params = search_filter('r', text)
+        rank_sql, rank_params = search_rank('r', text)
+        fts_sql = f"""
+            SELECT id, {rank_sql} AS search_rank FROM bench_items r
+            WHERE {condition}
+            ORDER BY search_rank DESC, r.created_at DESC, r.id DESC LIMIT {args.limit}
+        """
+        fts_params = rank_params + condition_params
+
+        for label, sql, params in (('ILIKE', ilike_sql, ilike_params), ('FTS', fts_sql, fts_params)):
+            median, p95, rows = measure(cur, sql, params, args.repeat)
+            print(f'{text:<22}{label:<8}{median:>13.2f}{p95:>10.2f}{rows:>7}  {plan_root(cur, sql, params)}')
+
+    conn.rollback()
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
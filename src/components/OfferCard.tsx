@@ -179,13 +179,18 @@ export default function OfferCard({ offer, onDelete, unreadMessages, existingOrd
         <div className="relative aspect-[16/9] bg-muted overflow-hidden">
           {offer.images.length > 0 ? (
             <>
-              <img
-                src={offer.images[currentImageIndex].url}
-                alt={offer.images[currentImageIndex].alt}
-                className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
-                loading="lazy"
-                decoding="async"
-              />
+              <picture>
+                {offer.images[currentImageIndex].thumbnailUrl && (
+                  <source srcSet={offer.images[currentImageIndex].thumbnailUrl} type="image/webp" />
+                )}
+                <img
+                  src={offer.images[currentImageIndex].thumbnailJpegUrl || offer.images[currentImageIndex].url}
+                  alt={offer.images[currentImageIndex].alt}
+                  className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
+                  loading="lazy"
+                  decoding="async"
+                />
+              </picture>
               {offer.images.length > 1 && (
                 <>
                   <button
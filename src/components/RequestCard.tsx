@@ -103,11 +103,16 @@ export default function RequestCard({ request, onDelete, unreadMessages }: Reque
         <CardHeader className="p-0">
           <div className="relative aspect-[16/9] bg-muted overflow-hidden">
             {request.images && request.images.length > 0 ? (
-              <img
-                src={request.images[0].url}
-                alt={request.images[0].alt || request.title}
-                className="w-full h-full object-cover"
-              />
+              <picture>
+                {request.images[0].thumbnailUrl && (
+                  <source srcSet={request.images[0].thumbnailUrl} type="image/webp" />
+                )}
+                <img
+                  src={request.images[0].thumbnailJpegUrl || request.images[0].url}
+                  alt={request.images[0].alt || request.title}
+                  className="w-full h-full object-cover"
+                />
+              </picture>
             ) : (
               <div className="w-full h-full flex items-center justify-center bg-gradient-to-br from-primary/10 to-primary/5">
                 {isTransport ? (
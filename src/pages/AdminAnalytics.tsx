@@ -73,6 +73,7 @@ interface PlatformStats {
   pendingVerifications: number;
   topSellers: TopSeller[];
   topCategories: TopCategory[];
+  refreshedAt?: string | null;
 }
 
 interface VisitStats {
@@ -141,6 +142,11 @@ export default function AdminAnalytics({ isAuthenticated, onLogout }: AdminAnaly
             </Button>
             <h1 className="text-3xl font-bold">Аналитика площадки</h1>
             <p className="text-muted-foreground">Реальные данные о работе платформы</p>
+            {platformStats?.refreshedAt && (
+              <p className="text-xs text-muted-foreground mt-1">
+                Данные на {new Date(platformStats.refreshedAt).toLocaleString('ru-RU')}
+              </p>
+            )}
           </div>
 
           {loading ? (
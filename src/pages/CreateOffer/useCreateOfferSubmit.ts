@@ -151,10 +151,17 @@ export function useCreateOfferSubmit(editOffer?: Offer, isEditMode: boolean = fa
           for (let attempt = 0; attempt <= MAX_RETRIES; attempt++) {
             try {
               console.log(`Uploading image ${i + 1}/${imagePreviews.length} (attempt ${attempt + 1})...`);
-              const uploadResult = await offersAPI.uploadMedia(img, isAutoSalePhoto);
+              // Фото авто идут через upload-video (скрытие гос. номера),
+              // остальные — напрямую в S3, обработка на сервере после сохранения
+              const url = isAutoSalePhoto
+                ? (await offersAPI.uploadMedia(img, true)).url
+                : await offersAPI.uploadImageDirect(img).catch(async (directError) => {
+                    console.warn('Direct upload failed, falling back to upload-video:', directError);
+                    return (await offersAPI.uploadMedia(img, false)).url;
+                  });
               setImageUploadCurrent(prev => prev + 1);
-              console.log(`Image ${i + 1} uploaded:`, uploadResult.url);
-              results.push({ i, url: uploadResult.url });
+              console.log(`Image ${i + 1} uploaded:`, url);
+              results.push({ i, url });
               uploaded = true;
               break;
             } catch (error) {
@@ -52,8 +52,8 @@ export default function MigrateImages({ isAuthenticated, onLogout }: MigrateImag
       
       await loadStatus();
       
-      // Если есть еще base64 изображения, продолжаем миграцию
-      if (status && status.base64 > 0) {
+      // Проход не закончен (или его выполняет другой вызов) — продолжаем с курсора
+      if (data.running || data.locked) {
         setTimeout(handleMigrate, 1000);
       } else {
         setIsMigrating(false);
@@ -444,6 +444,38 @@ export const offersAPI = {
     return response.json();
   },
 
+  // Прямая загрузка фото в S3 по подписанной ссылке: обработка (варианты размеров)
+  // выполняется на сервере асинхронно после создания предложения или запроса
+  async uploadImageDirect(dataUrl: string, folder: 'offer-uploads' | 'request-uploads' = 'offer-uploads'): Promise<string> {
+    const blob = await (await fetch(dataUrl)).blob();
+    const contentType = blob.type || 'image/jpeg';
+
+    const presignResponse = await fetch(`${GET_UPLOAD_URL_API}?action=presign`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ contentType, folder, size: blob.size }),
+    });
+    if (!presignResponse.ok) {
+      let errorMessage = 'Failed to get upload URL';
+      try {
+        const error = await presignResponse.json();
+        errorMessage = error.error || errorMessage;
+      } catch { /* ignore */ }
+      throw new Error(errorMessage);
+    }
+    const { uploadUrl, fileUrl } = await presignResponse.json();
+
+    const putResponse = await fetch(uploadUrl, {
+      method: 'PUT',
+      headers: { 'Content-Type': contentType },
+      body: blob,
+    });
+    if (!putResponse.ok) {
+      throw new Error(`Failed to upload image: ${putResponse.status}`);
+    }
+    return fileUrl;
+  },
+
   // Алиас для обратной совместимости
   async uploadVideo(videoBase64: string): Promise<{ url: string; message: string }> {
     return this.uploadMedia(videoBase64);
@@ -1107,8 +1139,13 @@ export const ordersAPI = {
 
 export interface AuctionsListResponse {
   auctions: Auction[];
+  hasMore?: boolean;
+  nextCursor?: string | null;
 }
 
+// Размер страницы при постраничной загрузке списка аукционов (максимум auctions-list)
+const AUCTIONS_PAGE_LIMIT = 100;
+
 export const auctionsAPI = {
   async getAllAuctions(status?: string): Promise<Auction[]> {
     let timezoneOffset = 9;
@@ -1123,18 +1160,28 @@ export const auctionsAPI = {
       timezoneOffset = 9;
     }
     
-    const params = new URLSearchParams();
-    if (status) params.append('status', status);
-    params.append('timezoneOffset', timezoneOffset.toString());
-    
-    const response = await fetchWithRetry(`${AUCTIONS_LIST_API}?${params.toString()}`);
-    
-    if (!response.ok) {
-      throw new Error('Failed to fetch auctions');
-    }
-    
-    const data = await response.json();
-    return (data.auctions || []).map((a: any) => {
+    // Список забирается постранично по курсору, пока сервер сообщает hasMore
+    const rawAuctions: any[] = [];
+    let cursor = '';
+    do {
+      const params = new URLSearchParams();
+      if (status) params.append('status', status);
+      params.append('timezoneOffset', timezoneOffset.toString());
+      params.append('limit', AUCTIONS_PAGE_LIMIT.toString());
+      params.append('cursor', cursor);
+
+      const response = await fetchWithRetry(`${AUCTIONS_LIST_API}?${params.toString()}`);
+
+      if (!response.ok) {
+        throw new Error('Failed to fetch auctions');
+      }
+
+      const data: AuctionsListResponse = await response.json();
+      rawAuctions.push(...(data.auctions || []));
+      cursor = data.hasMore && data.nextCursor ? data.nextCursor : '';
+    } while (cursor);
+
+    return rawAuctions.map((a: any) => {
       const safeDate = (dateStr: string | null | undefined): Date | undefined => {
         if (!dateStr) return undefined;
         try {
@@ -1,7 +1,19 @@
+export interface OfferImageVariant {
+  width: number;
+  height: number;
+  webp: string;
+  jpeg: string;
+}
+
 export interface OfferImage {
   id: string;
   url: string;
   alt: string;
+  // Превью для карточек списков (WebP 400px), если у изображения есть варианты
+  thumbnailUrl?: string;
+  // То же превью в JPEG — для браузеров без WebP
+  thumbnailJpegUrl?: string;
+  variants?: Record<string, OfferImageVariant> | null;
 }
 
 export interface OfferVideo {
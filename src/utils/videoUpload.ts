@@ -1,6 +1,11 @@
 const UPLOAD_VIDEO_URL = 'https://functions.poehali.dev/9999daf2-27bb-4ac4-a09e-001928741e24';
 
-const CHUNK_SIZE = 1 * 1024 * 1024; // 1 MB на чанк
+const CHUNK_SIZE = 1 * 1024 * 1024; // 1 MB на чанк (лимит тела запроса функции)
+
+interface UploadedPart {
+  partNumber: number;
+  etag: string;
+}
 
 function toBase64(buffer: ArrayBuffer): string {
   const bytes = new Uint8Array(buffer);
@@ -13,118 +18,84 @@ function toBase64(buffer: ArrayBuffer): string {
   return btoa(binary);
 }
 
-export async function uploadFileChunked(
+async function postJson(url: string, body: unknown, errorMessage: string) {
+  const resp = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  if (!resp.ok) {
+    let msg = errorMessage;
+    try { const e = await resp.json(); msg = e.error || msg; } catch { /* ignore */ }
+    throw new Error(msg);
+  }
+  return resp.json();
+}
+
+/**
+ * Загрузка файла чанками через S3 multipart (upload-video):
+ * init → chunk × N (сервер собирает чанки в части S3) → complete.
+ * Итоговый файл склеивает хранилище, при ошибке загрузка отменяется.
+ */
+async function uploadChunked(
   file: File,
+  contentType: string,
+  filename: string,
   onProgress?: (percent: number) => void
 ): Promise<string> {
-  const uploadId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
-  const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
-  const contentType = file.type || 'application/octet-stream';
-  const filename = file.name || 'file';
+  const totalChunks = Math.max(1, Math.ceil(file.size / CHUNK_SIZE));
 
   onProgress?.(2);
 
-  for (let i = 0; i < totalChunks; i++) {
-    const start = i * CHUNK_SIZE;
-    const end = Math.min(start + CHUNK_SIZE, file.size);
-    const chunk = file.slice(start, end);
-    const buffer = await chunk.arrayBuffer();
-    const chunkB64 = toBase64(buffer);
-
-    const resp = await fetch(
-      `${UPLOAD_VIDEO_URL}?action=chunk&uploadId=${uploadId}&part=${i}`,
-      {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ chunk: chunkB64 }),
-      }
-    );
+  const { uploadId, key } = await postJson(
+    `${UPLOAD_VIDEO_URL}?action=init`,
+    { filename, contentType },
+    'Не удалось начать загрузку'
+  );
 
-    if (!resp.ok) {
-      let msg = `Ошибка загрузки части ${i + 1}`;
-      try { const e = await resp.json(); msg = e.error || msg; } catch { /* ignore */ }
-      throw new Error(msg);
+  try {
+    const parts: UploadedPart[] = [];
+    for (let i = 0; i < totalChunks; i++) {
+      const start = i * CHUNK_SIZE;
+      const end = Math.min(start + CHUNK_SIZE, file.size);
+      const buffer = await file.slice(start, end).arrayBuffer();
+      const last = i === totalChunks - 1 ? '&last=1' : '';
+
+      const result = await postJson(
+        `${UPLOAD_VIDEO_URL}?action=chunk&uploadId=${encodeURIComponent(uploadId)}&key=${encodeURIComponent(key)}&part=${i}${last}`,
+        { chunk: toBase64(buffer) },
+        `Ошибка загрузки части ${i + 1}`
+      );
+      if (result.part) parts.push(result.part);
+
+      onProgress?.(2 + Math.round(((i + 1) / totalChunks) * 88));
     }
 
-    onProgress?.(2 + Math.round(((i + 1) / totalChunks) * 88));
-  }
-
-  const completeResp = await fetch(
-    `${UPLOAD_VIDEO_URL}?action=complete`,
-    {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ uploadId, filename, contentType, totalParts: totalChunks }),
-    }
-  );
+    const result = await postJson(
+      `${UPLOAD_VIDEO_URL}?action=complete`,
+      { uploadId, key, parts },
+      'Ошибка финализации загрузки'
+    );
+    if (!result.url) throw new Error('Нет URL в ответе');
 
-  if (!completeResp.ok) {
-    let msg = 'Ошибка финализации загрузки';
-    try { const e = await completeResp.json(); msg = e.error || msg; } catch { /* ignore */ }
-    throw new Error(msg);
+    onProgress?.(100);
+    return result.url;
+  } catch (err) {
+    postJson(`${UPLOAD_VIDEO_URL}?action=abort`, { uploadId, key }, '').catch(() => { /* ignore */ });
+    throw err;
   }
+}
 
-  const result = await completeResp.json();
-  if (!result.url) throw new Error('Нет URL в ответе');
-
-  onProgress?.(100);
-  return result.url;
+export async function uploadFileChunked(
+  file: File,
+  onProgress?: (percent: number) => void
+): Promise<string> {
+  return uploadChunked(file, file.type || 'application/octet-stream', file.name || 'file', onProgress);
 }
 
 export async function uploadVideoMultipart(
   file: File,
   onProgress?: (percent: number) => void
 ): Promise<string> {
-  const uploadId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
-  const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
-  const contentType = file.type || 'video/mp4';
-  const filename = file.name || 'video.mp4';
-
-  onProgress?.(2);
-
-  for (let i = 0; i < totalChunks; i++) {
-    const start = i * CHUNK_SIZE;
-    const end = Math.min(start + CHUNK_SIZE, file.size);
-    const chunk = file.slice(start, end);
-    const buffer = await chunk.arrayBuffer();
-    const chunkB64 = toBase64(buffer);
-
-    const resp = await fetch(
-      `${UPLOAD_VIDEO_URL}?action=chunk&uploadId=${uploadId}&part=${i}`,
-      {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ chunk: chunkB64 }),
-      }
-    );
-
-    if (!resp.ok) {
-      let msg = `Ошибка загрузки части ${i + 1}`;
-      try { const e = await resp.json(); msg = e.error || msg; } catch { /* ignore */ }
-      throw new Error(msg);
-    }
-
-    onProgress?.(2 + Math.round(((i + 1) / totalChunks) * 88));
-  }
-
-  const completeResp = await fetch(
-    `${UPLOAD_VIDEO_URL}?action=complete`,
-    {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ uploadId, filename, contentType, totalParts: totalChunks }),
-    }
-  );
-
-  if (!completeResp.ok) {
-    let msg = 'Ошибка финализации загрузки';
-    try { const e = await completeResp.json(); msg = e.error || msg; } catch { /* ignore */ }
-    throw new Error(msg);
-  }
-
-  const result = await completeResp.json();
-  if (!result.url) throw new Error('Нет URL в ответе');
-
-  onProgress?.(100);
-  return result.url;
-}
\ No newline at end of file
+  return uploadChunked(file, file.type || 'video/mp4', file.name || 'video.mp4', onProgress);
+}